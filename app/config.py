@@ -1,3 +1,4 @@
+from typing import Literal
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -6,6 +7,135 @@ class Settings(BaseSettings):
     debug: bool = False
     base_url: str = "http://localhost:8000"
     
+    # Фоновая запись событий
+    # direct — сразу в events; staging — в events_staging с периодическим переносом
+    event_ingest_mode: Literal["direct", "staging"] = "direct"
+    staging_move_interval: float = 1.0
+    staging_move_batch: int = 10000
+    event_queue_size: int = 10000
+    event_batch_size: int = 500
+    event_flush_interval: float = 0.5
+    
+    # Период записи HyperLogLog скетчей уникальных email в БД (секунды)
+    sketch_flush_interval: float = 5.0
+    
+    # Выгрузки: отдельный пул (можно направить на реплику) и лимит параллельных выгрузок
+    export_database_url: str | None = None
+    export_max_concurrent: int = 2
+    export_chunk_size: int = 5000
+    
+    # Максимум доменов в одном bulk-обновлении emails-sent
+    emails_sent_bulk_max: int = 10000
+    # Окно накопления приращений emails_sent перед записью (секунды)
+    emails_sent_flush_interval: float = 1.0
+    
+    # Фоновые задачи: число воркеров, период опроса очереди и через сколько
+    # секунд без обновлений running-задача считается брошенной
+    job_workers: int = 2
+    job_poll_interval: float = 2.0
+    job_stale_after: float = 300.0
+    job_chunk_size: int = 1000
+    job_batch_pause: float = 0.05
+    
+    # Кэш offer_url для редиректов (секунды до фонового обновления)
+    offer_cache_ttl: float = 60.0
+    # Сколько секунд помнить, что кампании нет: поток запросов с
+    # несуществующими id не должен каждый раз обращаться к БД
+    offer_cache_miss_ttl: float = 10.0
+    # Сколько офферов выводить в выпадающем списке; в больших справочниках
+    # остальные находятся поиском по началу названия
+    offer_select_limit: int = 200
+    
+    # Ограничения extra_params: лишние ключи отбрасываются, длинные значения обрезаются
+    extra_params_max_keys: int = 20
+    extra_params_max_key_length: int = 64
+    extra_params_max_value_length: int = 256
+    # Параметры, которые сохраняются всегда и доступны в фильтрах дашборда
+    extra_params_promoted: list[str] = [
+        "source", "utm_source", "utm_medium", "utm_campaign", "utm_content", "utm_term"
+    ]
+    
+    # Лимит частоты приема событий (token bucket): токенов в секунду и размер
+    # корзины по IP клиента и по кампании; число ключей в памяти на область
+    rate_limit_enabled: bool = True
+    rate_limit_ip_rate: float = 20.0
+    rate_limit_ip_burst: float = 100.0
+    rate_limit_campaign_rate: float = 1000.0
+    rate_limit_campaign_burst: float = 5000.0
+    rate_limit_max_keys: int = 100000
+    # Отдельные корзины редиректов и пикселей: всплеск открытий после
+    # рассылки не должен отнимать лимит конверсий, а прокси картинок
+    # почтовых сервисов ходят с немногих общих IP
+    rate_limit_tracking_ip_rate: float = 200.0
+    rate_limit_tracking_ip_burst: float = 2000.0
+    rate_limit_tracking_campaign_rate: float = 10000.0
+    rate_limit_tracking_campaign_burst: float = 50000.0
+    # Подсети серверов, которые шлют события с лендингов (landing_click,
+    # conversion, unsubscribe): на них не действует лимит по IP
+    rate_limit_exempt_networks: list[str] = []
+    
+    # Обратные прокси (CIDR), от которых принимается X-Forwarded-For:
+    # за ними IP клиента берется из заголовка, а не из адреса подключения
+    trusted_proxies: list[str] = ["127.0.0.0/8", "::1/128"]
+    
+    # Фильтр ботов: подсети сканеров (CIDR) и минимальная задержка клика
+    # после отправки письма (секунды, по параметру sent_at в ссылке)
+    bot_filter_enabled: bool = True
+    bot_ip_ranges: list[str] = []
+    bot_min_click_delay: float = 5.0
+    
+    # Дашборд: отдельный пул подключений (основной пул остается приему событий),
+    # число одновременных запросов и сколько секунд запрос ждет очереди
+    dashboard_pool_size: int = 5
+    dashboard_max_concurrent: int = 5
+    dashboard_queue_timeout: float = 2.0
+    # Устаревшие фрагменты, отдаваемые при перегрузке вместо 503
+    dashboard_stale_cache_size: int = 500
+    dashboard_stale_max_age: float = 600.0
+    # Сжатие ответов (gzip или brotli при установленном пакете brotli):
+    # минимальный размер тела в байтах и уровни сжатия
+    compression_min_size: int = 1024
+    compression_gzip_level: int = 6
+    compression_brotli_quality: int = 4
+    
+    # Индекс отписок для проверки перед отправкой: период опроса новых отписок
+    # (секунды), сколько id перечитывать до последнего прочитанного, размер
+    # пачки опроса и максимум адресов в одной пакетной проверке
+    suppression_poll_interval: float = 5.0
+    suppression_poll_lookback: int = 50000
+    suppression_poll_batch: int = 10000
+    suppression_check_batch_max: int = 10000
+    
+    # Шаблоны: каталог кэша байткода Jinja2 (пусто — без кэша), с какого
+    # числа строк таблицы фрагмент рендерится потоково и размер куска (символы)
+    template_cache_dir: str = "data/template_cache"
+    template_stream_min_rows: int = 100
+    template_stream_chunk_size: int = 16384
+    
+    # Список кампаний на главной: строк на страницу; период и пачка свертки
+    # приращений счетчиков кампаний
+    campaigns_page_size: int = 50
+    campaign_counters_rollup_interval: float = 2.0
+    campaign_counters_rollup_batch: int = 10000
+    
+    # Локальный журнал событий на время недоступности БД: каталог, размер
+    # сегмента (байты), период fsync и воспроизведения в БД (секунды)
+    spool_dir: str = "data/spool"
+    spool_segment_bytes: int = 16 * 1024 * 1024
+    spool_fsync_interval: float = 0.2
+    spool_replay_interval: float = 5.0
+    spool_replay_batch: int = 5000
+    
+    # Сырые события старше этого числа дней задача compact_events сворачивает
+    # в дневные агрегаты и пути получателей, после чего удаляет
+    raw_retention_days: int = 90
+    
+    # Холодный архив событий кампаний (Parquet, нужен pyarrow): каталог и
+    # сколько прочитанных таблиц и результатов агрегаций держать в памяти
+    archive_dir: str = "data/archive"
+    archive_table_cache_size: int = 8
+    archive_result_cache_size: int = 1000
+    
     model_config = SettingsConfigDict(
         env_file=".env",
         env_file_encoding="utf-8",
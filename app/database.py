@@ -2,21 +2,35 @@
 Настройка подключения к базе данных через SQLAlchemy
 """
 
+import asyncio
+from sqlalchemy.exc import InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 from app.config import settings
 from app.models.database import Base
 
 
+# Ошибки недоступности БД (в отличие от ошибок в данных запроса)
+DB_UNAVAILABLE_ERRORS = (
+    OperationalError, InterfaceError, PoolTimeoutError, OSError, asyncio.TimeoutError
+)
+
+
 class Database:
     """Класс для управления подключением к базе данных через SQLAlchemy"""
     
     def __init__(self):
         self.engine = None
+        self.export_engine = None
+        self.dashboard_engine = None
         self.async_session_maker: async_sessionmaker[AsyncSession] | None = None
+        self.dashboard_session_maker: async_sessionmaker[AsyncSession] | None = None
     
-    async def connect(self):
-        """Создает async engine и session maker"""
+    async def connect(self, ingest_only: bool = False):
+        """
+        Создает async engine и session maker. С ingest_only пулы выгрузок
+        и дашборда не создаются: ingest-приложение их не использует.
+        """
         if not self.engine:
             # Преобразуем postgresql:// в postgresql+asyncpg:// для asyncpg
             database_url = settings.database_url.replace(
@@ -36,6 +50,38 @@ class Database:
                 class_=AsyncSession,
                 expire_on_commit=False
             )
+            
+            if ingest_only:
+                return
+            
+            # Отдельный маленький пул для выгрузок, чтобы они не занимали
+            # подключения приема событий. Может указывать на реплику.
+            export_url = (settings.export_database_url or settings.database_url).replace(
+                "postgresql://", "postgresql+asyncpg://", 1
+            )
+            self.export_engine = create_async_engine(
+                export_url,
+                echo=False,
+                pool_size=settings.export_max_concurrent,
+                max_overflow=0,
+                pool_pre_ping=True
+            )
+            
+            # Пул страниц дашборда: при всплеске обновлений они ждут своих
+            # подключений и не отнимают их у приема событий
+            self.dashboard_engine = create_async_engine(
+                database_url,
+                echo=False,
+                pool_size=settings.dashboard_pool_size,
+                max_overflow=0,
+                pool_timeout=settings.dashboard_queue_timeout,
+                pool_pre_ping=True
+            )
+            self.dashboard_session_maker = async_sessionmaker(
+                self.dashboard_engine,
+                class_=AsyncSession,
+                expire_on_commit=False
+            )
     
     async def disconnect(self):
         """Закрывает engine"""
@@ -43,6 +89,13 @@ class Database:
             await self.engine.dispose()
             self.engine = None
             self.async_session_maker = None
+        if self.export_engine:
+            await self.export_engine.dispose()
+            self.export_engine = None
+        if self.dashboard_engine:
+            await self.dashboard_engine.dispose()
+            self.dashboard_engine = None
+            self.dashboard_session_maker = None
     
 
 
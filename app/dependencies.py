@@ -2,20 +2,20 @@
 Dependencies для FastAPI
 """
 
-from typing import AsyncGenerator
-from sqlalchemy.ext.asyncio import AsyncSession
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, AsyncIterator
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from app.database import db
 
 
-async def get_db_session() -> AsyncGenerator[AsyncSession, None]:
-    """
-    Dependency для получения сессии базы данных.
-    Автоматически закрывает сессию после использования.
-    """
-    if not db.async_session_maker:
+@asynccontextmanager
+async def _session_scope(
+    session_maker: async_sessionmaker[AsyncSession] | None
+) -> AsyncIterator[AsyncSession]:
+    if not session_maker:
         raise RuntimeError("Database session maker is not initialized")
     
-    async with db.async_session_maker() as session:
+    async with session_maker() as session:
         try:
             yield session
             await session.commit()
@@ -24,3 +24,21 @@ async def get_db_session() -> AsyncGenerator[AsyncSession, None]:
             raise
         finally:
             await session.close()
+
+
+async def get_db_session() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Dependency для получения сессии базы данных.
+    Автоматически закрывает сессию после использования.
+    """
+    async with _session_scope(db.async_session_maker) as session:
+        yield session
+
+
+async def get_dashboard_session() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Сессия из отдельного пула страниц дашборда, чтобы тяжелые страницы
+    не занимали подключения приема событий.
+    """
+    async with _session_scope(db.dashboard_session_maker) as session:
+        yield session
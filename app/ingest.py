@@ -0,0 +1,61 @@
+"""
+Облегчённое ASGI-приложение только для приема событий.
+
+Не загружает Jinja2 шаблоны, статику, страницы дашборда и обработчики
+исключений основного приложения — только ingest endpoints и пул подключений
+к БД. Масштабируется независимо от дашборда:
+
+    uvicorn app.ingest:app --host 0.0.0.0 --port 8001
+"""
+
+from contextlib import asynccontextmanager
+import logging
+from fastapi import FastAPI
+from app.database import db
+from app.services.emails_sent import emails_sent_coalescer
+from app.services.event_writer import event_writer
+from app.services.offer_cache import offer_url_cache
+from app.services.sketches import sketch_store
+from app.services.spool import event_spool
+from app.services.staging import staging_mover
+from app.routers import api, metrics, tracking
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Управление жизненным циклом ingest-приложения"""
+    # Startup
+    await db.connect(ingest_only=True)
+    await offer_url_cache.warm()
+    await sketch_store.start()
+    await event_spool.start()
+    await event_writer.start()
+    await staging_mover.start()
+    await emails_sent_coalescer.start()
+    yield
+    # Shutdown
+    await emails_sent_coalescer.stop()
+    await event_writer.stop()
+    await staging_mover.stop()
+    await event_spool.stop()
+    await sketch_store.stop()
+    await db.disconnect()
+
+
+# Без OpenAPI схемы и /docs: она не нужна ingest-воркерам и замедляет старт
+app = FastAPI(
+    title="Click Tracker Ingest",
+    lifespan=lifespan,
+    openapi_url=None,
+    docs_url=None,
+    redoc_url=None
+)
+
+app.include_router(api.router)
+app.include_router(tracking.router)
+app.include_router(metrics.router)
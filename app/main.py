@@ -2,11 +2,21 @@ from contextlib import asynccontextmanager
 import logging
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
-from fastapi.staticfiles import StaticFiles
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from app.database import db
-from app.routers import api, pages
+from app.middleware import CompressionMiddleware, DashboardAdmissionMiddleware
+from app.services.campaign_counters import campaign_counters_rollup
+from app.services.emails_sent import emails_sent_coalescer
+from app.services.event_writer import event_writer
+from app.services.jobs import job_runner
+from app.services.offer_cache import offer_url_cache
+from app.services.sketches import sketch_store
+from app.services.spool import event_spool
+from app.services.staging import staging_mover
+from app.services.suppression import suppression_index
+from app.static_assets import STATIC_DIR, FingerprintedStaticFiles, static_manifest
+from app.routers import api, exports, jobs, metrics, pages, suppression, tracking
 
 # Настройка логирования
 logging.basicConfig(
@@ -21,8 +31,25 @@ async def lifespan(app: FastAPI):
     """Управление жизненным циклом приложения"""
     # Startup
     await db.connect()
+    await offer_url_cache.warm()
+    await sketch_store.start()
+    await event_spool.start()
+    await event_writer.start()
+    await staging_mover.start()
+    await emails_sent_coalescer.start()
+    await campaign_counters_rollup.start()
+    await job_runner.start()
+    await suppression_index.start()
     yield
     # Shutdown
+    await suppression_index.stop()
+    await job_runner.stop()
+    await campaign_counters_rollup.stop()
+    await emails_sent_coalescer.stop()
+    await event_writer.stop()
+    await staging_mover.stop()
+    await event_spool.stop()
+    await sketch_store.stop()
     await db.disconnect()
 
 
@@ -65,7 +92,8 @@ async def http_exception_handler(request: Request, exc: StarletteHTTPException):
     )
     return JSONResponse(
         status_code=exc.status_code,
-        content={"detail": exc.detail}
+        content={"detail": exc.detail},
+        headers=getattr(exc, "headers", None)
     )
 
 
@@ -82,9 +110,21 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
     )
 
 
-# Подключаем статические файлы
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Ограничение параллельных запросов дашборда (прием событий не затрагивается)
+app.add_middleware(DashboardAdmissionMiddleware)
+
+# Сжатие ответов; подключено последним, поэтому внешнее: кэш устаревших
+# фрагментов дашборда хранит несжатые тела
+app.add_middleware(CompressionMiddleware)
+
+# Подключаем статические файлы (имена с отпечатком кэшируются навсегда)
+app.mount("/static", FingerprintedStaticFiles(directory=STATIC_DIR, manifest=static_manifest), name="static")
 
 # Подключаем роутеры
 app.include_router(api.router)
+app.include_router(suppression.router)
+app.include_router(tracking.router)
 app.include_router(pages.router)
+app.include_router(exports.router)
+app.include_router(jobs.router)
+app.include_router(metrics.router)
@@ -0,0 +1,287 @@
+"""
+ASGI middleware основного приложения
+"""
+
+import asyncio
+import json
+import logging
+import time
+import zlib
+from collections import OrderedDict
+from starlette.datastructures import Headers, MutableHeaders
+from app.config import settings
+from app.services.metrics import metrics
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli опционален
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Пути приема событий и служебные пути, на которые не действует
+# ограничение дашборда; у выгрузок свои слоты и пул
+UNLIMITED_PATH_PREFIXES = ("/api/", "/r/", "/o/", "/static/", "/metrics")
+
+# Типы ответов, которые сжимаются; изображения и архивы уже сжаты
+COMPRESSIBLE_TYPES = (
+    "text/html", "text/css", "text/plain", "text/csv",
+    "application/json", "application/javascript", "text/javascript"
+)
+
+# Ответы без тела и частичные ответы не сжимаются
+UNCOMPRESSED_STATUSES = (204, 206, 304)
+
+# Тела крупнее этого сжимаются в потоке, чтобы не занимать цикл событий
+COMPRESS_IN_THREAD_SIZE = 64 * 1024
+
+compressed_responses = metrics.counter(
+    "http_compressed_responses_total",
+    "Ответы, сжатые middleware, по кодированию",
+    labels=("encoding",)
+)
+
+dashboard_shed = metrics.counter(
+    "dashboard_shed_total",
+    "Запросы дашборда, не дождавшиеся очереди: отданы устаревшими или отклонены",
+    labels=("result",)
+)
+
+
+def is_dashboard_path(path: str) -> bool:
+    return not path.startswith(UNLIMITED_PATH_PREFIXES) and "/export/" not in path
+
+
+class DashboardAdmissionMiddleware:
+    """
+    Ограничивает число одновременных запросов дашборда семафором.
+    Запрос ждет свободного слота не дольше settings.dashboard_queue_timeout;
+    не дождавшийся получает последний успешный ответ на тот же GET
+    (не старше dashboard_stale_max_age, с заголовком X-Served-Stale) или 503.
+    HTMX не заменяет фрагмент при 503, так что опрос статистики просто
+    пропускает обновление.
+    """
+
+    # Фрагменты больше этого размера не запоминаются
+    MAX_STALE_BODY = 1024 * 1024
+
+    def __init__(self, app):
+        self.app = app
+        self._slots = asyncio.Semaphore(settings.dashboard_max_concurrent)
+        # ключ запроса -> (время, заголовки, тело)
+        self._stale: OrderedDict[str, tuple[float, list, bytes]] = OrderedDict()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not is_dashboard_path(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await asyncio.wait_for(self._slots.acquire(), settings.dashboard_queue_timeout)
+        except asyncio.TimeoutError:
+            await self._shed(scope, send)
+            return
+
+        try:
+            if scope["method"] == "GET":
+                await self.app(scope, receive, self._remembering_send(scope, send))
+            else:
+                await self.app(scope, receive, send)
+        finally:
+            self._slots.release()
+
+    def _remembering_send(self, scope, send):
+        """Пропускает ответ клиенту и запоминает копию успешного HTML ответа"""
+        key = _request_key(scope)
+        state = {"headers": None, "chunks": [], "size": 0}
+
+        async def wrapped(message):
+            if message["type"] == "http.response.start":
+                headers = message.get("headers", [])
+                content_type = dict(headers).get(b"content-type", b"")
+                if message["status"] == 200 and content_type.startswith(b"text/html"):
+                    state["headers"] = headers
+            elif message["type"] == "http.response.body" and state["headers"] is not None:
+                body = message.get("body", b"")
+                state["size"] += len(body)
+                if state["size"] > self.MAX_STALE_BODY:
+                    state["headers"] = None
+                    state["chunks"] = []
+                else:
+                    state["chunks"].append(body)
+                    if not message.get("more_body"):
+                        self._remember(key, state["headers"], b"".join(state["chunks"]))
+            await send(message)
+
+        return wrapped
+
+    def _remember(self, key: str, headers: list, body: bytes):
+        self._stale[key] = (time.monotonic(), headers, body)
+        self._stale.move_to_end(key)
+        while len(self._stale) > settings.dashboard_stale_cache_size:
+            self._stale.popitem(last=False)
+
+    async def _shed(self, scope, send):
+        entry = self._stale.get(_request_key(scope)) if scope["method"] == "GET" else None
+        if entry and time.monotonic() - entry[0] <= settings.dashboard_stale_max_age:
+            dashboard_shed.inc("stale")
+            _, headers, body = entry
+            headers = [
+                (name, value) for name, value in headers
+                if name not in (b"content-length", b"x-served-stale")
+            ]
+            headers += [(b"content-length", str(len(body)).encode()), (b"x-served-stale", b"1")]
+            await send({"type": "http.response.start", "status": 200, "headers": headers})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        dashboard_shed.inc("rejected")
+        logger.warning(f"Dashboard overloaded, rejected {scope['method']} {scope['path']}")
+        body = json.dumps({"detail": "Dashboard is overloaded, retry later"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", b"5")
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def _request_key(scope) -> str:
+    query = scope.get("query_string", b"").decode("latin-1")
+    return f"{scope['path']}?{query}"
+
+
+class CompressionMiddleware:
+    """
+    Сжимает HTML, JSON, CSS и JS ответы по Accept-Encoding клиента: brotli,
+    если установлен пакет brotli, иначе gzip. Ответы меньше
+    compression_min_size и уже сжатые ответы отдаются как есть. Ответ одним
+    сообщением сжимается целиком с новым Content-Length; потоковый — по
+    частям со сбросом буфера после каждой, чтобы клиент получал данные без
+    задержки.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _CompressingSend(send, encoding))
+
+
+def negotiate_encoding(accept_encoding: str) -> str | None:
+    """Выбирает br или gzip по заголовку Accept-Encoding (с учетом q=0)"""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    wildcard = accepted.get("*", 0.0)
+    if brotli is not None and accepted.get("br", wildcard) > 0:
+        return "br"
+    if accepted.get("gzip", wildcard) > 0:
+        return "gzip"
+    return None
+
+
+class _Compressor:
+    """Потоковый компрессор gzip или brotli с общим интерфейсом"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=settings.compression_brotli_quality)
+        else:
+            # wbits=31: формат gzip с заголовком и CRC
+            self._zlib = zlib.compressobj(settings.compression_gzip_level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        if self.encoding == "br":
+            output = self._brotli.process(data)
+            return output + (self._brotli.finish() if final else self._brotli.flush())
+        output = self._zlib.compress(data)
+        return output + self._zlib.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class _CompressingSend:
+    """send, который придерживает начало ответа до первого тела и сжимает тело"""
+
+    def __init__(self, send, encoding: str):
+        self.send = send
+        self.encoding = encoding
+        self.start: dict | None = None
+        self.compressor: _Compressor | None = None
+        self.passthrough = False
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            headers = Headers(raw=message.get("headers", []))
+            content_type = headers.get("content-type", "")
+            if (
+                message["status"] in UNCOMPRESSED_STATUSES
+                or "content-encoding" in headers
+                or not content_type.startswith(COMPRESSIBLE_TYPES)
+            ):
+                self.passthrough = True
+                await self.send(message)
+            else:
+                self.start = message
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.start is not None:
+            start, self.start = self.start, None
+            headers = MutableHeaders(raw=list(start.get("headers", [])))
+            headers.add_vary_header("Accept-Encoding")
+            if not more_body and len(body) < settings.compression_min_size:
+                self.passthrough = True
+                await self.send({**start, "headers": headers.raw})
+                await self.send(message)
+                return
+
+            self.compressor = _Compressor(self.encoding)
+            headers["content-encoding"] = self.encoding
+            compressed_responses.inc(self.encoding)
+            if not more_body:
+                body = await self._compress(body, final=True)
+                headers["content-length"] = str(len(body))
+                await self.send({**start, "headers": headers.raw})
+                await self.send({"type": "http.response.body", "body": body})
+                return
+            # Длина потокового ответа заранее неизвестна
+            if "content-length" in headers:
+                del headers["content-length"]
+            await self.send({**start, "headers": headers.raw})
+
+        await self.send({
+            "type": "http.response.body",
+            "body": await self._compress(body, final=not more_body),
+            "more_body": more_body
+        })
+
+    async def _compress(self, data: bytes, final: bool) -> bytes:
+        if len(data) >= COMPRESS_IN_THREAD_SIZE:
+            return await asyncio.to_thread(self.compressor.compress, data, final)
+        return self.compressor.compress(data, final)
@@ -5,8 +5,9 @@ SQLAlchemy модели для базы данных
 from datetime import datetime
 from sqlalchemy import (
     Column, Integer, String, Text, ForeignKey, 
-    DateTime, JSON, UniqueConstraint, Index
+    Date, DateTime, JSON, UniqueConstraint, Index, LargeBinary, BigInteger, Boolean
 )
+from sqlalchemy.dialects.postgresql import JSONB, UUID
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -23,8 +24,9 @@ class Offer(Base):
     url = Column(Text, nullable=False)
     created_at = Column(DateTime, server_default=func.now(), nullable=False)
     
-    # Связи
-    campaigns = relationship("Campaign", back_populates="offer", cascade="all, delete-orphan")
+    # Связи. passive_deletes: ORM не загружает кампании при удалении,
+    # удаление выполняется пачками (см. app/services/deletion.py)
+    campaigns = relationship("Campaign", back_populates="offer", cascade="all, delete-orphan", passive_deletes=True)
 
 
 class Campaign(Base):
@@ -34,13 +36,20 @@ class Campaign(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), nullable=False)
     offer_url = Column(Text, nullable=False)
-    offer_id = Column(Integer, ForeignKey("offers.id"), nullable=True, index=True)
+    offer_id = Column(Integer, ForeignKey("offers.id", ondelete="CASCADE"), nullable=True, index=True)
     created_at = Column(DateTime, server_default=func.now(), nullable=False)
+    # Время постановки кампании на удаление; такие кампании не принимают события
+    deleted_at = Column(DateTime, nullable=True)
     
-    # Связи
+    # Связи. passive_deletes: ORM не загружает события при удалении кампании,
+    # их удаляет БД (ON DELETE CASCADE) или пачками задача удаления
     offer = relationship("Offer", back_populates="campaigns")
-    events = relationship("Event", back_populates="campaign", cascade="all, delete-orphan")
-    domain_emails = relationship("CampaignDomainEmails", back_populates="campaign", cascade="all, delete-orphan")
+    events = relationship("Event", back_populates="campaign", cascade="all, delete-orphan", passive_deletes=True)
+    domain_emails = relationship("CampaignDomainEmails", back_populates="campaign", cascade="all, delete-orphan", passive_deletes=True)
+    
+    __table_args__ = (
+        Index("idx_campaigns_created_at", "created_at", "id"),
+    )
 
 
 class Event(Base):
@@ -48,13 +57,17 @@ class Event(Base):
     __tablename__ = "events"
     
     id = Column(Integer, primary_key=True, index=True)
-    campaign_id = Column(Integer, ForeignKey("campaigns.id"), nullable=False, index=True)
+    campaign_id = Column(Integer, ForeignKey("campaigns.id", ondelete="CASCADE"), nullable=False, index=True)
     event_type = Column(String(50), nullable=False)
     email = Column(String(255), nullable=False, index=True)
     domain = Column(String(255), nullable=False, index=True)
     ip = Column(String(45), nullable=True)
     user_agent = Column(Text, nullable=True)
-    extra_params = Column(JSON, nullable=True)
+    extra_params = Column(JSONB, nullable=True)
+    # Ключ события, назначаемый при приеме: защищает от дублей при повторной записи
+    event_key = Column(UUID(as_uuid=True), nullable=True)
+    # Событие от сканера ссылок или префетчера, не учитывается в статистике
+    is_bot = Column(Boolean, nullable=False, default=False, server_default="false")
     created_at = Column(DateTime, server_default=func.now(), nullable=False, index=True)
     
     # Связи
@@ -65,9 +78,97 @@ class Event(Base):
         Index("idx_events_email", "email"),
         Index("idx_events_domain", "domain"),
         Index("idx_events_created_at", "created_at"),
+        Index("idx_events_campaign_created_at", "campaign_id", "created_at"),
+        Index(
+            "idx_events_event_key", "event_key",
+            unique=True,
+            postgresql_where=event_key.isnot(None)
+        ),
+        # Опрос новых отписок (app/services/suppression.py)
+        Index(
+            "idx_events_unsubscribe", "id",
+            postgresql_where=event_type == "unsubscribe"
+        ),
+        # Фильтр по параметрам через extra_params @> '{"utm_source": "..."}'
+        Index(
+            "idx_events_extra_params", "extra_params",
+            postgresql_using="gin",
+            postgresql_ops={"extra_params": "jsonb_path_ops"},
+            postgresql_where=extra_params.isnot(None)
+        ),
     )
 
 
+class EventStaging(Base):
+    """
+    Промежуточная таблица приема событий (UNLOGGED, минимум индексов).
+    Периодически переносится в events пачками.
+    """
+    __tablename__ = "events_staging"
+    
+    id = Column(BigInteger, primary_key=True)
+    campaign_id = Column(Integer, nullable=False)
+    event_type = Column(String(50), nullable=False)
+    email = Column(String(255), nullable=False)
+    domain = Column(String(255), nullable=False)
+    ip = Column(String(45), nullable=True)
+    user_agent = Column(Text, nullable=True)
+    extra_params = Column(JSONB, nullable=True)
+    event_key = Column(UUID(as_uuid=True), nullable=True)
+    is_bot = Column(Boolean, nullable=False, default=False, server_default="false")
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+    
+    __table_args__ = (
+        Index("idx_events_staging_campaign", "campaign_id"),
+        {"prefixes": ["UNLOGGED"]},
+    )
+
+
+class CampaignCounters(Base):
+    """
+    Счетчики кампании для списка на главной. Триггер events_campaign_counters
+    пишет приращения в campaign_counter_deltas, их сворачивает
+    app/services/campaign_counters.py (см. init.sql)
+    """
+    __tablename__ = "campaign_counters"
+    
+    campaign_id = Column(Integer, ForeignKey("campaigns.id", ondelete="CASCADE"), primary_key=True)
+    clicks = Column(BigInteger, nullable=False, default=0, server_default="0")
+    conversions = Column(BigInteger, nullable=False, default=0, server_default="0")
+    updated_at = Column(DateTime, server_default=func.now(), nullable=False)
+    
+    __table_args__ = (
+        Index("idx_campaign_counters_clicks", "clicks", "campaign_id"),
+        Index("idx_campaign_counters_conversions", "conversions", "campaign_id"),
+        Index("idx_campaign_counters_updated_at", "updated_at"),
+    )
+
+
+class EventDailyCount(Base):
+    """Дневной счетчик сжатых событий кампании по домену и типу (без ботов)"""
+    __tablename__ = "event_daily_counts"
+    
+    campaign_id = Column(Integer, ForeignKey("campaigns.id", ondelete="CASCADE"), primary_key=True)
+    domain = Column(String(255), primary_key=True)
+    event_type = Column(String(50), primary_key=True)
+    day = Column(Date, primary_key=True)
+    count = Column(BigInteger, nullable=False)
+
+
+class RecipientJourney(Base):
+    """Путь получателя кампании по сжатым событиям"""
+    __tablename__ = "recipient_journeys"
+    
+    campaign_id = Column(Integer, ForeignKey("campaigns.id", ondelete="CASCADE"), primary_key=True)
+    email = Column(String(255), primary_key=True)
+    domain = Column(String(255), primary_key=True)
+    has_email_click = Column(Boolean, nullable=False, default=False)
+    has_landing_click = Column(Boolean, nullable=False, default=False)
+    has_conversion = Column(Boolean, nullable=False, default=False)
+    has_unsubscribe = Column(Boolean, nullable=False, default=False)
+    first_event = Column(DateTime, nullable=False)
+
+
 class CampaignDomainEmails(Base):
     """Модель для хранения количества отправленных писем по доменам"""
     __tablename__ = "campaign_domain_emails"
@@ -87,3 +188,38 @@ class CampaignDomainEmails(Base):
         Index("idx_campaign_domain_emails_campaign", "campaign_id"),
         Index("idx_campaign_domain_emails_domain", "domain"),
     )
+
+
+class CampaignSketch(Base):
+    """HyperLogLog скетч уникальных email кампании (domain='') или домена кампании"""
+    __tablename__ = "campaign_sketches"
+    
+    campaign_id = Column(Integer, ForeignKey("campaigns.id", ondelete="CASCADE"), primary_key=True)
+    domain = Column(String(255), primary_key=True, default="")
+    registers = Column(LargeBinary, nullable=False)
+    # В строке кампании: скетчи учитывают все ее события
+    complete = Column(Boolean, nullable=False, default=False, server_default="false")
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
+
+
+class Job(Base):
+    """Фоновая задача обслуживания (пересчеты, массовые удаления и т.п.)"""
+    __tablename__ = "jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String(50), nullable=False)
+    params = Column(JSON, nullable=True)
+    # pending -> running -> done | failed
+    status = Column(String(20), nullable=False, default="pending")
+    progress = Column(BigInteger, nullable=False, default=0)
+    total = Column(BigInteger, nullable=True)
+    message = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
+    
+    __table_args__ = (
+        Index("idx_jobs_status", "status", "id"),
+    )
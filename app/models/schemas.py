@@ -2,6 +2,9 @@ from datetime import datetime
 from typing import Any
 from pydantic import BaseModel, Field
 
+# Предел колонок INTEGER (campaign_domain_emails.emails_sent, id кампаний)
+INT32_MAX = 2_147_483_647
+
 
 class CampaignCreate(BaseModel):
     name: str = Field(..., min_length=1, max_length=255)
@@ -35,7 +38,8 @@ class EventCreate(BaseModel):
 
 class EventResponse(BaseModel):
     status: str
-    event_id: int
+    # None, если БД недоступна и событие сохранено в локальный журнал
+    event_id: int | None = None
 
 
 class OverallStats(BaseModel):
@@ -63,4 +67,32 @@ class UserJourney(BaseModel):
 
 
 class DomainEmailsSentUpdate(BaseModel):
-    emails_sent: int = Field(..., ge=0, description="Количество отправленных писем с домена")
+    emails_sent: int = Field(..., ge=0, le=INT32_MAX, description="Количество отправленных писем с домена")
+
+
+class DomainEmailsSentItem(BaseModel):
+    domain: str = Field(..., min_length=1, max_length=255)
+    emails_sent: int = Field(..., ge=0, le=INT32_MAX, description="Количество отправленных писем с домена")
+
+
+class EmailsSentIncrement(BaseModel):
+    campaign_id: int = Field(..., alias="cid", gt=0, le=INT32_MAX)
+    domain: str = Field(..., min_length=1, max_length=255)
+    delta: int = Field(..., ge=0, le=INT32_MAX, description="Сколько писем отправлено с момента прошлого отчета")
+
+
+class SuppressionCheckResult(BaseModel):
+    email: str
+    campaign_id: int | None = None
+    suppressed: bool
+
+
+class SuppressionBatchCheck(BaseModel):
+    emails: list[str] = Field(..., min_length=1)
+    # Без кампании проверяется отписка от любой кампании
+    campaign_id: int | None = Field(None, alias="cid")
+
+
+class SuppressionBatchResult(BaseModel):
+    checked: int
+    suppressed: list[str]
@@ -1,12 +1,29 @@
+import logging
+from contextlib import suppress
 from fastapi import APIRouter, HTTPException, Request, Depends
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from sqlalchemy.orm import selectinload
-from app.models.schemas import EventResponse, DomainEmailsSentUpdate
+from app.config import settings
+from app.database import DB_UNAVAILABLE_ERRORS
+from app.models.schemas import (
+    EventResponse, DomainEmailsSentUpdate, DomainEmailsSentItem, EmailsSentIncrement
+)
 from app.models.database import Campaign, Event, CampaignDomainEmails
 from app.dependencies import get_db_session
+from app.services.emails_sent import (
+    EmailsSentMode, coalesce_counts, emails_sent_coalescer, upsert_emails_sent
+)
+from app.services.offer_cache import offer_url_cache
+from app.services.ingest import EVENT_TYPES, build_event, client_ip, ingest_model
+from app.services.rate_limit import ingest_rate_limiter
+from app.services.sketches import sketch_store
+from app.services.spool import event_spool
 import json
 
+logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api", tags=["api"])
 
 
@@ -22,56 +39,60 @@ async def track_event(
     """
     Принимает события от внешних сайтов.
     Все дополнительные query параметры сохраняются в extra_params.
+    Если БД недоступна, событие сохраняется в локальный журнал и
+    записывается позже (ответ 202 без event_id).
     """
     
-    if event not in ["email_click", "landing_click", "conversion", "unsubscribe"]:
+    if event not in EVENT_TYPES:
         raise HTTPException(
             status_code=400,
-            detail=f"Invalid event type: {event}. Must be one of: email_click, landing_click, conversion, unsubscribe"
+            detail=f"Invalid event type: {event}. Must be one of: {', '.join(EVENT_TYPES)}"
         )
     
-    # Проверяем существование кампании
-    result = await session.execute(
-        select(Campaign).where(Campaign.id == cid)
-    )
-    campaign = result.scalar_one_or_none()
-    
-    if not campaign:
+    # Лимит частоты по IP и кампании — до обращения к БД
+    retry_after = ingest_rate_limiter.check(client_ip(request), cid)
+    if retry_after:
         raise HTTPException(
-            status_code=404,
-            detail=f"Campaign with id {cid} not found"
+            status_code=429,
+            detail="Too many events, retry later",
+            headers={"Retry-After": str(retry_after)}
         )
     
-    # Извлекаем IP и User-Agent
-    client_ip = request.client.host if request.client else None
-    user_agent = request.headers.get("user-agent")
-    
-    # Собираем дополнительные параметры
-    extra_params = {}
-    query_params = dict(request.query_params)
-    
-    # Удаляем обязательные параметры из extra_params
-    for key in ["cid", "event", "email", "domain"]:
-        query_params.pop(key, None)
-    
-    if query_params:
-        extra_params = query_params
-    
-    # Создаем новое событие
-    new_event = Event(
-        campaign_id=cid,
-        event_type=event,
-        email=email,
-        domain=domain,
-        ip=client_ip,
-        user_agent=user_agent,
-        extra_params=extra_params if extra_params else None
-    )
-    
-    session.add(new_event)
-    await session.flush()
+    event_row = build_event(request, cid, event, email, domain)
     
-    return EventResponse(status="ok", event_id=new_event.id)
+    try:
+        # Проверяем существование кампании
+        result = await session.execute(
+            select(Campaign.id).where(Campaign.id == cid, Campaign.deleted_at.is_(None))
+        )
+        if result.scalar_one_or_none() is None:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Campaign with id {cid} not found"
+            )
+        
+        # Создаем новое событие; коммит здесь, чтобы сбой БД при коммите
+        # тоже привел к записи в журнал, а не к 500
+        new_event = ingest_model()(**event_row)
+        session.add(new_event)
+        await session.commit()
+    except DB_UNAVAILABLE_ERRORS:
+        logger.warning(f"Database unavailable, spooling event for campaign {cid}", exc_info=True)
+        with suppress(Exception):
+            await session.rollback()
+        # Существование кампании проверится при воспроизведении журнала
+        event_spool.append([event_row])
+        return JSONResponse({"status": "spooled", "event_id": None}, status_code=202)
+    
+    if not new_event.is_bot:
+        sketch_store.add(cid, domain, email)
+    
+    # Возвращаем готовый JSONResponse: FastAPI не валидирует и не
+    # сериализует ответ повторно через response_model
+    if isinstance(new_event, Event):
+        return JSONResponse({"status": "ok", "event_id": new_event.id})
+    # В режиме staging окончательный id появится после переноса в events
+    return JSONResponse({"status": "ok", "event_id": None})
 
 
 @router.put("/campaign/{campaign_id}/domain/{domain}/emails-sent")
@@ -88,7 +109,7 @@ async def update_domain_emails_sent(
     
     # Проверяем существование кампании
     result = await session.execute(
-        select(Campaign).where(Campaign.id == campaign_id)
+        select(Campaign).where(Campaign.id == campaign_id, Campaign.deleted_at.is_(None))
     )
     campaign = result.scalar_one_or_none()
     
@@ -98,28 +119,118 @@ async def update_domain_emails_sent(
             detail=f"Campaign with id {campaign_id} not found"
         )
     
-    # Проверяем, существует ли запись для этого домена и кампании
+    # Один UPSERT вместо SELECT + INSERT/UPDATE: без гонки между запросами
+    await upsert_emails_sent(session, {(campaign_id, domain): data.emails_sent}, "set")
+    
+    return {"status": "ok", "campaign_id": campaign_id, "domain": domain, "emails_sent": data.emails_sent}
+
+
+
+@router.put("/campaign/{campaign_id}/emails-sent")
+async def bulk_update_emails_sent(
+    request: Request,
+    campaign_id: int,
+    mode: EmailsSentMode = "set",
+    session: AsyncSession = Depends(get_db_session)
+):
+    """
+    Обновляет количество отправленных писем сразу для многих доменов кампании.
+    Тело — JSON объект {"domain": count, ...} или NDJSON (Content-Type:
+    application/x-ndjson) со строками {"domain": ..., "emails_sent": ...}.
+    mode=set перезаписывает значения, mode=increment прибавляет к текущим.
+    """
+    
+    items = await _read_emails_sent_items(request)
+    
+    if len(items) > settings.emails_sent_bulk_max:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many domains: at most {settings.emails_sent_bulk_max} per request"
+        )
+    
     result = await session.execute(
-        select(CampaignDomainEmails).where(
-            CampaignDomainEmails.campaign_id == campaign_id,
-            CampaignDomainEmails.domain == domain
+        select(Campaign.id).where(Campaign.id == campaign_id, Campaign.deleted_at.is_(None))
+    )
+    if result.scalar_one_or_none() is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Campaign with id {campaign_id} not found"
         )
+    
+    counts = coalesce_counts(
+        ((campaign_id, item.domain, item.emails_sent) for item in items),
+        mode
     )
-    existing = result.scalar_one_or_none()
-    
-    if existing:
-        # Обновляем существующую запись
-        existing.emails_sent = data.emails_sent
-        session.add(existing)
-    else:
-        # Создаем новую запись
-        new_record = CampaignDomainEmails(
-            campaign_id=campaign_id,
-            domain=domain,
-            emails_sent=data.emails_sent
+    await upsert_emails_sent(session, counts, mode)
+    
+    return {"status": "ok", "campaign_id": campaign_id, "mode": mode, "domains": len(counts)}
+
+
+async def _read_emails_sent_items(request: Request) -> list[DomainEmailsSentItem]:
+    """Разбирает тело bulk-запроса в JSON или NDJSON формате"""
+    body = await request.body()
+    content_type = request.headers.get("content-type", "")
+    
+    try:
+        if "ndjson" in content_type:
+            return _parse_ndjson(body, DomainEmailsSentItem)
+        
+        mapping = json.loads(body)
+        if not isinstance(mapping, dict):
+            raise ValueError("Expected a JSON object mapping domain to emails_sent")
+        return [
+            DomainEmailsSentItem(domain=domain, emails_sent=emails_sent)
+            for domain, emails_sent in mapping.items()
+        ]
+    except ValueError as e:
+        # ValidationError и JSONDecodeError наследуются от ValueError
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+
+@router.post("/emails-sent/increments", status_code=202)
+async def add_emails_sent_increments(request: Request):
+    """
+    Принимает приращения отправленных писем от MTA по многим кампаниям сразу.
+    Тело — JSON массив или NDJSON строк {"cid": ..., "domain": ..., "delta": ...}.
+    Приращения суммируются в памяти и записываются в БД пачкой раз в
+    emails_sent_flush_interval секунд.
+    """
+    
+    body = await request.body()
+    content_type = request.headers.get("content-type", "")
+    
+    try:
+        if "ndjson" in content_type:
+            items = _parse_ndjson(body, EmailsSentIncrement)
+        else:
+            payload = json.loads(body)
+            if not isinstance(payload, list):
+                raise ValueError("Expected a JSON array of increments")
+            items = [EmailsSentIncrement.model_validate(item) for item in payload]
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    
+    if len(items) > settings.emails_sent_bulk_max:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many increments: at most {settings.emails_sent_bulk_max} per request"
+        )
+    
+    # Существование кампаний проверяем по кэшу, в БД идем только при промахе
+    campaign_ids = {item.campaign_id for item in items}
+    unknown = [cid for cid in sorted(campaign_ids) if await offer_url_cache.resolve(cid) is None]
+    if unknown:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Campaigns not found: {', '.join(map(str, unknown))}"
         )
-        session.add(new_record)
     
-    await session.flush()
+    emails_sent_coalescer.add((item.campaign_id, item.domain, item.delta) for item in items)
     
-    return {"status": "ok", "campaign_id": campaign_id, "domain": domain, "emails_sent": data.emails_sent}
+    return {"status": "accepted", "increments": len(items)}
+
+
+def _parse_ndjson(body: bytes, model: type[BaseModel]) -> list:
+    """Разбирает NDJSON, пропуская пустые строки"""
+    return [model.model_validate_json(line) for line in body.splitlines() if line.strip()]
@@ -0,0 +1,70 @@
+"""
+Выгрузки данных кампании для аналитиков
+"""
+
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.dependencies import get_dashboard_session
+from app.models.database import Campaign
+from app.services.archive import archive_store
+from app.services.export import (
+    EXPORTS, Dataset, ExportFormat, export_chunks, export_slots, parquet_available
+)
+
+router = APIRouter(tags=["export"])
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet"
+}
+
+
+@router.get("/campaign/{campaign_id}/export/{dataset}")
+async def export_campaign(
+    campaign_id: int,
+    dataset: Dataset,
+    format: ExportFormat = "csv",
+    session: AsyncSession = Depends(get_dashboard_session)
+):
+    """
+    Потоковая выгрузка событий (events), статистики по доменам (domains)
+    или путей пользователей (journeys) кампании в CSV или Parquet.
+    Выгрузки без данных архива архивной кампании помечаются заголовком
+    X-Export-Partial.
+    """
+    
+    if format == "parquet" and not parquet_available():
+        raise HTTPException(status_code=501, detail="Parquet export requires pyarrow to be installed")
+    
+    result = await session.execute(select(Campaign.id).where(Campaign.id == campaign_id, Campaign.deleted_at.is_(None)))
+    if result.scalar_one_or_none() is None:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    
+    archived = bool(archive_store.parts(campaign_id))
+    if archived and EXPORTS[dataset].archived and archive_store.archiving(campaign_id):
+        # Строки части еще удаляются из БД: выгрузка содержала бы их дважды
+        raise HTTPException(
+            status_code=409,
+            detail="Campaign is being archived, try again later",
+            headers={"Retry-After": "30"}
+        )
+    
+    headers = {"Content-Disposition": f'attachment; filename="campaign-{campaign_id}-{dataset}.{format}"'}
+    if archived and not EXPORTS[dataset].archived:
+        headers["X-Export-Partial"] = "archive"
+    
+    # Все слоты заняты — не ставим выгрузку в очередь, а просим повторить позже
+    if export_slots.locked():
+        raise HTTPException(
+            status_code=429,
+            detail="Too many exports in progress, try again later",
+            headers={"Retry-After": "30"}
+        )
+    
+    return StreamingResponse(
+        export_chunks(campaign_id, dataset, format),
+        media_type=MEDIA_TYPES[format],
+        headers=headers
+    )
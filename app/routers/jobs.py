@@ -0,0 +1,198 @@
+"""
+Страницы фоновых задач и действия, которые ставят задачи в очередь
+"""
+
+from fastapi import APIRouter, Request, HTTPException, Form, Depends
+from fastapi.responses import HTMLResponse, RedirectResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import settings
+from app.dependencies import get_dashboard_session
+from app.models.database import Campaign, Job, Offer
+from app.services.archive import archive_available
+from app.services.compaction import compaction_cutoff
+from app.services.deletion import mark_campaigns_deleted
+from app.services.jobs import enqueue_job
+from app.templating import templates
+
+router = APIRouter(tags=["jobs"])
+
+# HTMX прекращает опрос, получив этот статус
+HTMX_STOP_POLLING = 286
+
+
+@router.get("/jobs", response_class=HTMLResponse)
+async def jobs_list(
+    request: Request,
+    session: AsyncSession = Depends(get_dashboard_session)
+):
+    """Страница со списком последних фоновых задач"""
+    jobs = await _recent_jobs(session)
+    return templates.TemplateResponse(
+        "jobs.html",
+        {
+            "request": request,
+            "jobs": jobs,
+            "compaction_cutoff": compaction_cutoff(settings.raw_retention_days)
+        }
+    )
+
+
+@router.get("/jobs/table", response_class=HTMLResponse)
+async def jobs_table(
+    request: Request,
+    session: AsyncSession = Depends(get_dashboard_session)
+):
+    """HTMX endpoint для обновления таблицы задач"""
+    jobs = await _recent_jobs(session)
+    return templates.TemplateResponse("partials/jobs_table.html", {"request": request, "jobs": jobs})
+
+
+@router.get("/job/{job_id}", response_class=HTMLResponse)
+async def job_detail(
+    request: Request,
+    job_id: int,
+    session: AsyncSession = Depends(get_dashboard_session)
+):
+    """Страница задачи с прогрессом"""
+    job = await _get_job(session, job_id)
+    return templates.TemplateResponse("job_detail.html", {"request": request, "job": job})
+
+
+@router.get("/job/{job_id}/status", response_class=HTMLResponse)
+async def job_status(
+    request: Request,
+    job_id: int,
+    session: AsyncSession = Depends(get_dashboard_session)
+):
+    """HTMX endpoint прогресса задачи; после завершения останавливает опрос"""
+    job = await _get_job(session, job_id)
+    response = templates.TemplateResponse("partials/job_status.html", {"request": request, "job": job})
+    if job.status in ("done", "failed"):
+        response.status_code = HTMX_STOP_POLLING
+    return response
+
+
+@router.post("/campaign/{campaign_id}/rebuild-sketches")
+async def rebuild_campaign_sketches(
+    request: Request,
+    campaign_id: int,
+    session: AsyncSession = Depends(get_dashboard_session)
+):
+    """Ставит в очередь пересчет скетчей уникальных получателей кампании"""
+    
+    result = await session.execute(select(Campaign.id).where(Campaign.id == campaign_id, Campaign.deleted_at.is_(None)))
+    if result.scalar_one_or_none() is None:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    
+    job = await enqueue_job(session, "rebuild_sketches", {"campaign_id": campaign_id})
+    return _redirect_to_job(request, job.id)
+
+
+@router.post("/jobs/compact-events")
+async def compact_events(
+    request: Request,
+    session: AsyncSession = Depends(get_dashboard_session)
+):
+    """Ставит в очередь сжатие сырых событий старше raw_retention_days в агрегаты"""
+    
+    job = await enqueue_job(session, "compact_events")
+    return _redirect_to_job(request, job.id)
+
+
+@router.post("/campaign/{campaign_id}/archive")
+async def archive_campaign(
+    request: Request,
+    campaign_id: int,
+    session: AsyncSession = Depends(get_dashboard_session)
+):
+    """Ставит в очередь перенос событий кампании в холодный архив"""
+    
+    if not archive_available():
+        raise HTTPException(status_code=501, detail="Campaign archive requires pyarrow to be installed")
+    
+    result = await session.execute(select(Campaign.id).where(Campaign.id == campaign_id, Campaign.deleted_at.is_(None)))
+    if result.scalar_one_or_none() is None:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    
+    job = await enqueue_job(session, "archive_campaign", {"campaign_id": campaign_id})
+    return _redirect_to_job(request, job.id)
+
+
+@router.post("/offer/{offer_id}/repoint")
+async def repoint_offer(
+    request: Request,
+    offer_id: int,
+    target_offer_id: int = Form(...),
+    session: AsyncSession = Depends(get_dashboard_session)
+):
+    """Ставит в очередь перенос всех кампаний оффера на другой оффер"""
+    
+    if target_offer_id == offer_id:
+        raise HTTPException(status_code=400, detail="Target offer must differ from the source offer")
+    
+    result = await session.execute(select(Offer.id).where(Offer.id.in_([offer_id, target_offer_id])))
+    if len(result.all()) != 2:
+        raise HTTPException(status_code=404, detail="Offer not found")
+    
+    job = await enqueue_job(
+        session, "repoint_offer", {"offer_id": offer_id, "target_offer_id": target_offer_id}
+    )
+    return _redirect_to_job(request, job.id)
+
+
+@router.post("/campaign/{campaign_id}/delete")
+async def delete_campaign(
+    request: Request,
+    campaign_id: int,
+    session: AsyncSession = Depends(get_dashboard_session)
+):
+    """
+    Помечает кампанию удаленной (она сразу перестает принимать события)
+    и ставит в очередь пакетное удаление ее данных.
+    """
+    
+    if not await mark_campaigns_deleted(session, Campaign.id == campaign_id):
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    
+    job = await enqueue_job(session, "delete_campaign", {"campaign_id": campaign_id})
+    return _redirect_to_job(request, job.id)
+
+
+@router.post("/offer/{offer_id}/delete")
+async def delete_offer(
+    request: Request,
+    offer_id: int,
+    session: AsyncSession = Depends(get_dashboard_session)
+):
+    """Ставит в очередь удаление оффера вместе со всеми его кампаниями"""
+    
+    result = await session.execute(select(Offer.id).where(Offer.id == offer_id))
+    if result.scalar_one_or_none() is None:
+        raise HTTPException(status_code=404, detail="Offer not found")
+    
+    await mark_campaigns_deleted(session, Campaign.offer_id == offer_id)
+    job = await enqueue_job(session, "delete_offer", {"offer_id": offer_id})
+    return _redirect_to_job(request, job.id)
+
+
+async def _recent_jobs(session: AsyncSession, limit: int = 100) -> list[Job]:
+    result = await session.execute(select(Job).order_by(Job.id.desc()).limit(limit))
+    return list(result.scalars().all())
+
+
+async def _get_job(session: AsyncSession, job_id: int) -> Job:
+    result = await session.execute(select(Job).where(Job.id == job_id))
+    job = result.scalar_one_or_none()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+def _redirect_to_job(request: Request, job_id: int):
+    if request.headers.get("hx-request"):
+        return HTMLResponse(
+            content="",
+            headers={"HX-Redirect": f"/job/{job_id}"}
+        )
+    return RedirectResponse(url=f"/job/{job_id}", status_code=303)
@@ -1,121 +1,255 @@
 import logging
+from datetime import datetime, timedelta, timezone
+from typing import Literal
 from fastapi import APIRouter, Request, HTTPException, Form, Depends
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, case, or_, and_, distinct
+from sqlalchemy import BigInteger, insert, literal, select, update, func, cast, or_, and_, tuple_
 from sqlalchemy.orm import selectinload
-from app.dependencies import get_db_session
-from app.models.database import Campaign, Event, Offer, CampaignDomainEmails
+from app.dependencies import get_dashboard_session
+from app.models.database import Campaign, CampaignCounters, Offer
 from app.models.schemas import CampaignCreate
 from app.config import settings
+from app.templating import render_table, templates
+from app.services.archive import archive_store
+from app.services.ingest import utc_now
+from app.services.offer_cache import offer_catalog, offer_url_cache
+from app.services.sketches import mark_sketches_complete
+from app.services.stats import (
+    Bucket, BUCKET_SIZES, DEFAULT_RANGES, MAX_BUCKETS, EVENT_COUNTERS, campaign_timeseries,
+    DomainSort, SortDirection, DOMAIN_PAGE_SIZES, archived_totals, campaign_counts,
+    campaign_domain_stats, campaign_domains, campaign_journeys, event_counts_query,
+    compacted_counts, extra_param_conditions, unique_emails
+)
 
 logger = logging.getLogger(__name__)
 router = APIRouter(tags=["pages"])
-templates = Jinja2Templates(directory="app/templates")
+
+
+CampaignSort = Literal["created", "clicks", "conversions"]
+
+# Колонка сортировки списка кампаний (по убыванию); второй ключ — id.
+# Кампания без строки счетчиков показывается с нулями
+CAMPAIGN_SORT_COLUMNS = {
+    "created": Campaign.created_at,
+    "clicks": func.coalesce(CampaignCounters.clicks, 0),
+    "conversions": func.coalesce(CampaignCounters.conversions, 0)
+}
+
+# Опрос изменений захватывает несколько секунд до прошлого опроса: updated_at
+# счетчиков — время начала записавшей их транзакции, а не ее коммита
+CAMPAIGNS_POLL_OVERLAP = timedelta(seconds=5)
 
 
 @router.get("/", response_class=HTMLResponse)
 async def home(
     request: Request,
-    session: AsyncSession = Depends(get_db_session)
+    session: AsyncSession = Depends(get_dashboard_session)
 ):
-    """Главная страница со списком всех кампаний"""
+    """Главная страница: первая страница списка кампаний и фильтры"""
     
-    stmt = (
-        select(
-            Campaign.id,
-            Campaign.name,
-            Campaign.created_at,
-            func.count(
-                case(
-                    (Event.event_type.in_(["email_click", "landing_click"]), 1)
-                )
-            ).label("clicks"),
-            func.count(
-                case((Event.event_type == "conversion", 1))
-            ).label("conversions")
-        )
-        .outerjoin(Event, Campaign.id == Event.campaign_id)
-        .group_by(Campaign.id, Campaign.name, Campaign.created_at)
-        .order_by(Campaign.created_at.desc())
-    )
-    
-    result = await session.execute(stmt)
-    campaigns = [
-        {
-            "id": row.id,
-            "name": row.name,
-            "created_at": row.created_at,
-            "clicks": row.clicks or 0,
-            "conversions": row.conversions or 0
-        }
-        for row in result.all()
-    ]
+    campaigns, has_more = await _campaign_page(session, None, None, "created", None)
     
     return templates.TemplateResponse(
         "home.html",
-        {"request": request, "campaigns": campaigns, "base_url": settings.base_url}
+        {
+            "request": request,
+            **await _offer_choices(),
+            "campaigns": campaigns,
+            "has_more": has_more,
+            "poll": await _campaigns_poll(session, "created", _newest_id(campaigns)),
+            "base_url": settings.base_url
+        }
     )
 
 
 @router.get("/campaigns-table", response_class=HTMLResponse)
 async def campaigns_table(
     request: Request,
-    session: AsyncSession = Depends(get_db_session)
+    name: str | None = None,
+    offer_id: str | None = None,
+    sort: CampaignSort = "created",
+    after: int | None = None,
+    session: AsyncSession = Depends(get_dashboard_session)
+):
+    """
+    HTMX endpoint таблицы кампаний. Без after — таблица с первой страницей
+    (смена фильтров), с after — следующая страница после кампании after
+    (keyset по колонке сортировки и id, без OFFSET).
+    """
+    
+    campaigns, has_more = await _campaign_page(
+        session, name, _parse_offer_id(offer_id), sort, after
+    )
+    context = {
+        "request": request,
+        "campaigns": campaigns,
+        "has_more": has_more,
+        "base_url": settings.base_url
+    }
+    
+    if after is not None:
+        return templates.TemplateResponse("partials/campaign_rows.html", context)
+    
+    context["poll"] = await _campaigns_poll(session, sort, _newest_id(campaigns))
+    return templates.TemplateResponse("partials/campaigns_table.html", context)
+
+
+@router.get("/campaigns-table/changes", response_class=HTMLResponse)
+async def campaigns_table_changes(
+    request: Request,
+    since: datetime,
+    newest: int | None = None,
+    last: int = 0,
+    name: str | None = None,
+    offer_id: str | None = None,
+    sort: CampaignSort = "created",
+    session: AsyncSession = Depends(get_dashboard_session)
 ):
-    """HTMX endpoint для обновления таблицы кампаний"""
+    """
+    Опрос таблицы кампаний раз в 30 секунд: отдает только строки, счетчики
+    которых изменились после прошлого опроса (заменяются через hx-swap-oob),
+    новые кампании при сортировке по дате и удаленные кампании. Измененные
+    строки берутся только до последней показанной кампании last: строки
+    ниже загруженных страниц не на экране.
+    """
+    
+    offer = _parse_offer_id(offer_id)
+    changed_after = since - CAMPAIGNS_POLL_OVERLAP
+    
+    added = []
+    if sort == "created":
+        stmt = _campaign_list_query(name, offer)
+        if newest is not None:
+            stmt = stmt.where(
+                tuple_(Campaign.created_at, Campaign.id)
+                > tuple_(_sort_anchor("created", newest), newest)
+            )
+        stmt = stmt.order_by(Campaign.created_at.desc(), Campaign.id.desc()).limit(settings.campaigns_page_size)
+        result = await session.execute(stmt)
+        added = [_campaign_row(row) for row in result.all()]
+    
+    changed = []
+    if last:
+        key = CAMPAIGN_SORT_COLUMNS[sort]
+        stmt = _campaign_list_query(name, offer).where(
+            CampaignCounters.updated_at > changed_after,
+            tuple_(key, Campaign.id) >= tuple_(_sort_anchor(sort, last), last)
+        )
+        if added:
+            stmt = stmt.where(Campaign.id.not_in([campaign["id"] for campaign in added]))
+        result = await session.execute(stmt)
+        changed = [_campaign_row(row) for row in result.all()]
+    
+    stmt = select(Campaign.id).where(Campaign.deleted_at > changed_after)
+    result = await session.execute(stmt)
+    removed = result.scalars().all()
     
+    return templates.TemplateResponse(
+        "partials/campaigns_changes.html",
+        {
+            "request": request,
+            "added": added,
+            "changed": changed,
+            "removed": removed,
+            "poll": await _campaigns_poll(session, sort, added[0]["id"] if added else newest),
+            "base_url": settings.base_url
+        }
+    )
+
+
+def _parse_offer_id(offer_id: str | None) -> int | None:
+    """Пустое значение селекта фильтра означает все офферы"""
+    if not offer_id:
+        return None
+    if not offer_id.isdigit():
+        raise HTTPException(status_code=400, detail="Invalid offer_id")
+    return int(offer_id)
+
+
+def _campaign_list_query(name: str | None, offer_id: int | None):
+    """Кампании списка с предрассчитанными счетчиками (campaign_counters)"""
     stmt = (
         select(
             Campaign.id,
             Campaign.name,
             Campaign.created_at,
-            func.count(
-                case(
-                    (Event.event_type.in_(["email_click", "landing_click"]), 1)
-                )
-            ).label("clicks"),
-            func.count(
-                case((Event.event_type == "conversion", 1))
-            ).label("conversions")
+            CAMPAIGN_SORT_COLUMNS["clicks"].label("clicks"),
+            CAMPAIGN_SORT_COLUMNS["conversions"].label("conversions")
         )
-        .outerjoin(Event, Campaign.id == Event.campaign_id)
-        .group_by(Campaign.id, Campaign.name, Campaign.created_at)
-        .order_by(Campaign.created_at.desc())
+        .outerjoin(CampaignCounters, CampaignCounters.campaign_id == Campaign.id)
+        .where(Campaign.deleted_at.is_(None))
     )
+    if name:
+        stmt = stmt.where(Campaign.name.ilike(f"%{name}%"))
+    if offer_id is not None:
+        stmt = stmt.where(Campaign.offer_id == offer_id)
+    return stmt
+
+
+def _sort_anchor(sort: CampaignSort, campaign_id: int):
+    """Текущее значение колонки сортировки у кампании — граница keyset страницы"""
+    return (
+        select(CAMPAIGN_SORT_COLUMNS[sort])
+        .select_from(Campaign)
+        .outerjoin(CampaignCounters, CampaignCounters.campaign_id == Campaign.id)
+        .where(Campaign.id == campaign_id)
+        .scalar_subquery()
+    )
+
+
+def _campaign_row(row) -> dict:
+    return {
+        "id": row.id,
+        "name": row.name,
+        "created_at": row.created_at,
+        "clicks": row.clicks,
+        "conversions": row.conversions
+    }
+
+
+async def _campaign_page(
+    session: AsyncSession,
+    name: str | None,
+    offer_id: int | None,
+    sort: CampaignSort,
+    after: int | None
+) -> tuple[list[dict], bool]:
+    """Страница списка кампаний после кампании after и признак следующей страницы"""
+    key = CAMPAIGN_SORT_COLUMNS[sort]
+    stmt = _campaign_list_query(name, offer_id)
+    if after is not None:
+        stmt = stmt.where(tuple_(key, Campaign.id) < tuple_(_sort_anchor(sort, after), after))
+    stmt = stmt.order_by(key.desc(), Campaign.id.desc()).limit(settings.campaigns_page_size + 1)
     
     result = await session.execute(stmt)
-    campaigns = [
-        {
-            "id": row.id,
-            "name": row.name,
-            "created_at": row.created_at,
-            "clicks": row.clicks or 0,
-            "conversions": row.conversions or 0
-        }
-        for row in result.all()
-    ]
-    
-    return templates.TemplateResponse(
-        "partials/campaigns_table.html",
-        {"request": request, "campaigns": campaigns, "base_url": settings.base_url}
-    )
+    rows = result.all()
+    campaigns = [_campaign_row(row) for row in rows[:settings.campaigns_page_size]]
+    return campaigns, len(rows) > settings.campaigns_page_size
+
+
+def _newest_id(campaigns: list[dict]) -> int | None:
+    return campaigns[0]["id"] if campaigns else None
+
+
+async def _campaigns_poll(session: AsyncSession, sort: CampaignSort, newest: int | None) -> dict:
+    """
+    Параметры следующего опроса изменений: время БД на момент выборки и,
+    при сортировке по дате, самая новая показанная кампания
+    """
+    poll = {"since": (await session.scalar(select(func.localtimestamp()))).isoformat()}
+    if sort == "created" and newest is not None:
+        poll["newest"] = newest
+    return poll
 
 
 @router.get("/create", response_class=HTMLResponse)
 async def create_campaign_page(
     request: Request,
-    session: AsyncSession = Depends(get_db_session)
+    session: AsyncSession = Depends(get_dashboard_session)
 ):
     """Страница создания новой кампании"""
-    stmt = select(Offer.id, Offer.name, Offer.url).order_by(Offer.name)
-    result = await session.execute(stmt)
-    offers = [
-        {"id": row.id, "name": row.name, "url": row.url}
-        for row in result.all()
-    ]
-    return templates.TemplateResponse("create.html", {"request": request, "offers": offers})
+    return templates.TemplateResponse("create.html", {"request": request, **await _offer_choices()})
 
 
 @router.post("/campaigns")
@@ -123,7 +257,7 @@ async def create_campaign(
     request: Request,
     name: str = Form(...),
     offer_id: int = Form(None),
-    session: AsyncSession = Depends(get_db_session)
+    session: AsyncSession = Depends(get_dashboard_session)
 ):
     """Создание новой кампании"""
     
@@ -133,22 +267,30 @@ async def create_campaign(
     if not offer_id:
         raise HTTPException(status_code=400, detail="Offer is required")
     
-    # Получаем оффер
-    result = await session.execute(select(Offer).where(Offer.id == offer_id))
-    offer = result.scalar_one_or_none()
-    if not offer:
-        raise HTTPException(status_code=404, detail="Offer not found")
-    
-    # Создаем новую кампанию
-    new_campaign = Campaign(
-        name=name,
-        offer_id=offer_id,
-        offer_url=offer.url
+    # Создаем кампанию одной командой INSERT ... SELECT FROM offers:
+    # URL оффера берется в той же команде, без отдельного запроса
+    result = await session.execute(
+        insert(Campaign)
+        .from_select(
+            ["name", "offer_id", "offer_url"],
+            select(literal(name), Offer.id, Offer.url).where(Offer.id == offer_id)
+        )
+        .returning(Campaign.id, Campaign.offer_url)
     )
-    session.add(new_campaign)
-    await session.flush()
+    row = result.first()
+    if not row:
+        # Оффер удален: справочник мог показать его в форме
+        offer_catalog.invalidate()
+        raise HTTPException(status_code=404, detail="Offer not found")
     
-    campaign_id = new_campaign.id
+    campaign_id = row.id
+    # Строка счетчиков нужна списку кампаний сразу, до первого события
+    session.add(CampaignCounters(campaign_id=campaign_id))
+    # У новой кампании нет событий до скетчей: они полны с самого начала
+    await mark_sketches_complete(session, campaign_id)
+    # Кэш обновляется после коммита: редирект не должен знать о несохраненной кампании
+    await session.commit()
+    offer_url_cache.set(campaign_id, offer_id, row.offer_url)
     
     # Для HTMX возвращаем редирект
     if request.headers.get("hx-request"):
@@ -164,7 +306,8 @@ async def create_campaign(
 async def campaign_detail(
     request: Request,
     campaign_id: int,
-    session: AsyncSession = Depends(get_db_session)
+    exact: bool = False,
+    session: AsyncSession = Depends(get_dashboard_session)
 ):
     """Детальная страница кампании с полной статистикой"""
     
@@ -175,7 +318,7 @@ async def campaign_detail(
         stmt = (
             select(Campaign, Offer.name.label("offer_name"))
             .outerjoin(Offer, Campaign.offer_id == Offer.id)
-            .where(Campaign.id == campaign_id)
+            .where(Campaign.id == campaign_id, Campaign.deleted_at.is_(None))
         )
         result = await session.execute(stmt)
         row = result.first()
@@ -191,146 +334,30 @@ async def campaign_detail(
             "offer_url": campaign_obj.offer_url,
             "offer_id": campaign_obj.offer_id,
             "offer_name": row.offer_name,
-            "created_at": campaign_obj.created_at
+            "created_at": campaign_obj.created_at,
+            "archived": bool(archive_store.parts(campaign_obj.id))
         }
         
-        # Получаем список всех офферов для выбора
-        offers_stmt = select(Offer.id, Offer.name).order_by(Offer.name)
-        offers_result = await session.execute(offers_stmt)
-        all_offers = [
-            {"id": row.id, "name": row.name}
-            for row in offers_result.all()
-        ]
-        
         logger.debug("Fetching overall stats")
         # Общая статистика
-        stats_stmt = (
-            select(
-                func.count(case((Event.event_type == "email_click", 1))).label("email_clicks"),
-                func.count(case((Event.event_type == "landing_click", 1))).label("landing_clicks"),
-                func.count(case((Event.event_type == "conversion", 1))).label("conversions"),
-                func.count(case((Event.event_type == "unsubscribe", 1))).label("unsubscribes")
-            )
-            .where(Event.campaign_id == campaign_id)
-        )
-        stats_result = await session.execute(stats_stmt)
-        stats_row = stats_result.first()
-        
-        overall_stats = {
-            "email_clicks": stats_row.email_clicks or 0 if stats_row else 0,
-            "landing_clicks": stats_row.landing_clicks or 0 if stats_row else 0,
-            "conversions": stats_row.conversions or 0 if stats_row else 0,
-            "unsubscribes": stats_row.unsubscribes or 0 if stats_row else 0
-        }
+        overall_stats = await campaign_counts(session, campaign_id)
         
         email_clicks = overall_stats["email_clicks"]
         conversions = overall_stats["conversions"]
         conversion_rate = (conversions / email_clicks * 100) if email_clicks > 0 else 0
         
         logger.debug("Fetching domain stats")
-        # Получаем уникальные домены из events и campaign_domain_emails
-        events_domains_stmt = (
-            select(distinct(Event.domain))
-            .where(Event.campaign_id == campaign_id)
-        )
-        emails_domains_stmt = (
-            select(distinct(CampaignDomainEmails.domain))
-            .where(CampaignDomainEmails.campaign_id == campaign_id)
-        )
-        
-        events_domains_result = await session.execute(events_domains_stmt)
-        emails_domains_result = await session.execute(emails_domains_stmt)
-        
-        all_domains = set()
-        for row in events_domains_result.all():
-            all_domains.add(row[0])
-        for row in emails_domains_result.all():
-            all_domains.add(row[0])
-        
-        # Для каждого домена получаем статистику
-        domain_stats = []
-        for domain in all_domains:
-            # Статистика из events
-            domain_events_stmt = (
-                select(
-                    func.count(case((Event.event_type == "email_click", 1))).label("email_clicks"),
-                    func.count(case((Event.event_type == "landing_click", 1))).label("landing_clicks"),
-                    func.count(case((Event.event_type == "conversion", 1))).label("conversions"),
-                    func.count(case((Event.event_type == "unsubscribe", 1))).label("unsubscribes")
-                )
-                .where(and_(Event.campaign_id == campaign_id, Event.domain == domain))
-            )
-            domain_events_result = await session.execute(domain_events_stmt)
-            domain_events_row = domain_events_result.first()
-            
-            # Количество отправленных писем
-            emails_stmt = (
-                select(CampaignDomainEmails.emails_sent)
-                .where(
-                    and_(
-                        CampaignDomainEmails.campaign_id == campaign_id,
-                        CampaignDomainEmails.domain == domain
-                    )
-                )
-            )
-            emails_result = await session.execute(emails_stmt)
-            emails_row = emails_result.first()
-            emails_sent = emails_row[0] if emails_row else 0
-            
-            e_clicks = domain_events_row.email_clicks or 0 if domain_events_row else 0
-            convs = domain_events_row.conversions or 0 if domain_events_row else 0
-            
-            domain_stats.append({
-                "domain": domain,
-                "email_clicks": e_clicks,
-                "landing_clicks": domain_events_row.landing_clicks or 0 if domain_events_row else 0,
-                "conversions": convs,
-                "unsubscribes": domain_events_row.unsubscribes or 0 if domain_events_row else 0,
-                "emails_sent": emails_sent,
-                "conversion_rate": (convs / e_clicks * 100) if e_clicks > 0 else 0
-            })
-        
-        domain_stats.sort(key=lambda x: x["email_clicks"], reverse=True)
+        # Первая страница статистики по доменам и все домены для фильтра
+        domain_stats, domains_total = await campaign_domain_stats(session, campaign_id)
+        domains = await campaign_domains(session, campaign_id)
         
         logger.debug("Fetching user journeys")
         # Получаем уникальных пользователей с их путешествием
-        user_journeys_stmt = (
-            select(
-                Event.email,
-                Event.domain,
-                func.bool_or(Event.event_type == "email_click").label("has_email_click"),
-                func.bool_or(Event.event_type == "landing_click").label("has_landing_click"),
-                func.bool_or(Event.event_type == "conversion").label("has_conversion"),
-                func.bool_or(Event.event_type == "unsubscribe").label("has_unsubscribe"),
-                func.min(Event.created_at).label("first_event")
-            )
-            .where(Event.campaign_id == campaign_id)
-            .group_by(Event.email, Event.domain)
-            .order_by(func.min(Event.created_at).desc())
-            .limit(50)
-        )
-        user_journeys_result = await session.execute(user_journeys_stmt)
-        
-        user_journeys = []
-        for row in user_journeys_result.all():
-            user_journeys.append({
-                "email": row.email,
-                "domain": row.domain,
-                "has_email_click": bool(row.has_email_click),
-                "has_landing_click": bool(row.has_landing_click),
-                "has_conversion": bool(row.has_conversion),
-                "has_unsubscribe": bool(row.has_unsubscribe)
-            })
+        user_journeys = await campaign_journeys(session, campaign_id)
         
         logger.debug("Fetching total users")
-        # Получаем общее количество уникальных пользователей
-        total_users_stmt = (
-            select(func.count(distinct(Event.email)).label("total"))
-            .where(Event.campaign_id == campaign_id)
-        )
-        total_users_result = await session.execute(total_users_stmt)
-        total_users_row = total_users_result.first()
-        total_users = total_users_row.total or 0 if total_users_row else 0
+        # Количество уникальных пользователей: по умолчанию из скетча
+        total_users, total_users_approx = await unique_emails(session, campaign_id, exact=exact)
         
         logger.debug("Rendering template")
         return templates.TemplateResponse(
@@ -338,18 +365,24 @@ async def campaign_detail(
             {
                 "request": request,
                 "campaign": campaign,
-                "all_offers": all_offers,
+                **await _offer_choices(selected=campaign_obj.offer_id),
                 "overall_stats": {
                     **overall_stats,
                     "conversion_rate": conversion_rate
                 },
                 "domain_stats": domain_stats,
+                "domains": domains,
+                **_domain_page_context(campaign_id, domains_total, "email_clicks", "desc", 0, 50),
                 "user_journeys": user_journeys,
                 "total_users": total_users,
+                "total_users_approx": total_users_approx,
                 "offset": 0,
                 "campaign_id": campaign_id,
                 "domain": None,
-                "email_search": None
+                "email_search": None,
+                "param": None,
+                "param_value": None,
+                "promoted_params": settings.extra_params_promoted
             }
         )
     except HTTPException:
@@ -367,100 +400,49 @@ async def campaign_detail(
 async def campaign_stats(
     request: Request,
     campaign_id: int,
-    session: AsyncSession = Depends(get_db_session)
+    param: str | None = None,
+    param_value: str | None = None,
+    sort: DomainSort = "email_clicks",
+    direction: SortDirection = "desc",
+    offset: int = 0,
+    limit: int = 50,
+    session: AsyncSession = Depends(get_dashboard_session)
 ):
-    """HTMX endpoint для обновления статистики"""
+    """
+    HTMX endpoint для обновления статистики. Таблица доменов отдается
+    одной страницей: сортировка, смещение и размер страницы приходят из
+    скрытых полей фрагмента, так что опрос обновляет только видимую страницу.
+    """
+    
+    if offset < 0 or not 1 <= limit <= max(DOMAIN_PAGE_SIZES):
+        raise HTTPException(
+            status_code=400,
+            detail=f"offset must be non-negative and limit between 1 and {max(DOMAIN_PAGE_SIZES)}"
+        )
     
     try:
         logger.debug(f"Loading stats for campaign_id={campaign_id}")
         
-        # Общая статистика
-        stats_stmt = (
-            select(
-                func.count(case((Event.event_type == "email_click", 1))).label("email_clicks"),
-                func.count(case((Event.event_type == "landing_click", 1))).label("landing_clicks"),
-                func.count(case((Event.event_type == "conversion", 1))).label("conversions"),
-                func.count(case((Event.event_type == "unsubscribe", 1))).label("unsubscribes")
-            )
-            .where(Event.campaign_id == campaign_id)
+        # Фильтр по продвигаемому параметру события (utm_source и т.п.)
+        overall_stats = await campaign_counts(
+            session, campaign_id, param=param, param_value=param_value
         )
-        stats_result = await session.execute(stats_stmt)
-        stats_row = stats_result.first()
-        
-        overall_stats = {
-            "email_clicks": stats_row.email_clicks or 0 if stats_row else 0,
-            "landing_clicks": stats_row.landing_clicks or 0 if stats_row else 0,
-            "conversions": stats_row.conversions or 0 if stats_row else 0,
-            "unsubscribes": stats_row.unsubscribes or 0 if stats_row else 0
-        }
         
         email_clicks = overall_stats["email_clicks"]
         conversions = overall_stats["conversions"]
         conversion_rate = (conversions / email_clicks * 100) if email_clicks > 0 else 0
         
-        # Получаем уникальные домены
-        events_domains_stmt = (
-            select(distinct(Event.domain))
-            .where(Event.campaign_id == campaign_id)
-        )
-        emails_domains_stmt = (
-            select(distinct(CampaignDomainEmails.domain))
-            .where(CampaignDomainEmails.campaign_id == campaign_id)
+        domain_stats_list, domains_total = await campaign_domain_stats(
+            session, campaign_id, sort=sort, direction=direction, offset=offset, limit=limit,
+            param=param, param_value=param_value
         )
         
-        events_domains_result = await session.execute(events_domains_stmt)
-        emails_domains_result = await session.execute(emails_domains_stmt)
-        
-        all_domains = set()
-        for row in events_domains_result.all():
-            all_domains.add(row[0])
-        for row in emails_domains_result.all():
-            all_domains.add(row[0])
+        # Сжатые события параметров не хранят: показываем, сколько их не вошло
+        compacted = None
+        if extra_param_conditions(param, param_value):
+            compacted = await compacted_counts(session, campaign_id)
         
-        # Для каждого домена получаем статистику
-        domain_stats_list = []
-        for domain in all_domains:
-            domain_events_stmt = (
-                select(
-                    func.count(case((Event.event_type == "email_click", 1))).label("email_clicks"),
-                    func.count(case((Event.event_type == "landing_click", 1))).label("landing_clicks"),
-                    func.count(case((Event.event_type == "conversion", 1))).label("conversions"),
-                    func.count(case((Event.event_type == "unsubscribe", 1))).label("unsubscribes")
-                )
-                .where(and_(Event.campaign_id == campaign_id, Event.domain == domain))
-            )
-            domain_events_result = await session.execute(domain_events_stmt)
-            domain_events_row = domain_events_result.first()
-            
-            emails_stmt = (
-                select(CampaignDomainEmails.emails_sent)
-                .where(
-                    and_(
-                        CampaignDomainEmails.campaign_id == campaign_id,
-                        CampaignDomainEmails.domain == domain
-                    )
-                )
-            )
-            emails_result = await session.execute(emails_stmt)
-            emails_row = emails_result.first()
-            emails_sent = emails_row[0] if emails_row else 0
-            
-            e_clicks = domain_events_row.email_clicks or 0 if domain_events_row else 0
-            convs = domain_events_row.conversions or 0 if domain_events_row else 0
-            
-            domain_stats_list.append({
-                "domain": domain,
-                "email_clicks": e_clicks,
-                "landing_clicks": domain_events_row.landing_clicks or 0 if domain_events_row else 0,
-                "conversions": convs,
-                "unsubscribes": domain_events_row.unsubscribes or 0 if domain_events_row else 0,
-                "emails_sent": emails_sent,
-                "conversion_rate": (convs / e_clicks * 100) if e_clicks > 0 else 0
-            })
-        
-        domain_stats_list.sort(key=lambda x: x["email_clicks"], reverse=True)
-        
-        return templates.TemplateResponse(
+        return render_table(
             "partials/campaign_stats.html",
             {
                 "request": request,
@@ -468,8 +450,11 @@ async def campaign_stats(
                     **overall_stats,
                     "conversion_rate": conversion_rate
                 },
-                "domain_stats": domain_stats_list
-            }
+                "domain_stats": domain_stats_list,
+                "compacted_events": sum(compacted.values()) if compacted else 0,
+                **_domain_page_context(campaign_id, domains_total, sort, direction, offset, limit)
+            },
+            rows=len(domain_stats_list)
         )
     except Exception as e:
         logger.error(
@@ -480,6 +465,26 @@ async def campaign_stats(
         raise
 
 
+def _domain_page_context(
+    campaign_id: int,
+    domains_total: int,
+    sort: str,
+    direction: str,
+    offset: int,
+    limit: int
+) -> dict:
+    """Состояние таблицы доменов для фрагмента campaign_stats"""
+    return {
+        "campaign_id": campaign_id,
+        "domains_total": domains_total,
+        "domain_sort": sort,
+        "domain_direction": direction,
+        "domain_offset": offset,
+        "domain_limit": limit,
+        "domain_page_sizes": DOMAIN_PAGE_SIZES
+    }
+
+
 @router.get("/campaign/{campaign_id}/users", response_class=HTMLResponse)
 async def campaign_users(
     request: Request,
@@ -487,90 +492,172 @@ async def campaign_users(
     domain: str | None = None,
     email_search: str | None = None,
     offset: int = 0,
-    session: AsyncSession = Depends(get_db_session)
+    exact: bool = False,
+    param: str | None = None,
+    param_value: str | None = None,
+    session: AsyncSession = Depends(get_dashboard_session)
 ):
     """HTMX endpoint для фильтрации и пагинации пользователей"""
     
-    # Строим запрос с фильтрами
-    conditions = [Event.campaign_id == campaign_id]
+    # Фильтр по параметру учитывается и передается в ссылки, только если он применим
+    if not extra_param_conditions(param, param_value):
+        param = param_value = None
     
-    if domain:
-        conditions.append(Event.domain == domain)
-    
-    if email_search:
-        conditions.append(Event.email.ilike(f"%{email_search}%"))
-    
-    stmt = (
-        select(
-            Event.email,
-            Event.domain,
-            func.bool_or(Event.event_type == "email_click").label("has_email_click"),
-            func.bool_or(Event.event_type == "landing_click").label("has_landing_click"),
-            func.bool_or(Event.event_type == "conversion").label("has_conversion"),
-            func.bool_or(Event.event_type == "unsubscribe").label("has_unsubscribe"),
-            func.min(Event.created_at).label("first_event")
-        )
-        .where(and_(*conditions))
-        .group_by(Event.email, Event.domain)
-        .order_by(func.min(Event.created_at).desc())
-        .limit(50)
-        .offset(offset)
+    user_journeys = await campaign_journeys(
+        session, campaign_id, domain=domain, email_search=email_search,
+        param=param, param_value=param_value, offset=offset
     )
     
-    result = await session.execute(stmt)
-    user_journeys = []
-    for row in result.all():
-        user_journeys.append({
-            "email": row.email,
-            "domain": row.domain,
-            "has_email_click": bool(row.has_email_click),
-            "has_landing_click": bool(row.has_landing_click),
-            "has_conversion": bool(row.has_conversion),
-            "has_unsubscribe": bool(row.has_unsubscribe)
-        })
-    
     # Получаем общее количество для текущего фильтра
-    count_stmt = (
-        select(func.count(distinct(Event.email)).label("total"))
-        .where(and_(*conditions))
+    total_users, total_users_approx = await unique_emails(
+        session, campaign_id, domain=domain, email_search=email_search, exact=exact,
+        param=param, param_value=param_value
     )
-    count_result = await session.execute(count_stmt)
-    count_row = count_result.first()
-    total_users = count_row.total or 0 if count_row else 0
     
-    return templates.TemplateResponse(
+    compacted = None
+    if param:
+        compacted = await compacted_counts(session, campaign_id, domain=domain)
+    
+    return render_table(
         "partials/user_journeys.html",
         {
             "request": request,
             "user_journeys": user_journeys,
             "total_users": total_users,
+            "total_users_approx": total_users_approx,
             "offset": offset,
             "campaign_id": campaign_id,
             "domain": domain,
-            "email_search": email_search
+            "email_search": email_search,
+            "param": param,
+            "param_value": param_value,
+            "compacted_events": sum(compacted.values()) if compacted else 0
+        },
+        rows=len(user_journeys)
+    )
+
+
+@router.get("/campaign/{campaign_id}/timeseries")
+async def campaign_timeseries_view(
+    request: Request,
+    campaign_id: int,
+    bucket: Bucket = "hour",
+    start: datetime | None = None,
+    end: datetime | None = None,
+    format: Literal["html", "json"] = "html",
+    session: AsyncSession = Depends(get_dashboard_session)
+):
+    """
+    Динамика событий кампании по минутам, часам или дням.
+    HTMX partial по умолчанию, компактный JSON при format=json.
+    """
+    
+    end = _to_naive_utc(end) if end else utc_now()
+    start = _to_naive_utc(start) if start else end - DEFAULT_RANGES[bucket]
+    
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be earlier than end")
+    
+    if (end - start) / BUCKET_SIZES[bucket] > MAX_BUCKETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Range is too large for bucket '{bucket}': at most {MAX_BUCKETS} buckets allowed"
+        )
+    
+    series = await campaign_timeseries(session, campaign_id, bucket, start, end)
+    
+    if format == "json":
+        return JSONResponse(series)
+    
+    # Для таблицы разворачиваем колонки в строки, свежие сверху
+    rows = [
+        {
+            "t": datetime.fromisoformat(t),
+            **{key: series[key][i] for key in EVENT_COUNTERS}
+        }
+        for i, t in enumerate(series["t"])
+    ]
+    rows.reverse()
+    
+    return templates.TemplateResponse(
+        "partials/campaign_timeseries.html",
+        {
+            "request": request,
+            "campaign_id": campaign_id,
+            "bucket": bucket,
+            "rows": rows,
+            "compacted": series["compacted"],
+            "compacted_events": sum(series["compacted"].values())
         }
     )
 
 
+def _to_naive_utc(value: datetime) -> datetime:
+    """Приводит datetime к UTC без tzinfo, как хранится created_at"""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
 # ==================== ОФФЕРЫ ====================
 
+@router.get("/offers/options", response_class=HTMLResponse)
+async def offer_options(
+    request: Request,
+    q: str = "",
+    selected: int | None = None,
+    exclude: int | None = None,
+    placeholder: str | None = None
+):
+    """HTMX endpoint поиска оффера по началу названия для выпадающих списков"""
+    offers = await offer_catalog.search(q, settings.offer_select_limit, exclude)
+    return templates.TemplateResponse(
+        "partials/offer_options.html",
+        {"request": request, "offers": offers, "selected": selected, "placeholder": placeholder}
+    )
+
+
+async def _offer_choices(selected: int | None = None, exclude: int | None = None) -> dict:
+    """
+    Офферы выпадающего списка из справочника в памяти: первые
+    offer_select_limit по названию и выбранный, если он не попал в их число.
+    searchable — справочник больше списка, нужен поиск по названию.
+    """
+    offers = await offer_catalog.search(limit=settings.offer_select_limit, exclude=exclude)
+    if selected is not None and all(offer.id != selected for offer in offers):
+        current = await offer_catalog.get(selected)
+        if current:
+            offers.insert(0, current)
+    return {
+        "offers": offers,
+        "selected_offer_id": selected,
+        "offers_searchable": await offer_catalog.count() > settings.offer_select_limit
+    }
+
+
 @router.get("/offers", response_class=HTMLResponse)
 async def offers_list(
     request: Request,
-    session: AsyncSession = Depends(get_db_session)
+    session: AsyncSession = Depends(get_dashboard_session)
 ):
-    """Страница со списком всех офферов"""
+    """
+    Страница со списком всех офферов. Клики и конверсии берутся из
+    campaign_counters, а не пересчитываются по событиям: счетчики
+    включают и сжатые, и архивные события.
+    """
+    
     stmt = (
         select(
             Offer.id,
             Offer.name,
             Offer.url,
             Offer.created_at,
-            func.count(distinct(Campaign.id)).label("campaigns_count"),
-            func.count(Event.id).label("total_events")
+            func.count(Campaign.id).label("campaigns_count"),
+            cast(func.sum(CampaignCounters.clicks), BigInteger).label("clicks"),
+            cast(func.sum(CampaignCounters.conversions), BigInteger).label("conversions")
         )
-        .outerjoin(Campaign, Offer.id == Campaign.offer_id)
-        .outerjoin(Event, Campaign.id == Event.campaign_id)
+        .outerjoin(Campaign, and_(Offer.id == Campaign.offer_id, Campaign.deleted_at.is_(None)))
+        .outerjoin(CampaignCounters, Campaign.id == CampaignCounters.campaign_id)
         .group_by(Offer.id, Offer.name, Offer.url, Offer.created_at)
         .order_by(Offer.created_at.desc())
     )
@@ -583,7 +670,8 @@ async def offers_list(
             "url": row.url,
             "created_at": row.created_at,
             "campaigns_count": row.campaigns_count or 0,
-            "total_events": row.total_events or 0
+            "clicks": row.clicks or 0,
+            "conversions": row.conversions or 0
         }
         for row in result.all()
     ]
@@ -605,7 +693,7 @@ async def create_offer(
     request: Request,
     name: str = Form(...),
     url: str = Form(...),
-    session: AsyncSession = Depends(get_db_session)
+    session: AsyncSession = Depends(get_dashboard_session)
 ):
     """Создание нового оффера"""
     
@@ -617,6 +705,8 @@ async def create_offer(
     await session.flush()
     
     offer_id = new_offer.id
+    await session.commit()
+    offer_catalog.invalidate()
     
     if request.headers.get("hx-request"):
         return HTMLResponse(
@@ -631,7 +721,7 @@ async def create_offer(
 async def offer_detail(
     request: Request,
     offer_id: int,
-    session: AsyncSession = Depends(get_db_session)
+    session: AsyncSession = Depends(get_dashboard_session)
 ):
     """Детальная страница оффера со статистикой"""
     
@@ -648,18 +738,23 @@ async def offer_detail(
         "created_at": offer_obj.created_at
     }
     
-    # Общая статистика по офферу (через все кампании)
+    # Общая статистика по офферу (через все кампании). Фильтр по кампаниям
+    # оффера внутри подзапроса: агрегируются только их события
+    offer_campaigns = select(Campaign.id).where(
+        Campaign.offer_id == offer_id, Campaign.deleted_at.is_(None)
+    )
+    counts = event_counts_query(("campaign_id",), campaign_ids=offer_campaigns).subquery()
     overall_stats_stmt = (
         select(
-            func.count(distinct(Campaign.id)).label("campaigns_count"),
-            func.count(case((Event.event_type == "email_click", 1))).label("email_clicks"),
-            func.count(case((Event.event_type == "landing_click", 1))).label("landing_clicks"),
-            func.count(case((Event.event_type == "conversion", 1))).label("conversions"),
-            func.count(case((Event.event_type == "unsubscribe", 1))).label("unsubscribes")
+            func.count(Campaign.id).label("campaigns_count"),
+            cast(func.sum(counts.c.email_clicks), BigInteger).label("email_clicks"),
+            cast(func.sum(counts.c.landing_clicks), BigInteger).label("landing_clicks"),
+            cast(func.sum(counts.c.conversions), BigInteger).label("conversions"),
+            cast(func.sum(counts.c.unsubscribes), BigInteger).label("unsubscribes")
         )
         .select_from(Offer)
-        .outerjoin(Campaign, Offer.id == Campaign.offer_id)
-        .outerjoin(Event, Campaign.id == Event.campaign_id)
+        .outerjoin(Campaign, and_(Offer.id == Campaign.offer_id, Campaign.deleted_at.is_(None)))
+        .outerjoin(counts, Campaign.id == counts.c.campaign_id)
         .where(Offer.id == offer_id)
     )
     overall_stats_result = await session.execute(overall_stats_stmt)
@@ -678,15 +773,14 @@ async def offer_detail(
         select(
             Campaign.id,
             Campaign.name,
-            func.count(case((Event.event_type == "email_click", 1))).label("email_clicks"),
-            func.count(case((Event.event_type == "landing_click", 1))).label("landing_clicks"),
-            func.count(case((Event.event_type == "conversion", 1))).label("conversions"),
-            func.count(case((Event.event_type == "unsubscribe", 1))).label("unsubscribes")
+            func.coalesce(counts.c.email_clicks, 0).label("email_clicks"),
+            func.coalesce(counts.c.landing_clicks, 0).label("landing_clicks"),
+            func.coalesce(counts.c.conversions, 0).label("conversions"),
+            func.coalesce(counts.c.unsubscribes, 0).label("unsubscribes")
         )
-        .outerjoin(Event, Campaign.id == Event.campaign_id)
-        .where(Campaign.offer_id == offer_id)
-        .group_by(Campaign.id, Campaign.name)
-        .order_by(func.count(case((Event.event_type == "email_click", 1))).desc())
+        .outerjoin(counts, Campaign.id == counts.c.campaign_id)
+        .where(Campaign.offer_id == offer_id, Campaign.deleted_at.is_(None))
+        .order_by(func.coalesce(counts.c.email_clicks, 0).desc())
     )
     campaigns_stats_result = await session.execute(campaigns_stats_stmt)
     campaigns_stats = [
@@ -701,6 +795,18 @@ async def offer_detail(
         for row in campaigns_stats_result.all()
     ]
     
+    # События архивных кампаний
+    archived = await archived_totals([campaign["id"] for campaign in campaigns_stats])
+    if archived:
+        for campaign in campaigns_stats:
+            counts = archived.get(campaign["id"])
+            if not counts:
+                continue
+            for key in ("email_clicks", "landing_clicks", "conversions", "unsubscribes"):
+                campaign[key] += counts[key]
+                overall_stats[key] += counts[key]
+        campaigns_stats.sort(key=lambda campaign: campaign["email_clicks"], reverse=True)
+    
     # Вычисляем conversion rate
     email_clicks = overall_stats["email_clicks"]
     conversions = overall_stats["conversions"]
@@ -715,7 +821,9 @@ async def offer_detail(
                 **overall_stats,
                 "conversion_rate": conversion_rate
             },
-            "campaigns_stats": campaigns_stats
+            "campaigns_stats": campaigns_stats,
+            # Офферы, на которые можно перенести кампании
+            **await _offer_choices(exclude=offer_id)
         }
     )
 
@@ -724,7 +832,7 @@ async def offer_detail(
 async def edit_offer_page(
     request: Request,
     offer_id: int,
-    session: AsyncSession = Depends(get_db_session)
+    session: AsyncSession = Depends(get_dashboard_session)
 ):
     """Страница редактирования оффера"""
     result = await session.execute(select(Offer).where(Offer.id == offer_id))
@@ -751,34 +859,37 @@ async def update_offer(
     offer_id: int,
     name: str = Form(...),
     url: str = Form(...),
-    session: AsyncSession = Depends(get_db_session)
+    session: AsyncSession = Depends(get_dashboard_session)
 ):
     """Обновление оффера"""
     
     if not name or not url:
         raise HTTPException(status_code=400, detail="Name and URL are required")
     
-    # Проверяем существование оффера
-    result = await session.execute(select(Offer).where(Offer.id == offer_id))
-    offer = result.scalar_one_or_none()
-    if not offer:
-        raise HTTPException(status_code=404, detail="Offer not found")
-    
     # Обновляем оффер
-    offer.name = name
-    offer.url = url
-    session.add(offer)
+    result = await session.execute(
+        update(Offer)
+        .where(Offer.id == offer_id)
+        .values(name=name, url=url)
+        .returning(Offer.id)
+    )
+    if result.scalar_one_or_none() is None:
+        raise HTTPException(status_code=404, detail="Offer not found")
     
-    # Обновляем offer_url во всех кампаниях с этим оффером
-    campaigns_result = await session.execute(
-        select(Campaign).where(Campaign.offer_id == offer_id)
+    # Обновляем offer_url во всех кампаниях с этим оффером одной командой
+    await session.execute(
+        update(Campaign)
+        .where(Campaign.offer_id == offer_id)
+        .values(offer_url=url)
+        .execution_options(synchronize_session=False)
     )
-    campaigns = campaigns_result.scalars().all()
-    for campaign in campaigns:
-        campaign.offer_url = url
-        session.add(campaign)
     
-    await session.flush()
+    # Кэши обновляются только после коммита: при сбое коммита редирект
+    # не должен вести на несохраненный URL, а справочник — загрузить старое
+    # название под новой версией
+    await session.commit()
+    offer_url_cache.update_offer(offer_id, url)
+    offer_catalog.invalidate()
     
     if request.headers.get("hx-request"):
         return HTMLResponse(
@@ -794,27 +905,34 @@ async def update_campaign_offer(
     request: Request,
     campaign_id: int,
     offer_id: int = Form(...),
-    session: AsyncSession = Depends(get_db_session)
+    session: AsyncSession = Depends(get_dashboard_session)
 ):
     """Обновление оффера в кампании"""
     
-    # Проверяем существование кампании
-    campaign_result = await session.execute(select(Campaign).where(Campaign.id == campaign_id))
-    campaign = campaign_result.scalar_one_or_none()
-    if not campaign:
-        raise HTTPException(status_code=404, detail="Campaign not found")
-    
-    # Проверяем существование оффера
-    offer_result = await session.execute(select(Offer).where(Offer.id == offer_id))
-    offer = offer_result.scalar_one_or_none()
-    if not offer:
+    # Переносим кампанию на оффер одной командой UPDATE ... FROM offers
+    result = await session.execute(
+        update(Campaign)
+        .where(
+            Campaign.id == campaign_id,
+            Campaign.deleted_at.is_(None),
+            Offer.id == offer_id
+        )
+        .values(offer_id=Offer.id, offer_url=Offer.url)
+        .returning(Campaign.offer_url)
+        .execution_options(synchronize_session=False)
+    )
+    offer_url = result.scalar_one_or_none()
+    if offer_url is None:
+        # Причину уточняем только в редком случае ошибки
+        campaign_exists = await session.scalar(
+            select(Campaign.id).where(Campaign.id == campaign_id, Campaign.deleted_at.is_(None))
+        )
+        if campaign_exists is None:
+            raise HTTPException(status_code=404, detail="Campaign not found")
         raise HTTPException(status_code=404, detail="Offer not found")
     
-    # Обновляем оффер в кампании
-    campaign.offer_id = offer_id
-    campaign.offer_url = offer.url
-    session.add(campaign)
-    await session.flush()
+    await session.commit()
+    offer_url_cache.set(campaign_id, offer_id, offer_url)
     
     if request.headers.get("hx-request"):
         return HTMLResponse(
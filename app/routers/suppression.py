@@ -0,0 +1,73 @@
+"""
+Проверка отписок перед отправкой письма (для MTA)
+"""
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import Response
+from app.config import settings
+from app.models.schemas import (
+    SuppressionBatchCheck, SuppressionBatchResult, SuppressionCheckResult
+)
+from app.services.suppression import SuppressionScope, suppression_index
+
+router = APIRouter(prefix="/api/suppression", tags=["suppression"])
+
+
+def _require_ready():
+    if not suppression_index.ready:
+        raise HTTPException(
+            status_code=503,
+            detail="Suppression index is loading, retry later",
+            headers={"Retry-After": "5"}
+        )
+
+
+@router.get("/check", response_model=SuppressionCheckResult)
+async def check_suppression(email: str, cid: int | None = None):
+    """
+    Отписан ли адрес от кампании cid или, без cid, от любой кампании.
+    Ответ из индекса в памяти, без обращения к БД.
+    """
+    _require_ready()
+    return SuppressionCheckResult(
+        email=email,
+        campaign_id=cid,
+        suppressed=suppression_index.check(email, cid)
+    )
+
+
+@router.post("/check", response_model=SuppressionBatchResult)
+async def check_suppression_batch(payload: SuppressionBatchCheck):
+    """Пакетная проверка: возвращает отписанные адреса из списка"""
+    _require_ready()
+    if len(payload.emails) > settings.suppression_check_batch_max:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many emails: {len(payload.emails)}, max {settings.suppression_check_batch_max}"
+        )
+    suppressed = [
+        email for email in payload.emails
+        if suppression_index.check(email, payload.campaign_id)
+    ]
+    return SuppressionBatchResult(checked=len(payload.emails), suppressed=suppressed)
+
+
+@router.get("/snapshot")
+async def suppression_snapshot(scope: SuppressionScope = "global"):
+    """
+    Снимок индекса для локальной проверки на стороне MTA: отсортированные
+    хэши little-endian uint64. Хэш — первые 8 байт blake2b (digest_size=8)
+    от email без пробелов по краям в нижнем регистре; для scope=campaign —
+    от строки "cid:email".
+    """
+    _require_ready()
+    data = await suppression_index.snapshot(scope)
+    return Response(
+        content=data,
+        media_type="application/octet-stream",
+        headers={
+            "Content-Disposition": f'attachment; filename="suppression-{scope}.bin"',
+            "X-Suppression-Hash": "blake2b-64-le",
+            "X-Suppression-Count": str(len(data) // 8)
+        }
+    )
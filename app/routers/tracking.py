@@ -0,0 +1,100 @@
+"""
+Трекинговые endpoints, на которые ведут ссылки из писем
+"""
+
+import logging
+from typing import Any
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Request
+from fastapi.responses import RedirectResponse, Response
+from app.services.event_writer import event_writer
+from app.services.ingest import build_event, client_ip
+from app.services.offer_cache import offer_url_cache
+from app.services.rate_limit import tracking_rate_limiter
+
+logger = logging.getLogger(__name__)
+router = APIRouter(tags=["tracking"])
+
+# Прозрачный GIF 1x1, отдается из одного и того же буфера
+PIXEL_GIF = (
+    b"GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff"
+    b"!\xf9\x04\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00"
+    b"\x00\x02\x02D\x01\x00;"
+)
+PIXEL_HEADERS = {
+    "Cache-Control": "no-store, no-cache, must-revalidate, max-age=0, private",
+    "Pragma": "no-cache",
+    "Expires": "0"
+}
+
+
+@router.get("/r/{campaign_id}")
+async def redirect_click(
+    request: Request,
+    campaign_id: int,
+    email: str | None = None,
+    domain: str | None = None
+):
+    """
+    Записывает email_click и сразу перенаправляет на оффер кампании.
+    Запись события идет в фоне, offer_url берется из кэша в памяти.
+    Все дополнительные query параметры сохраняются в extra_params.
+    При превышении лимита частоты получатель перенаправляется без записи клика.
+    Лимит проверяется до поиска кампании: ограниченный клиент получает URL
+    только из кэша и не вызывает запросов к БД.
+    """
+    if _rate_limited(request, campaign_id):
+        offer_url = offer_url_cache.get(campaign_id)
+        if offer_url is None:
+            raise HTTPException(status_code=429, detail="Too many requests")
+        return RedirectResponse(url=offer_url, status_code=302)
+
+    offer_url = await offer_url_cache.resolve(campaign_id)
+    if offer_url is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Campaign with id {campaign_id} not found"
+        )
+
+    # Без email/domain событие записать нельзя, но получателя все равно перенаправляем
+    if email and domain:
+        event_writer.submit(build_event(request, campaign_id, "email_click", email, domain))
+    else:
+        logger.warning(f"Redirect for campaign {campaign_id} without email/domain, click not recorded")
+
+    return RedirectResponse(url=offer_url, status_code=302)
+
+
+@router.get("/o/{campaign_id}.gif")
+async def open_pixel(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    campaign_id: int,
+    email: str | None = None,
+    domain: str | None = None
+):
+    """
+    Пиксель открытия письма: записывает событие open в фоне.
+    Всегда отвечает картинкой, даже для неизвестной кампании,
+    чтобы не ломать отображение письма.
+    """
+    if email and domain and not _rate_limited(request, campaign_id):
+        event = build_event(request, campaign_id, "open", email, domain)
+        if offer_url_cache.get(campaign_id) is not None:
+            event_writer.submit(event)
+        else:
+            # Кампании нет в кэше — проверяем ее в БД уже после ответа
+            background_tasks.add_task(_submit_after_lookup, event)
+
+    return Response(content=PIXEL_GIF, media_type="image/gif", headers=PIXEL_HEADERS)
+
+
+def _rate_limited(request: Request, campaign_id: int) -> bool:
+    return tracking_rate_limiter.check(client_ip(request), campaign_id) > 0
+
+
+async def _submit_after_lookup(event: dict[str, Any]):
+    """Ставит событие в очередь, если кампания существует"""
+    if await offer_url_cache.resolve(event["campaign_id"]) is None:
+        logger.warning(f"Open for unknown campaign {event['campaign_id']} dropped")
+        return
+    event_writer.submit(event)
@@ -0,0 +1,470 @@
+"""
+Холодный архив событий кампаний в Parquet файлах на локальном диске.
+
+Задача archive_campaign выгружает события кампании из events в часть
+архива {archive_dir}/campaign-{id}/{время}.parquet (zstd, row group на
+пачку серверного курсора), после fsync делает часть видимой и только затем
+удаляет из БД ровно записанные строки. Пока строки удаляются, рядом лежит
+маркер {время}.deleting: события кратковременно видны и в БД, и в архиве
+(счетчики завышены, а не занижены), выгрузка событий ждет окончания.
+Прерванная задача доделывает удаление при следующем запуске, сбой не
+теряет данных. Одновременно кампанию архивирует только одна задача (flock
+на каталоге кампании). Повторный запуск добавляет новую часть с событиями,
+пришедшими после прошлой архивации.
+
+Страницы кампании складывают статистику из БД и архива (app/services/stats.py).
+Части читаются через memory map, агрегаты считаются векторно
+(pyarrow.compute) в отдельном потоке. Части не меняются, поэтому таблицы
+и результаты кэшируются по набору частей кампании. Требуется pyarrow.
+"""
+
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import shutil
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Iterable, Sequence
+from sqlalchemy import Row, delete, select
+from app.config import settings
+from app.database import db
+from app.models.database import Event
+from app.services.jobs import JobContext, job_handler
+from app.services.metrics import metrics
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - pyarrow опционален
+    pa = None
+    pc = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+PART_SUFFIX = ".parquet"
+# Маркер видимой части, строки которой еще удаляются из БД
+DELETING_SUFFIX = ".deleting"
+# Часть, записанная до появления маркеров: еще не видна, строки в БД
+PENDING_SUFFIX = ".pending"
+LOCK_NAME = ".lock"
+
+JOURNEY_FLAGS = {
+    "has_email_click": "email_click",
+    "has_landing_click": "landing_click",
+    "has_conversion": "conversion",
+    "has_unsubscribe": "unsubscribe"
+}
+
+archived_events = metrics.counter(
+    "archived_events_total",
+    "События, перенесенные из БД в холодный архив"
+)
+
+
+def archive_available() -> bool:
+    return pa is not None
+
+
+@dataclass(frozen=True)
+class ArchiveFilter:
+    """Фильтры страницы кампании; неизменяемый, чтобы служить ключом кэша"""
+    domain: str | None = None
+    email_search: str | None = None
+    param: str | None = None
+    param_value: str | None = None
+
+
+# ==================== ЗАПИСЬ ====================
+
+def _schema():
+    return pa.schema([
+        ("id", pa.int64()),
+        ("event_type", pa.string()),
+        ("email", pa.string()),
+        ("domain", pa.string()),
+        ("ip", pa.string()),
+        ("user_agent", pa.string()),
+        ("extra_params", pa.string()),
+        ("is_bot", pa.bool_()),
+        ("created_at", pa.timestamp("us")),
+        # Продвигаемые параметры отдельными колонками для фильтра без разбора JSON
+        *((f"param_{name}", pa.string()) for name in settings.extra_params_promoted)
+    ])
+
+
+def _to_table(rows: Sequence[Row], schema):
+    ids, event_types, emails, domains, ips, user_agents, extra_params, is_bot, created_at = zip(*rows)
+    columns = [
+        ids, event_types, emails, domains, ips, user_agents,
+        [json.dumps(params, ensure_ascii=False) if params is not None else None for params in extra_params],
+        is_bot, created_at,
+        *(
+            [str(params[name]) if params and name in params else None for params in extra_params]
+            for name in settings.extra_params_promoted
+        )
+    ]
+    return pa.Table.from_arrays(
+        [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+        schema=schema
+    )
+
+
+def _fsync(path: Path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def campaign_directory(campaign_id: int) -> Path:
+    return Path(settings.archive_dir) / f"campaign-{campaign_id}"
+
+
+async def _write_part(ctx: JobContext, campaign_id: int, done: int) -> Path | None:
+    """Пишет события кампании в новую часть и делает ее видимой с маркером удаления"""
+    directory = campaign_directory(campaign_id)
+    directory.mkdir(parents=True, exist_ok=True)
+    name = f"{time.time_ns():020d}"
+    writing = directory / f"{name}.tmp"
+    schema = _schema()
+    writer = pq.ParquetWriter(writing, schema, compression="zstd")
+    rows = 0
+    try:
+        async with db.engine.connect() as conn:
+            result = await conn.stream(
+                select(
+                    Event.id, Event.event_type, Event.email, Event.domain, Event.ip,
+                    Event.user_agent, Event.extra_params, Event.is_bot, Event.created_at
+                )
+                .where(Event.campaign_id == campaign_id)
+                .order_by(Event.id)
+                .execution_options(yield_per=settings.export_chunk_size)
+            )
+            async for partition in result.partitions():
+                await asyncio.to_thread(writer.write_table, _to_table(partition, schema))
+                rows += len(partition)
+                # Heartbeat: без него долгую запись сочли бы брошенной задачей
+                await ctx.report(done, message=f"Writing archive part: {rows} events")
+    finally:
+        writer.close()
+
+    if not rows:
+        writing.unlink()
+        return None
+    _fsync(writing)
+    return _publish(writing)
+
+
+def _publish(written: Path) -> Path:
+    """Делает записанную часть видимой; маркер появляется раньше части"""
+    part = written.with_suffix(PART_SUFFIX)
+    part.with_suffix(DELETING_SUFFIX).touch()
+    os.rename(written, part)
+    _fsync(part.parent)
+    return part
+
+
+async def _finish_part(ctx: JobContext, campaign_id: int, part: Path, done: int) -> int:
+    """Удаляет из БД строки видимой части пачками и снимает маркер удаления"""
+    ids = await asyncio.to_thread(
+        lambda: pq.read_table(part, columns=["id"])["id"].to_pylist()
+    )
+    for start in range(0, len(ids), settings.job_chunk_size):
+        chunk = ids[start:start + settings.job_chunk_size]
+        async with db.async_session_maker() as session:
+            await session.execute(
+                delete(Event).where(Event.campaign_id == campaign_id, Event.id.in_(chunk))
+            )
+            await session.commit()
+        done += len(chunk)
+        archived_events.inc(amount=len(chunk))
+        await ctx.report(done)
+        # Короткая пауза между пачками, чтобы не вытеснять прием событий
+        await asyncio.sleep(settings.job_batch_pause)
+    part.with_suffix(DELETING_SUFFIX).unlink()
+    _fsync(part.parent)
+    return done
+
+
+def _lock_campaign(directory: Path):
+    """Эксклюзивная блокировка каталога кампании на время архивации"""
+    lock = open(directory / LOCK_NAME, "ab")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        raise RuntimeError(f"Campaign archive {directory.name} is being written by another job")
+    return lock
+
+
+@job_handler("archive_campaign")
+async def archive_campaign_job(ctx: JobContext):
+    """Переносит события кампании из БД в холодный архив (params: campaign_id)"""
+    if not archive_available():
+        raise RuntimeError("Campaign archive requires pyarrow to be installed")
+    campaign_id = ctx.params["campaign_id"]
+    directory = campaign_directory(campaign_id)
+    directory.mkdir(parents=True, exist_ok=True)
+    lock = _lock_campaign(directory)
+    try:
+        # Хвосты прерванного запуска: недописанные части удаляются,
+        # удаление строк видимых частей доделывается
+        done = 0
+        for leftover in directory.glob("*.tmp"):
+            leftover.unlink()
+        for pending in sorted(directory.glob(f"*{PENDING_SUFFIX}")):
+            _publish(pending)
+        for marker in sorted(directory.glob(f"*{DELETING_SUFFIX}")):
+            part = marker.with_suffix(PART_SUFFIX)
+            if part.exists():
+                done = await _finish_part(ctx, campaign_id, part, done)
+            else:
+                marker.unlink()
+
+        await ctx.report(done, message="Writing archive part")
+        part = await _write_part(ctx, campaign_id, done)
+        if part is not None:
+            await ctx.report(done, message=f"Removing archived events ({part.stem})")
+            done = await _finish_part(ctx, campaign_id, part, done)
+        await ctx.report(done, total=done, message="Done")
+    finally:
+        lock.close()
+
+
+# ==================== ЧТЕНИЕ ====================
+
+def _mask(table, filters: ArchiveFilter):
+    mask = pc.invert(table["is_bot"])
+    if filters.domain:
+        mask = pc.and_(mask, pc.equal(table["domain"], filters.domain))
+    if filters.email_search:
+        mask = pc.and_(
+            mask, pc.match_substring(table["email"], filters.email_search, ignore_case=True)
+        )
+    if filters.param:
+        column = f"param_{filters.param}"
+        if column not in table.column_names:
+            # Параметр стал продвигаемым после архивации: в архиве его значений нет
+            return pc.and_(mask, pa.scalar(False))
+        mask = pc.and_(mask, pc.fill_null(pc.equal(table[column], filters.param_value), False))
+    return mask
+
+
+def _counts(table, filters: ArchiveFilter, keys: tuple[str, ...]) -> dict[tuple, dict[str, int]]:
+    """Количество событий по типам для каждой комбинации колонок keys"""
+    grouped = (
+        table.filter(_mask(table, filters))
+        .group_by([*keys, "event_type"])
+        .aggregate([("id", "count")])
+    )
+    result: dict[tuple, dict[str, int]] = {}
+    for row in grouped.to_pylist():
+        counts = result.setdefault(tuple(row[key] for key in keys), {})
+        counts[row["event_type"]] = row["id_count"]
+    return result
+
+
+def _journeys(table, filters: ArchiveFilter):
+    """
+    Пути получателей таблицей Arrow, отсортированные по первому событию,
+    свежие первыми. В кэше хранится колоночная таблица, в словари
+    превращается только запрошенная страница.
+    """
+    filtered = table.filter(_mask(table, filters))
+    for flag, event_type in JOURNEY_FLAGS.items():
+        filtered = filtered.append_column(flag, pc.equal(filtered["event_type"], event_type))
+    return (
+        filtered.group_by(["email", "domain"])
+        .aggregate([*((flag, "any") for flag in JOURNEY_FLAGS), ("created_at", "min")])
+        .sort_by([("created_at_min", "descending")])
+    )
+
+
+def _journey_rows(journeys) -> list[dict[str, Any]]:
+    return [
+        {
+            "email": row["email"],
+            "domain": row["domain"],
+            **{flag: row[f"{flag}_any"] for flag in JOURNEY_FLAGS},
+            "first_event": row["created_at_min"]
+        }
+        for row in journeys.to_pylist()
+    ]
+
+
+def _emails(table, filters: ArchiveFilter) -> frozenset[str]:
+    return frozenset(pc.unique(table.filter(_mask(table, filters))["email"]).to_pylist())
+
+
+def _unsubscribed(table) -> frozenset[str]:
+    # Отписка действует и с is_bot: фильтр ботов к ней не применяется
+    mask = pc.equal(table["event_type"], "unsubscribe")
+    return frozenset(pc.unique(table.filter(mask)["email"]).to_pylist())
+
+
+def _timeseries(table, bucket: str, start: datetime, end: datetime) -> dict[datetime, dict[str, int]]:
+    created_at = table["created_at"]
+    mask = pc.and_(
+        _mask(table, ArchiveFilter()),
+        pc.and_(pc.greater_equal(created_at, pa.scalar(start, pa.timestamp("us"))),
+                pc.less(created_at, pa.scalar(end, pa.timestamp("us"))))
+    )
+    filtered = table.filter(mask)
+    filtered = filtered.append_column("bucket", pc.floor_temporal(filtered["created_at"], unit=bucket))
+    return {key[0]: counts for key, counts in _counts(filtered, ArchiveFilter(), ("bucket",)).items()}
+
+
+class ArchiveStore:
+    """Чтение архива кампаний с кэшем таблиц и результатов агрегаций"""
+
+    def __init__(self):
+        self._directory = Path(settings.archive_dir)
+        # (campaign_id, части) -> таблица
+        self._tables: OrderedDict[tuple, Any] = OrderedDict()
+        # (campaign_id, части, агрегация, аргументы) -> результат
+        self._results: OrderedDict[tuple, Any] = OrderedDict()
+
+    def parts(self, campaign_id: int) -> tuple[str, ...]:
+        """Видимые части архива кампании; пустой кортеж, если кампания не в архиве"""
+        if pa is None:
+            return ()
+        try:
+            names = os.listdir(campaign_directory(campaign_id))
+        except FileNotFoundError:
+            return ()
+        return tuple(sorted(name for name in names if name.endswith(PART_SUFFIX)))
+
+    def archived_campaign_ids(self, campaign_ids: Iterable[int] | None = None) -> list[int]:
+        """Архивные кампании из списка или все архивные кампании"""
+        if campaign_ids is None:
+            try:
+                names = os.listdir(self._directory)
+            except FileNotFoundError:
+                return []
+            campaign_ids = [
+                int(name.removeprefix("campaign-")) for name in names
+                if name.startswith("campaign-") and name.removeprefix("campaign-").isdigit()
+            ]
+        return [campaign_id for campaign_id in campaign_ids if self.parts(campaign_id)]
+
+    def archiving(self, campaign_id: int) -> bool:
+        """Идет удаление из БД строк видимой части: события есть и там, и там"""
+        try:
+            names = os.listdir(campaign_directory(campaign_id))
+        except FileNotFoundError:
+            return False
+        return any(name.endswith(DELETING_SUFFIX) for name in names)
+
+    def remove(self, campaign_id: int):
+        """Удаляет архив кампании (при удалении кампании)"""
+        shutil.rmtree(campaign_directory(campaign_id), ignore_errors=True)
+
+    async def _query(self, campaign_id: int, compute: Callable, *args) -> Any:
+        parts = self.parts(campaign_id)
+        if not parts:
+            return None
+        key = (campaign_id, parts, compute.__name__, args)
+        if key in self._results:
+            self._results.move_to_end(key)
+            return self._results[key]
+
+        table_key = (campaign_id, parts)
+        table = self._tables.get(table_key)
+        if table is None:
+            table = await asyncio.to_thread(self._load, campaign_id, parts)
+            self._tables[table_key] = table
+            while len(self._tables) > settings.archive_table_cache_size:
+                self._tables.popitem(last=False)
+        else:
+            self._tables.move_to_end(table_key)
+
+        result = await asyncio.to_thread(compute, table, *args)
+        self._results[key] = result
+        while len(self._results) > settings.archive_result_cache_size:
+            self._results.popitem(last=False)
+        return result
+
+    def _load(self, campaign_id: int, parts: tuple[str, ...]):
+        directory = campaign_directory(campaign_id)
+        tables = [pq.read_table(directory / name, memory_map=True) for name in parts]
+        # Части с разным набором продвигаемых параметров: недостающие колонки — null
+        return pa.concat_tables(tables, promote_options="default")
+
+    async def counts(self, campaign_id: int, filters: ArchiveFilter = ArchiveFilter()) -> dict[str, int] | None:
+        """Количество событий по типам; None, если кампания не в архиве"""
+        result = await self._query(campaign_id, _counts, filters, ())
+        if result is None:
+            return None
+        return result.get((), {})
+
+    async def domain_counts(self, campaign_id: int, filters: ArchiveFilter = ArchiveFilter()) -> dict[str, dict[str, int]]:
+        result = await self._query(campaign_id, _counts, filters, ("domain",))
+        return {key[0]: counts for key, counts in (result or {}).items()}
+
+    async def journeys(
+        self,
+        campaign_id: int,
+        filters: ArchiveFilter = ArchiveFilter(),
+        offset: int = 0,
+        limit: int | None = None
+    ) -> list[dict[str, Any]]:
+        """Страница путей получателей архива, свежие первыми"""
+        journeys = await self._query(campaign_id, _journeys, filters)
+        if journeys is None:
+            return []
+        return _journey_rows(journeys.slice(offset, limit))
+
+    async def journeys_for(
+        self,
+        campaign_id: int,
+        keys: Iterable[tuple[str, str]],
+        filters: ArchiveFilter = ArchiveFilter()
+    ) -> dict[tuple[str, str], dict[str, Any]]:
+        """Пути архива для указанных пар (email, domain)"""
+        keys = set(keys)
+        journeys = await self._query(campaign_id, _journeys, filters)
+        if journeys is None or not keys:
+            return {}
+        emails = pa.array(sorted({email for email, _ in keys}), type=pa.string())
+        rows = _journey_rows(journeys.filter(pc.is_in(journeys["email"], value_set=emails)))
+        return {
+            (row["email"], row["domain"]): row for row in rows
+            if (row["email"], row["domain"]) in keys
+        }
+
+    async def event_batches(self, campaign_id: int, columns: Sequence[str]) -> AsyncIterator[list[tuple]]:
+        """События архива кампании пачками строк (по row group), в порядке id"""
+        directory = campaign_directory(campaign_id)
+        for name in self.parts(campaign_id):
+            parquet = await asyncio.to_thread(pq.ParquetFile, directory / name, memory_map=True)
+            for group in range(parquet.num_row_groups):
+                batch = await asyncio.to_thread(parquet.read_row_group, group, columns=list(columns))
+                yield list(zip(*(batch[column].to_pylist() for column in columns)))
+
+    async def emails(self, campaign_id: int, filters: ArchiveFilter = ArchiveFilter()) -> frozenset[str] | None:
+        return await self._query(campaign_id, _emails, filters)
+
+    async def unsubscribed_emails(self, campaign_id: int) -> frozenset[str]:
+        """Адреса, отписавшиеся от архивной кампании"""
+        return await self._query(campaign_id, _unsubscribed) or frozenset()
+
+    async def timeseries(self, campaign_id: int, bucket: str, start: datetime, end: datetime) -> dict[datetime, dict[str, int]]:
+        return await self._query(campaign_id, _timeseries, bucket, start, end) or {}
+
+    async def totals(self, campaign_ids: Iterable[int] | None = None) -> dict[int, dict[str, int]]:
+        """Количество событий по типам для архивных кампаний из списка"""
+        return {
+            campaign_id: await self.counts(campaign_id)
+            for campaign_id in self.archived_campaign_ids(campaign_ids)
+        }
+
+
+archive_store = ArchiveStore()
@@ -0,0 +1,123 @@
+"""
+Распознавание ботов и предзагрузки ссылок при приеме событий.
+
+Проверяются только события, которые порождает открытие письма: переход по
+ссылке из письма и пиксель открытия. landing_click, conversion и unsubscribe
+отправляют серверы лендингов (обычно HTTP-библиотекой), такие события ботами
+не помечаются.
+
+Событие помечается is_bot, если сработал один из признаков:
+- user agent пустой или совпал с известным сканером или префетчером почтового сервиса
+  (все шаблоны собраны в одно регулярное выражение при импорте);
+- IP клиента входит в одну из подсетей settings.bot_ip_ranges (поиск по
+  префиксному дереву, время не зависит от числа подсетей);
+- клик пришел быстрее settings.bot_min_click_delay секунд после отправки
+  письма (ссылка передает время отправки в параметре sent_at).
+
+Помеченные события сохраняются, но исключаются из статистики дашборда.
+"""
+
+import ipaddress
+import re
+from datetime import datetime, timezone
+from typing import Iterable
+from app.config import settings
+from app.services.metrics import metrics
+
+# Сканеры ссылок, превью и префетчеры почтовых сервисов
+BOT_USER_AGENT_PATTERNS = (
+    # "bot" отдельным словом или токеном продукта (Googlebot/2.1), но не Cubot
+    r"\bbot\b", r"bot/", r"crawler", r"spider", r"scanner",
+    r"preview", r"prefetch", r"headless",
+    r"barracuda", r"proofpoint", r"mimecast", r"safelinks",
+    r"symantec", r"trendmicro", r"fortiguard", r"sophos",
+)
+
+BOT_USER_AGENT_RE = re.compile("|".join(BOT_USER_AGENT_PATTERNS), re.IGNORECASE)
+
+# События из письма, которые проверяются на ботов
+CHECKED_EVENT_TYPES = ("email_click", "open")
+
+bot_events = metrics.counter(
+    "ingest_bot_events_total",
+    "События, помеченные как боты, по признаку",
+    labels=("reason",)
+)
+
+
+class CidrTrie:
+    """Бинарное префиксное дерево подсетей: поиск за число бит адреса"""
+
+    def __init__(self, networks: Iterable[str] = ()):
+        # Отдельные корни для IPv4 и IPv6
+        self._roots: dict[int, dict] = {4: {}, 6: {}}
+        for network in networks:
+            self.add(network)
+
+    def add(self, network: str):
+        net = ipaddress.ip_network(network, strict=False)
+        node = self._roots[net.version]
+        bits = int(net.network_address)
+        width = net.max_prefixlen
+        for i in range(net.prefixlen):
+            bit = (bits >> (width - 1 - i)) & 1
+            node = node.setdefault(bit, {})
+        node["end"] = True
+
+    def __contains__(self, address: str) -> bool:
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        if ip.version == 6 and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+        node = self._roots[ip.version]
+        bits = int(ip)
+        width = ip.max_prefixlen
+        for i in range(width):
+            if "end" in node:
+                return True
+            node = node.get((bits >> (width - 1 - i)) & 1)
+            if node is None:
+                return False
+        return "end" in node
+
+
+bot_networks = CidrTrie(settings.bot_ip_ranges)
+
+
+def parse_sent_at(value: str | None) -> datetime | None:
+    """Время отправки письма из параметра sent_at (unix timestamp, UTC)"""
+    if not value:
+        return None
+    try:
+        return datetime.fromtimestamp(float(value), tz=timezone.utc).replace(tzinfo=None)
+    except (ValueError, OverflowError, OSError):
+        return None
+
+
+def classify_event(
+    event_type: str,
+    ip: str | None,
+    user_agent: str | None,
+    created_at: datetime,
+    sent_at: datetime | None = None
+) -> str | None:
+    """Возвращает признак, по которому событие считается ботом, или None"""
+    if not settings.bot_filter_enabled or event_type not in CHECKED_EVENT_TYPES:
+        return None
+
+    reason = None
+    if not user_agent or BOT_USER_AGENT_RE.search(user_agent):
+        reason = "user_agent"
+    elif ip and ip in bot_networks:
+        reason = "ip"
+    elif (
+        sent_at is not None
+        and (created_at - sent_at).total_seconds() < settings.bot_min_click_delay
+    ):
+        reason = "timing"
+
+    if reason:
+        bot_events.inc(reason)
+    return reason
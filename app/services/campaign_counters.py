@@ -0,0 +1,93 @@
+"""
+Свертка приращений счетчиков кампаний в campaign_counters.
+
+Триггер events_campaign_counters на каждую вставку в events добавляет по
+строке на кампанию в campaign_counter_deltas — обычный INSERT, без
+блокировки строки счетчиков. Этот процесс раз в
+campaign_counters_rollup_interval забирает накопленные приращения пачками
+и прибавляет их к campaign_counters одной командой, так что параллельные
+пачки приема событий горячей кампании не ждут друг друга на ее строке.
+Список кампаний отстает от приема не больше чем на интервал свертки.
+"""
+
+import asyncio
+import logging
+from sqlalchemy import text
+from app.config import settings
+from app.database import db
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory lock: одновременно сворачивает только один процесс
+ROLLUP_LOCK_KEY = 7_100_046
+
+ROLLUP_BATCH_SQL = text("""
+    WITH batch AS (
+        DELETE FROM campaign_counter_deltas
+        WHERE id IN (SELECT id FROM campaign_counter_deltas ORDER BY id LIMIT :limit)
+        RETURNING campaign_id, clicks, conversions
+    ), applied AS (
+        INSERT INTO campaign_counters AS counters (campaign_id, clicks, conversions, updated_at)
+        SELECT campaign_id, sum(clicks), sum(conversions), NOW()
+        FROM batch
+        -- Приращения удаленных кампаний отбрасываются
+        WHERE EXISTS (SELECT 1 FROM campaigns c WHERE c.id = batch.campaign_id)
+        GROUP BY campaign_id
+        ORDER BY campaign_id
+        ON CONFLICT (campaign_id) DO UPDATE SET
+            clicks = counters.clicks + EXCLUDED.clicks,
+            conversions = counters.conversions + EXCLUDED.conversions,
+            updated_at = EXCLUDED.updated_at
+    )
+    SELECT count(*) FROM batch
+""")
+
+
+class CampaignCountersRollup:
+    """Фоновая свертка campaign_counter_deltas -> campaign_counters"""
+
+    def __init__(self):
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self._task:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def rollup(self) -> int:
+        """Сворачивает все накопленные приращения, возвращает число строк приращений"""
+        total = 0
+        while True:
+            async with db.async_session_maker() as session:
+                locked = await session.scalar(
+                    text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": ROLLUP_LOCK_KEY}
+                )
+                if not locked:
+                    return total
+                taken = await session.scalar(
+                    ROLLUP_BATCH_SQL, {"limit": settings.campaign_counters_rollup_batch}
+                )
+                await session.commit()
+            total += taken
+            if taken < settings.campaign_counters_rollup_batch:
+                return total
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.campaign_counters_rollup_interval)
+            try:
+                await self.rollup()
+            except Exception:
+                logger.error("Failed to roll up campaign counters", exc_info=True)
+
+
+campaign_counters_rollup = CampaignCountersRollup()
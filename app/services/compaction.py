@@ -0,0 +1,113 @@
+"""
+Сжатие старых сырых событий в долговременные агрегаты.
+
+Задача compact_events сворачивает события старше settings.raw_retention_days
+в дневные счетчики event_daily_counts (кампания, домен, тип, день) и пути
+получателей recipient_journeys, после чего сырые строки удаляются.
+Каждая пачка из job_chunk_size событий удаляется и добавляется в агрегаты
+одной командой, поэтому прерванная задача не теряет и не удваивает
+счетчики. Запросы статистики (app/services/stats.py) читают живые
+события вместе с агрегатами, так что страницы после сжатия не меняются.
+События ботов в агрегаты не попадают: статистика их не учитывает.
+"""
+
+import asyncio
+from datetime import datetime, time, timedelta
+from sqlalchemy import TextClause, func, select, text
+from app.config import settings
+from app.database import db
+from app.models.database import Event
+from app.services.ingest import utc_now
+from app.services.jobs import JobContext, job_handler
+from app.services.metrics import metrics
+
+compacted_events = metrics.counter(
+    "compacted_events_total",
+    "Сырые события, свернутые в агрегаты и удаленные"
+)
+
+
+def _compact_batch_sql(by_campaign: bool) -> TextClause:
+    campaign_filter = "AND campaign_id = :campaign_id" if by_campaign else ""
+    return text(f"""
+        WITH batch AS (
+            DELETE FROM events
+            WHERE id IN (
+                SELECT id FROM events
+                WHERE created_at < :cutoff {campaign_filter}
+                LIMIT :limit
+            )
+            RETURNING campaign_id, event_type, email, domain, is_bot, created_at
+        ), counted AS (
+            INSERT INTO event_daily_counts AS d (campaign_id, domain, event_type, day, count)
+            SELECT campaign_id, domain, event_type, created_at::date, count(*)
+            FROM batch
+            WHERE NOT is_bot
+            GROUP BY campaign_id, domain, event_type, created_at::date
+            ON CONFLICT (campaign_id, domain, event_type, day)
+            DO UPDATE SET count = d.count + EXCLUDED.count
+        ), journeys AS (
+            INSERT INTO recipient_journeys AS j (
+                campaign_id, email, domain, has_email_click, has_landing_click,
+                has_conversion, has_unsubscribe, first_event
+            )
+            SELECT
+                campaign_id, email, domain,
+                bool_or(event_type = 'email_click'),
+                bool_or(event_type = 'landing_click'),
+                bool_or(event_type = 'conversion'),
+                bool_or(event_type = 'unsubscribe'),
+                min(created_at)
+            FROM batch
+            -- Отписки сохраняются и с is_bot: по ним работает проверка отписок
+            WHERE NOT is_bot OR event_type = 'unsubscribe'
+            GROUP BY campaign_id, email, domain
+            ON CONFLICT (campaign_id, email, domain) DO UPDATE SET
+                has_email_click = j.has_email_click OR EXCLUDED.has_email_click,
+                has_landing_click = j.has_landing_click OR EXCLUDED.has_landing_click,
+                has_conversion = j.has_conversion OR EXCLUDED.has_conversion,
+                has_unsubscribe = j.has_unsubscribe OR EXCLUDED.has_unsubscribe,
+                first_event = LEAST(j.first_event, EXCLUDED.first_event)
+        )
+        SELECT count(*) FROM batch
+    """)
+
+
+def compaction_cutoff(older_than_days: int) -> datetime:
+    """Граница сжатия — начало дня: дневные агрегаты покрывают целые дни"""
+    return datetime.combine(utc_now().date() - timedelta(days=older_than_days), time.min)
+
+
+@job_handler("compact_events")
+async def compact_events_job(ctx: JobContext):
+    """
+    Сворачивает сырые события старше raw_retention_days в агрегаты и удаляет их
+    (params: campaign_id — только одна кампания, older_than_days — срок вместо настройки).
+    """
+    campaign_id = ctx.params.get("campaign_id")
+    cutoff = compaction_cutoff(ctx.params.get("older_than_days", settings.raw_retention_days))
+    conditions = [Event.created_at < cutoff]
+    params = {"cutoff": cutoff, "limit": settings.job_chunk_size}
+    if campaign_id is not None:
+        conditions.append(Event.campaign_id == campaign_id)
+        params["campaign_id"] = campaign_id
+
+    async with db.async_session_maker() as session:
+        total = await session.scalar(select(func.count(Event.id)).where(*conditions))
+    await ctx.report(0, total, message=f"Events before {cutoff.date()}")
+
+    batch_sql = _compact_batch_sql(campaign_id is not None)
+    compacted = 0
+    while True:
+        async with db.async_session_maker() as session:
+            count = await session.scalar(batch_sql, params)
+            await session.commit()
+        if not count:
+            break
+        compacted += count
+        compacted_events.inc(amount=count)
+        await ctx.report(compacted)
+        # Короткая пауза между пачками, чтобы не вытеснять прием событий
+        await asyncio.sleep(settings.job_batch_pause)
+
+    await ctx.report(compacted, total=max(total, compacted), message="Done")
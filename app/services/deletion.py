@@ -0,0 +1,123 @@
+"""
+Удаление кампаний и офферов пачками без загрузки событий в память.
+
+Кампания сначала помечается deleted_at и перестает принимать события,
+затем задача удаляет ее события диапазонами id по settings.job_chunk_size,
+каждый в своей короткой транзакции, и только потом удаляет саму кампанию
+(остаток, успевший записаться, удаляет ON DELETE CASCADE).
+"""
+
+import asyncio
+import time
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import settings
+from app.database import db
+from app.models.database import Campaign, Event, Offer
+from app.services.archive import archive_store
+from app.services.jobs import JobContext, job_handler
+from app.services.offer_cache import offer_catalog, offer_url_cache
+
+
+async def mark_campaigns_deleted(session: AsyncSession, *conditions) -> list[int]:
+    """Помечает кампании удаляемыми и убирает их из кэша редиректов"""
+    result = await session.execute(
+        update(Campaign)
+        .where(*conditions, Campaign.deleted_at.is_(None))
+        .values(deleted_at=func.now())
+        .returning(Campaign.id)
+    )
+    campaign_ids = list(result.scalars().all())
+    for campaign_id in campaign_ids:
+        offer_url_cache.invalidate(campaign_id)
+    return campaign_ids
+
+
+async def _count_events(campaign_ids: list[int]) -> int:
+    async with db.async_session_maker() as session:
+        result = await session.execute(
+            select(func.count(Event.id)).where(Event.campaign_id.in_(campaign_ids))
+        )
+        return result.scalar_one()
+
+
+async def _delete_campaign_events(ctx: JobContext, campaign_id: int, deleted: int) -> int:
+    """
+    Удаляет события кампании диапазонами id, возвращает общий счетчик
+    удаленных. Каждая пачка — сканирование диапазона первичного ключа
+    без повторного прохода по уже удаленным строкам. События, записанные
+    после чтения границ, удалит ON DELETE CASCADE вместе с кампанией.
+    """
+    async with db.async_session_maker() as session:
+        result = await session.execute(
+            select(func.min(Event.id), func.max(Event.id)).where(Event.campaign_id == campaign_id)
+        )
+        first_id, last_id = result.one()
+    if first_id is None:
+        return deleted
+
+    reported_at = time.monotonic()
+    for range_start in range(first_id, last_id + 1, settings.job_chunk_size):
+        async with db.async_session_maker() as session:
+            result = await session.execute(
+                delete(Event).where(
+                    Event.campaign_id == campaign_id,
+                    Event.id >= range_start,
+                    Event.id < range_start + settings.job_chunk_size
+                )
+            )
+            await session.commit()
+        if not result.rowcount:
+            # Диапазоны без событий кампании быстрые, но задача должна
+            # подавать признаки жизни, пока проходит длинные пустые участки
+            if time.monotonic() - reported_at > settings.job_stale_after / 3:
+                await ctx.report(deleted, message=f"Campaign {campaign_id}")
+                reported_at = time.monotonic()
+            continue
+        deleted += result.rowcount
+        await ctx.report(deleted, message=f"Campaign {campaign_id}")
+        reported_at = time.monotonic()
+        # Короткая пауза между пачками, чтобы не вытеснять прием событий
+        await asyncio.sleep(settings.job_batch_pause)
+    return deleted
+
+
+async def _delete_campaigns(ctx: JobContext, campaign_ids: list[int]):
+    total = await _count_events(campaign_ids)
+    await ctx.report(0, total)
+    deleted = 0
+    for campaign_id in campaign_ids:
+        deleted = await _delete_campaign_events(ctx, campaign_id, deleted)
+        # Связанные строки небольшие — их удалит ON DELETE CASCADE
+        async with db.async_session_maker() as session:
+            await session.execute(delete(Campaign).where(Campaign.id == campaign_id))
+            await session.commit()
+        archive_store.remove(campaign_id)
+    await ctx.report(deleted, total=max(total, deleted), message="Done")
+
+
+@job_handler("delete_campaign")
+async def delete_campaign_job(ctx: JobContext):
+    """Удаляет кампанию и все ее данные (params: campaign_id)"""
+    await _delete_campaigns(ctx, [ctx.params["campaign_id"]])
+
+
+@job_handler("delete_offer")
+async def delete_offer_job(ctx: JobContext):
+    """Удаляет оффер вместе со всеми его кампаниями (params: offer_id)"""
+    offer_id = ctx.params["offer_id"]
+    async with db.async_session_maker() as session:
+        # Кампании, созданные после постановки задачи, тоже помечаются
+        await mark_campaigns_deleted(session, Campaign.offer_id == offer_id)
+        result = await session.execute(
+            select(Campaign.id).where(Campaign.offer_id == offer_id).order_by(Campaign.id)
+        )
+        campaign_ids = list(result.scalars().all())
+        await session.commit()
+
+    await _delete_campaigns(ctx, campaign_ids)
+
+    async with db.async_session_maker() as session:
+        await session.execute(delete(Offer).where(Offer.id == offer_id))
+        await session.commit()
+    offer_catalog.invalidate()
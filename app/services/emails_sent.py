@@ -0,0 +1,177 @@
+"""
+Запись количества отправленных писем по доменам кампаний.
+
+emails_sent — INTEGER: суммы приращений насыщаются на INT32_MAX, а не
+переполняют колонку.
+"""
+
+import asyncio
+import logging
+from typing import Iterable, Literal
+from sqlalchemy import BigInteger, Integer, String, bindparam, func, select
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import settings
+from app.database import DB_UNAVAILABLE_ERRORS, db
+from app.models.database import Campaign, CampaignDomainEmails
+from app.models.schemas import INT32_MAX
+
+logger = logging.getLogger(__name__)
+
+EmailsSentMode = Literal["set", "increment"]
+
+EmailsSentKey = tuple[int, str]
+
+
+def coalesce_counts(
+    rows: Iterable[tuple[int, str, int]],
+    mode: EmailsSentMode
+) -> dict[EmailsSentKey, int]:
+    """
+    Схлопывает повторы (campaign_id, domain): при set побеждает последнее
+    значение, при increment значения суммируются. ON CONFLICT DO UPDATE не
+    может обновить одну строку дважды в одной команде.
+    """
+    counts: dict[EmailsSentKey, int] = {}
+    for campaign_id, domain, value in rows:
+        key = (campaign_id, domain)
+        counts[key] = min(counts.get(key, 0) + value, INT32_MAX) if mode == "increment" else value
+    return counts
+
+
+async def upsert_emails_sent(
+    session: AsyncSession,
+    counts: dict[EmailsSentKey, int],
+    mode: EmailsSentMode
+):
+    """
+    Записывает счетчики одной командой INSERT ... SELECT FROM unnest(...)
+    ON CONFLICT DO UPDATE по уникальному ключу (campaign_id, domain).
+    Массивы передаются тремя параметрами, поэтому размер пачки не упирается
+    в лимит параметров запроса.
+    """
+    if not counts:
+        return
+
+    # Единый порядок строк: параллельные UPSERT из разных воркеров
+    # блокируют строки в одной последовательности и не взаимоблокируются
+    keys = sorted(counts)
+    source = func.unnest(
+        bindparam("campaign_ids", [cid for cid, _ in keys], type_=ARRAY(Integer)),
+        bindparam("domains", [domain for _, domain in keys], type_=ARRAY(String)),
+        bindparam("counts", [counts[key] for key in keys], type_=ARRAY(Integer))
+    ).table_valued("campaign_id", "domain", "emails_sent").render_derived()
+
+    stmt = insert(CampaignDomainEmails).from_select(
+        ["campaign_id", "domain", "emails_sent"],
+        select(source.c.campaign_id, source.c.domain, source.c.emails_sent)
+    )
+    if mode == "increment":
+        new_value = func.least(
+            CampaignDomainEmails.emails_sent.cast(BigInteger) + stmt.excluded.emails_sent,
+            INT32_MAX
+        )
+    else:
+        new_value = stmt.excluded.emails_sent
+
+    await session.execute(
+        stmt.on_conflict_do_update(
+            constraint="campaign_domain_emails_campaign_id_domain_key",
+            set_={"emails_sent": new_value, "updated_at": func.now()}
+        )
+    )
+
+
+class EmailsSentCoalescer:
+    """
+    Накапливает приращения emails_sent от многих отправителей в памяти и
+    раз в emails_sent_flush_interval записывает их одним UPSERT, чтобы
+    горячие строки campaign_domain_emails обновлялись раз за окно, а не
+    на каждый отчет MTA.
+    """
+
+    def __init__(self):
+        self._pending: dict[EmailsSentKey, int] = {}
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self._task:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+
+    def add(self, rows: Iterable[tuple[int, str, int]]):
+        """Добавляет приращения (campaign_id, domain, delta)"""
+        for campaign_id, domain, delta in rows:
+            key = (campaign_id, domain)
+            self._pending[key] = min(self._pending.get(key, 0) + delta, INT32_MAX)
+
+    async def flush(self):
+        """Записывает накопленные приращения"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            async with db.async_session_maker() as session:
+                try:
+                    await upsert_emails_sent(session, pending, "increment")
+                    await session.commit()
+                except IntegrityError:
+                    # Кампанию удалили, пока приращения ждали записи
+                    await session.rollback()
+                    pending = await _drop_unknown_campaigns(session, pending)
+                    await upsert_emails_sent(session, pending, "increment")
+                    await session.commit()
+        except DB_UNAVAILABLE_ERRORS:
+            logger.error(f"Failed to flush {len(pending)} emails_sent increments", exc_info=True)
+            self.add((cid, domain, delta) for (cid, domain), delta in pending.items())
+        except Exception:
+            # Ошибка в данных повторялась бы на каждом цикле: пишем построчно
+            # и отбрасываем только отклоненные строки
+            logger.error(f"Batch of {len(pending)} emails_sent increments rejected", exc_info=True)
+            await self._flush_row_by_row(pending)
+
+    async def _flush_row_by_row(self, pending: dict[EmailsSentKey, int]):
+        for key, delta in pending.items():
+            try:
+                async with db.async_session_maker() as session:
+                    await upsert_emails_sent(session, {key: delta}, "increment")
+                    await session.commit()
+            except DB_UNAVAILABLE_ERRORS:
+                self.add([(*key, delta)])
+            except Exception:
+                logger.error(
+                    f"Dropped emails_sent increment campaign_id={key[0]} domain={key[1]} delta={delta}",
+                    exc_info=True
+                )
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.emails_sent_flush_interval)
+            await self.flush()
+
+
+async def _drop_unknown_campaigns(
+    session: AsyncSession,
+    counts: dict[EmailsSentKey, int]
+) -> dict[EmailsSentKey, int]:
+    campaign_ids = {cid for cid, _ in counts}
+    result = await session.execute(select(Campaign.id).where(Campaign.id.in_(campaign_ids)))
+    existing = set(result.scalars().all())
+    dropped = campaign_ids - existing
+    if dropped:
+        logger.warning(f"Dropped emails_sent increments for unknown campaigns: {sorted(dropped)}")
+    return {key: value for key, value in counts.items() if key[0] in existing}
+
+
+emails_sent_coalescer = EmailsSentCoalescer()
@@ -0,0 +1,131 @@
+"""
+Фоновая запись событий в БД вне пути ответа.
+
+Endpoints кладут готовые строки в очередь и сразу отвечают клиенту,
+воркер пишет их пачками одним INSERT в events или events_staging. События, которые не
+поместились в очередь или не записались из-за недоступности БД,
+сохраняются в локальный журнал (app.services.spool). Пачка, отклоненная
+из-за данных (нарушение ограничений, слишком длинное значение), пишется
+построчно, и отбрасываются только отклоненные строки: в журнал они не
+попадают, иначе воспроизведение повторяло бы ту же ошибку.
+"""
+
+import asyncio
+import logging
+from typing import Any
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from app.config import settings
+from app.database import DB_UNAVAILABLE_ERRORS, db
+from app.services.ingest import ingest_model
+from app.services.sketches import sketch_store
+from app.services.spool import event_spool
+from app.services.suppression import suppression_index
+
+logger = logging.getLogger(__name__)
+
+
+class EventWriter:
+    """Очередь событий с пакетной записью в фоне"""
+
+    def __init__(self):
+        self._queue: asyncio.Queue[dict[str, Any] | None] | None = None
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        """Запускает воркер записи"""
+        if self._task:
+            return
+        self._queue = asyncio.Queue(maxsize=settings.event_queue_size)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Дописывает накопленные события и останавливает воркер"""
+        if not self._task:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        self._queue = None
+
+    def submit(self, event: dict[str, Any]) -> bool:
+        """
+        Ставит событие в очередь без ожидания; при переполненной очереди
+        событие уходит в локальный журнал.
+        Возвращает False, если воркер не запущен.
+        """
+        if not self._queue:
+            logger.warning("Event writer is not started, event dropped")
+            return False
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            event_spool.append([event])
+        return True
+
+    async def _run(self):
+        """Собирает пачки из очереди и записывает их"""
+        stopping = False
+        while not stopping:
+            event = await self._queue.get()
+            if event is None:
+                break
+            batch = [event]
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + settings.event_flush_interval
+
+            while len(batch) < settings.event_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    event = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if event is None:
+                    stopping = True
+                    break
+                batch.append(event)
+
+            await self._write(batch)
+
+    async def _write(self, batch: list[dict[str, Any]]):
+        """Записывает пачку одним INSERT, при ошибке в данных — построчно"""
+        try:
+            async with db.async_session_maker() as session:
+                await session.execute(insert(ingest_model()), batch)
+                await session.commit()
+            sketch_store.add_events(batch)
+            suppression_index.add_events(batch)
+            return
+        except IntegrityError:
+            logger.warning(f"Batch of {len(batch)} events violates constraints, retrying row by row")
+        except DB_UNAVAILABLE_ERRORS:
+            logger.warning(f"Failed to write batch of {len(batch)} events, spooling to disk", exc_info=True)
+            event_spool.append(batch)
+            return
+        except Exception:
+            logger.warning(f"Batch of {len(batch)} events rejected, retrying row by row", exc_info=True)
+
+        for event in batch:
+            try:
+                async with db.async_session_maker() as session:
+                    await session.execute(insert(ingest_model()), [event])
+                    await session.commit()
+                sketch_store.add_events([event])
+                suppression_index.add_events([event])
+            except IntegrityError:
+                logger.warning(
+                    f"Event dropped: campaign_id={event['campaign_id']} event_type={event['event_type']}"
+                )
+            except DB_UNAVAILABLE_ERRORS:
+                logger.warning("Failed to write event, spooling to disk", exc_info=True)
+                event_spool.append([event])
+            except Exception:
+                logger.error(
+                    f"Event rejected: campaign_id={event['campaign_id']} event_type={event['event_type']}",
+                    exc_info=True
+                )
+
+
+event_writer = EventWriter()
@@ -0,0 +1,223 @@
+"""
+Потоковые выгрузки данных кампании в CSV и Parquet.
+
+Строки читаются серверным курсором через отдельный пул db.export_engine
+в транзакции REPEATABLE READ READ ONLY (согласованный снимок данных) и
+отдаются клиенту по мере чтения, так что память не зависит от объема.
+Выгрузка событий архивной кампании начинается с частей холодного архива
+(по row group), затем идут события из БД. Статистика по доменам и пути
+получателей строятся только по БД. Parquet требует установленного pyarrow.
+"""
+
+import asyncio
+import csv
+import io
+import json
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Literal, Sequence
+from sqlalchemy import Row, Select, select
+from app.config import settings
+from app.database import db
+from app.models.database import Event
+from app.services.archive import archive_store
+from app.services.stats import EVENT_COUNTERS, domain_stats_query, user_journeys_query
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - pyarrow опционален
+    pa = None
+    pq = None
+
+Dataset = Literal["events", "domains", "journeys"]
+ExportFormat = Literal["csv", "parquet"]
+
+# Ограничение параллельных выгрузок
+export_slots = asyncio.Semaphore(settings.export_max_concurrent)
+
+
+@dataclass(frozen=True)
+class ExportSpec:
+    """Описание набора данных: колонки с типами Parquet и запрос"""
+    columns: tuple[tuple[str, str], ...]
+    query: Callable[[int], Select]
+    # Набор включает события холодного архива
+    archived: bool = False
+
+
+def _events_query(campaign_id: int) -> Select:
+    return (
+        select(
+            Event.id, Event.created_at, Event.event_type, Event.email, Event.domain,
+            Event.ip, Event.user_agent, Event.extra_params, Event.is_bot
+        )
+        .where(Event.campaign_id == campaign_id)
+        .order_by(Event.id)
+    )
+
+
+def _domains_query(campaign_id: int) -> Select:
+    stmt = domain_stats_query(campaign_id)
+    return stmt.order_by(stmt.selected_columns.domain)
+
+
+def _journeys_query(campaign_id: int) -> Select:
+    stmt = user_journeys_query(campaign_id)
+    return stmt.order_by(stmt.selected_columns.email, stmt.selected_columns.domain)
+
+
+EXPORTS: dict[str, ExportSpec] = {
+    "events": ExportSpec(
+        columns=(
+            ("id", "int64"), ("created_at", "timestamp"), ("event_type", "string"),
+            ("email", "string"), ("domain", "string"), ("ip", "string"),
+            ("user_agent", "string"), ("extra_params", "string"), ("is_bot", "bool")
+        ),
+        query=_events_query,
+        archived=True
+    ),
+    "domains": ExportSpec(
+        columns=(
+            ("domain", "string"), ("emails_sent", "int64"),
+            *((key, "int64") for key in EVENT_COUNTERS)
+        ),
+        query=_domains_query
+    ),
+    "journeys": ExportSpec(
+        columns=(
+            ("email", "string"), ("domain", "string"),
+            ("has_email_click", "bool"), ("has_landing_click", "bool"),
+            ("has_conversion", "bool"), ("has_unsubscribe", "bool"),
+            ("first_event", "timestamp")
+        ),
+        query=_journeys_query
+    )
+}
+
+
+def parquet_available() -> bool:
+    return pa is not None
+
+
+async def _stream_partitions(stmt: Select) -> AsyncIterator[Sequence[Row]]:
+    """Читает результат запроса пачками через серверный курсор на снимке данных"""
+    async with db.export_engine.connect() as conn:
+        conn = await conn.execution_options(
+            isolation_level="REPEATABLE READ",
+            postgresql_readonly=True
+        )
+        async with conn.begin():
+            result = await conn.stream(
+                stmt.execution_options(yield_per=settings.export_chunk_size)
+            )
+            async for partition in result.partitions():
+                yield partition
+
+
+async def _campaign_partitions(
+    spec: ExportSpec,
+    campaign_id: int,
+    stmt: Select
+) -> AsyncIterator[Sequence[Row]]:
+    """Пачки строк набора: сначала из архива кампании, затем из БД"""
+    if spec.archived:
+        columns = [name for name, _ in spec.columns]
+        async for batch in archive_store.event_batches(campaign_id, columns):
+            yield batch
+    async for partition in _stream_partitions(stmt):
+        yield partition
+
+
+def _plain_value(value: Any) -> Any:
+    """JSON поля выгружаются строкой"""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+async def _csv_chunks(spec: ExportSpec, partitions: AsyncIterator[Sequence[Row]]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in spec.columns])
+    async for partition in partitions:
+        writer.writerows([_plain_value(value) for value in row] for row in partition)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Файл для ParquetWriter, из которого записанные байты забираются по частям"""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        # ParquetWriter пишет в футер абсолютные смещения
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _arrow_schema(spec: ExportSpec):
+    types = {
+        "int64": pa.int64(),
+        "string": pa.string(),
+        "bool": pa.bool_(),
+        "timestamp": pa.timestamp("us")
+    }
+    return pa.schema([(name, types[kind]) for name, kind in spec.columns])
+
+
+async def _parquet_chunks(spec: ExportSpec, partitions: AsyncIterator[Sequence[Row]]) -> AsyncIterator[bytes]:
+    schema = _arrow_schema(spec)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        async for partition in partitions:
+            columns = list(zip(*partition))
+            table = pa.Table.from_arrays(
+                [
+                    pa.array([_plain_value(value) for value in column], type=field.type)
+                    for column, field in zip(columns, schema)
+                ],
+                schema=schema
+            )
+            # Каждая пачка — отдельная row group, сразу уходит клиенту
+            writer.write_table(table)
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+async def export_chunks(
+    campaign_id: int,
+    dataset: Dataset,
+    export_format: ExportFormat
+) -> AsyncIterator[bytes]:
+    """
+    Генератор байтов выгрузки. Слот выгрузки занимается здесь, а не в
+    обработчике, чтобы он освобождался при любом завершении стрима.
+    """
+    spec = EXPORTS[dataset]
+    stmt = spec.query(campaign_id)
+    chunks = _parquet_chunks if export_format == "parquet" else _csv_chunks
+    async with export_slots:
+        async for chunk in chunks(spec, _campaign_partitions(spec, campaign_id, stmt)):
+            if chunk:
+                yield chunk
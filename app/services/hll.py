@@ -0,0 +1,58 @@
+"""
+HyperLogLog для приближенного подсчета уникальных значений.
+
+Скетчи объединяются поэлементным максимумом регистров, поэтому их можно
+копить независимо в разных процессах и сливать в БД.
+"""
+
+import hashlib
+import math
+
+DEFAULT_PRECISION = 12  # 4096 регистров, стандартная ошибка ~1.6%
+
+
+class HyperLogLog:
+    """Скетч HyperLogLog с 64-битным хэшем"""
+
+    def __init__(self, precision: int = DEFAULT_PRECISION, registers: bytes | None = None):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(registers) if registers else bytearray(self.m)
+        if len(self.registers) != self.m:
+            raise ValueError(f"Expected {self.m} registers, got {len(self.registers)}")
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        """Восстанавливает скетч из сериализованных регистров"""
+        return cls(precision=len(data).bit_length() - 1, registers=data)
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.registers)
+
+    def add(self, value: str):
+        """Добавляет значение в скетч"""
+        x = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+        index = x >> (64 - self.precision)
+        rest_bits = 64 - self.precision
+        rest = x & ((1 << rest_bits) - 1)
+        # Позиция первой единицы в оставшихся битах
+        rank = rest_bits - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog"):
+        """Объединяет другой скетч с этим"""
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge sketches with different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> int:
+        """Оценка количества уникальных значений"""
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        # Для малых значений точнее linear counting
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
@@ -0,0 +1,112 @@
+"""
+Общая логика приема событий для /api/event и трекинговых endpoints
+"""
+
+import ipaddress
+import uuid
+from datetime import datetime, timezone
+from typing import Any
+from fastapi import Request
+from app.config import settings
+from app.models.database import Event, EventStaging
+from app.services.bot_filter import CidrTrie, classify_event, parse_sent_at
+
+# Допустимые типы событий
+EVENT_TYPES = ("email_click", "landing_click", "conversion", "unsubscribe", "open")
+
+# Параметры, которые не попадают в extra_params
+RESERVED_PARAMS = ("cid", "event", "email", "domain", "sent_at")
+
+
+trusted_proxies = CidrTrie(settings.trusted_proxies)
+
+
+def client_ip(request: Request) -> str | None:
+    """
+    IP клиента. Если запрос пришел от доверенного прокси (settings.trusted_proxies),
+    адрес берется из X-Forwarded-For: первый справа, не принадлежащий
+    доверенным прокси. Адреса левее него клиент мог подставить сам.
+    """
+    if not request.client:
+        return None
+    ip = request.client.host
+    if ip not in trusted_proxies:
+        return ip
+    for candidate in reversed(request.headers.get("x-forwarded-for", "").split(",")):
+        candidate = candidate.strip()
+        try:
+            ipaddress.ip_address(candidate)
+        except ValueError:
+            break
+        ip = candidate
+        if ip not in trusted_proxies:
+            break
+    return ip
+
+
+def ingest_model() -> type[Event] | type[EventStaging]:
+    """Таблица, в которую пишутся принятые события (settings.event_ingest_mode)"""
+    return EventStaging if settings.event_ingest_mode == "staging" else Event
+
+
+def utc_now() -> datetime:
+    """Текущее время в UTC без tzinfo (колонки TIMESTAMP без часового пояса)"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def extract_extra_params(request: Request) -> dict[str, Any] | None:
+    """
+    Собирает дополнительные query параметры запроса в пределах лимитов:
+    продвигаемые параметры (settings.extra_params_promoted) сохраняются
+    всегда, остальные — пока не набрано extra_params_max_keys ключей.
+    Слишком длинные ключи отбрасываются, значения обрезаются.
+    """
+    promoted = settings.extra_params_promoted
+    max_value_length = settings.extra_params_max_value_length
+
+    extra_params: dict[str, str] = {}
+    for key in promoted:
+        value = request.query_params.get(key)
+        if value is not None:
+            extra_params[key] = value[:max_value_length]
+
+    for key, value in request.query_params.items():
+        if len(extra_params) >= settings.extra_params_max_keys:
+            break
+        if key in RESERVED_PARAMS or key in extra_params:
+            continue
+        if len(key) > settings.extra_params_max_key_length:
+            continue
+        extra_params[key] = value[:max_value_length]
+    return extra_params or None
+
+
+def build_event(
+    request: Request,
+    campaign_id: int,
+    event_type: str,
+    email: str,
+    domain: str
+) -> dict[str, Any]:
+    """
+    Формирует строку для вставки в events.
+    created_at фиксируется в момент приема, а не в момент записи в БД.
+    is_bot выставляется классификатором ботов и префетчеров, event_key
+    защищает от дублей при повторной записи из локального журнала.
+    """
+    ip = client_ip(request)
+    user_agent = request.headers.get("user-agent")
+    created_at = utc_now()
+    sent_at = parse_sent_at(request.query_params.get("sent_at"))
+    return {
+        "event_key": uuid.uuid4(),
+        "campaign_id": campaign_id,
+        "event_type": event_type,
+        "email": email,
+        "domain": domain,
+        "ip": ip,
+        "user_agent": user_agent,
+        "extra_params": extract_extra_params(request),
+        "is_bot": classify_event(event_type, ip, user_agent, created_at, sent_at) is not None,
+        "created_at": created_at
+    }
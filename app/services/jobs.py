@@ -0,0 +1,231 @@
+"""
+Фоновые задачи обслуживания на таблице jobs.
+
+Задача ставится в очередь строкой со статусом pending, воркеры процесса
+дашборда забирают ее через FOR UPDATE SKIP LOCKED, так что несколько
+процессов не возьмут одну задачу. Обработчик работает пачками в своих
+сессиях и сообщает прогресс через JobContext.
+"""
+
+import asyncio
+import logging
+from datetime import timedelta
+from typing import Any, Awaitable, Callable
+from sqlalchemy import select, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import settings
+from app.database import db
+from app.models.database import Job, Campaign, Offer
+from app.services.offer_cache import offer_url_cache
+from app.services.sketches import rebuild_campaign_sketches
+
+logger = logging.getLogger(__name__)
+
+JOB_STATUSES = ("pending", "running", "done", "failed")
+
+
+class JobContext:
+    """Параметры задачи и отчет о прогрессе"""
+
+    def __init__(self, job_id: int, params: dict[str, Any]):
+        self.job_id = job_id
+        self.params = params
+
+    async def report(self, progress: int, total: int | None = None, message: str | None = None):
+        """Сохраняет прогресс; заодно служит heartbeat для обнаружения брошенных задач"""
+        values: dict[str, Any] = {"progress": progress, "updated_at": func.now()}
+        if total is not None:
+            values["total"] = total
+        if message is not None:
+            values["message"] = message
+        async with db.async_session_maker() as session:
+            await session.execute(update(Job).where(Job.id == self.job_id).values(**values))
+            await session.commit()
+
+
+JobHandler = Callable[[JobContext], Awaitable[None]]
+
+JOB_HANDLERS: dict[str, JobHandler] = {}
+
+
+def job_handler(kind: str):
+    """Регистрирует обработчик задач указанного типа"""
+    def decorator(handler: JobHandler) -> JobHandler:
+        JOB_HANDLERS[kind] = handler
+        return handler
+    return decorator
+
+
+async def enqueue_job(session: AsyncSession, kind: str, params: dict[str, Any] | None = None) -> Job:
+    """Ставит задачу в очередь в рамках сессии запроса"""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    job = Job(kind=kind, params=params or {}, status="pending", progress=0)
+    session.add(job)
+    await session.flush()
+    return job
+
+
+class JobRunner:
+    """Воркеры, выполняющие задачи из таблицы jobs"""
+
+    def __init__(self):
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._worker(n))
+            for n in range(settings.job_workers)
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self, number: int):
+        while True:
+            try:
+                job = await self._claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.error(f"Job worker {number} failed to claim a job", exc_info=True)
+                job = None
+
+            if job is None:
+                await asyncio.sleep(settings.job_poll_interval)
+                continue
+
+            await self._execute(job)
+
+    async def _claim(self) -> Job | None:
+        """Забирает следующую задачу, возвращая в очередь брошенные"""
+        async with db.async_session_maker() as session:
+            stale_before = func.now() - timedelta(seconds=settings.job_stale_after)
+            await session.execute(
+                update(Job)
+                .where(Job.status == "running", Job.updated_at < stale_before)
+                .values(status="pending", message="Requeued after worker stopped responding")
+            )
+            next_id = (
+                select(Job.id)
+                .where(Job.status == "pending")
+                .order_by(Job.id)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+                .scalar_subquery()
+            )
+            result = await session.execute(
+                update(Job)
+                .where(Job.id == next_id)
+                .values(status="running", started_at=func.now(), updated_at=func.now(), error=None)
+                .returning(Job)
+            )
+            job = result.scalar_one_or_none()
+            await session.commit()
+            return job
+
+    async def _execute(self, job: Job):
+        handler = JOB_HANDLERS.get(job.kind)
+        context = JobContext(job.id, job.params or {})
+        try:
+            if handler is None:
+                raise ValueError(f"Unknown job kind: {job.kind}")
+            logger.info(f"Job {job.id} ({job.kind}) started")
+            await handler(context)
+        except asyncio.CancelledError:
+            # Остановка процесса: задача вернется в очередь и продолжится
+            await self._finish(job.id, "pending", message="Interrupted by shutdown")
+            raise
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.kind}) failed", exc_info=True)
+            await self._finish(job.id, "failed", error=f"{type(e).__name__}: {e}")
+        else:
+            logger.info(f"Job {job.id} ({job.kind}) done")
+            await self._finish(job.id, "done")
+
+    async def _finish(self, job_id: int, status: str, message: str | None = None, error: str | None = None):
+        values: dict[str, Any] = {"status": status, "updated_at": func.now(), "error": error}
+        if status in ("done", "failed"):
+            values["finished_at"] = func.now()
+        if message is not None:
+            values["message"] = message
+        async with db.async_session_maker() as session:
+            await session.execute(update(Job).where(Job.id == job_id).values(**values))
+            await session.commit()
+
+
+job_runner = JobRunner()
+
+
+# ==================== ОБРАБОТЧИКИ ====================
+
+@job_handler("rebuild_sketches")
+async def rebuild_sketches_job(ctx: JobContext):
+    """
+    Пересчитывает HyperLogLog скетчи кампании по ее событиям
+    (params: campaign_id) или всех кампаний, если campaign_id не задан.
+    """
+    campaign_id = ctx.params.get("campaign_id")
+    if campaign_id is not None:
+        campaign_ids = [campaign_id]
+    else:
+        async with db.async_session_maker() as session:
+            result = await session.execute(select(Campaign.id).order_by(Campaign.id))
+            campaign_ids = list(result.scalars().all())
+
+    await ctx.report(0, len(campaign_ids))
+    for done, cid in enumerate(campaign_ids, start=1):
+        async with db.async_session_maker() as session:
+            await rebuild_campaign_sketches(session, cid)
+            await session.commit()
+        await ctx.report(done, message=f"Campaign {cid}")
+
+
+@job_handler("repoint_offer")
+async def repoint_offer_job(ctx: JobContext):
+    """
+    Переносит все кампании оффера на другой оффер пачками
+    (params: offer_id, target_offer_id).
+    """
+    offer_id = ctx.params["offer_id"]
+    target_offer_id = ctx.params["target_offer_id"]
+
+    async with db.async_session_maker() as session:
+        result = await session.execute(select(Offer.url).where(Offer.id == target_offer_id))
+        target_url = result.scalar_one_or_none()
+        if target_url is None:
+            raise ValueError(f"Offer {target_offer_id} not found")
+        result = await session.execute(
+            select(func.count(Campaign.id)).where(Campaign.offer_id == offer_id)
+        )
+        total = result.scalar_one()
+
+    await ctx.report(0, total)
+    moved = 0
+    while True:
+        async with db.async_session_maker() as session:
+            result = await session.execute(
+                select(Campaign.id)
+                .where(Campaign.offer_id == offer_id)
+                .order_by(Campaign.id)
+                .limit(settings.job_chunk_size)
+            )
+            campaign_ids = list(result.scalars().all())
+            if not campaign_ids:
+                break
+            await session.execute(
+                update(Campaign)
+                .where(Campaign.id.in_(campaign_ids))
+                .values(offer_id=target_offer_id, offer_url=target_url)
+            )
+            await session.commit()
+
+        for cid in campaign_ids:
+            offer_url_cache.set(cid, target_offer_id, target_url)
+        moved += len(campaign_ids)
+        await ctx.report(moved)
@@ -0,0 +1,110 @@
+"""
+Метрики процесса в текстовом формате Prometheus.
+
+Счетчики и gauge хранятся в памяти процесса без внешних зависимостей;
+каждый воркер uvicorn отдает на /metrics свои значения.
+"""
+
+import math
+from typing import Callable
+
+LabelValues = tuple[str, ...]
+
+
+class Counter:
+    """Монотонный счетчик с метками"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self) -> dict[LabelValues, float]:
+        return dict(self._values)
+
+
+class Gauge:
+    """Текущее значение, вычисляемое при сборе метрик"""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        collect: Callable[[], dict[LabelValues, float]],
+        labels: tuple[str, ...] = ()
+    ):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._collect = collect
+
+    def samples(self) -> dict[LabelValues, float]:
+        return self._collect()
+
+
+class MetricsRegistry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self._metrics: dict[str, Counter | Gauge] = {}
+
+    def counter(self, name: str, description: str, labels: tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, description, labels)
+        self._metrics[name] = metric
+        return metric
+
+    def gauge(
+        self,
+        name: str,
+        description: str,
+        collect: Callable[[], dict[LabelValues, float]],
+        labels: tuple[str, ...] = ()
+    ) -> Gauge:
+        metric = Gauge(name, description, collect, labels)
+        self._metrics[name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Текстовый формат exposition 0.0.4"""
+        lines: list[str] = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for label_values, value in metric.samples().items():
+                lines.append(f"{metric.name}{_format_labels(metric.labels, label_values)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_value(value: float) -> str:
+    """Значение без потери точности: формат :g оставляет 6 значащих цифр"""
+    if isinstance(value, int):
+        return str(int(value))
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _format_labels(names: tuple[str, ...], values: LabelValues) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+metrics = MetricsRegistry()
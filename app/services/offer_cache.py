@@ -0,0 +1,242 @@
+"""
+Кэши офферов в памяти процесса.
+
+OfferUrlCache — offer_url кампаний для трекинговых редиректов. Прогревается
+при старте, обновляется при изменении офферов в этом процессе. Устаревшие
+записи (старше offer_cache_ttl) отдаются сразу и обновляются в фоне, поэтому
+изменения из других процессов подхватываются без ожидания БД на пути ответа.
+Промахи тоже кэшируются на offer_cache_miss_ttl, чтобы запросы с
+несуществующими кампаниями не ходили в БД каждый раз.
+
+OfferCatalog — справочник офферов (id -> название, url) для выпадающих
+списков дашборда и поиска по началу названия.
+"""
+
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from dataclasses import dataclass
+from sqlalchemy import select, func
+from app.config import settings
+from app.database import db
+from app.models.database import Campaign, Offer
+
+logger = logging.getLogger(__name__)
+
+# Предел числа запомненных промахов: сверх него устаревшие записи вычищаются
+MISSES_LIMIT = 100_000
+
+
+class OfferUrlCache:
+    """
+    campaign_id -> (offer_id, собственный offer_url, время загрузки)
+    и offer_id -> url оффера. URL кампании с оффером берется из второго
+    словаря, поэтому изменение оффера обновляет все его кампании за O(1).
+    """
+
+    def __init__(self):
+        self._entries: dict[int, tuple[int | None, str, float]] = {}
+        self._offer_urls: dict[int, str] = {}
+        # campaign_id -> момент, до которого кампания считается отсутствующей
+        self._misses: dict[int, float] = {}
+        self._refreshing: set[int] = set()
+        self._tasks: set[asyncio.Task] = set()
+
+    async def warm(self):
+        """Загружает offer_url всех кампаний"""
+        async with db.async_session_maker() as session:
+            result = await session.execute(
+                _campaign_urls_query().where(Campaign.deleted_at.is_(None))
+            )
+            now = time.monotonic()
+            self._entries = {}
+            self._offer_urls = {}
+            self._misses = {}
+            for row in result.all():
+                self._store(row.id, row.offer_id, row.offer_url, now)
+        logger.info(f"Offer URL cache warmed: {len(self._entries)} campaigns")
+
+    def get(self, campaign_id: int) -> str | None:
+        """Возвращает offer_url из кэша, не обращаясь к БД"""
+        entry = self._entries.get(campaign_id)
+        if not entry:
+            return None
+        if time.monotonic() - entry[2] > settings.offer_cache_ttl:
+            self._schedule_refresh(campaign_id)
+        offer_id, offer_url, _ = entry
+        if offer_id is not None:
+            return self._offer_urls.get(offer_id, offer_url)
+        return offer_url
+
+    async def resolve(self, campaign_id: int) -> str | None:
+        """Возвращает offer_url, при промахе кэша загружает его из БД"""
+        offer_url = self.get(campaign_id)
+        if offer_url is not None:
+            return offer_url
+        if self._misses.get(campaign_id, 0.0) > time.monotonic():
+            return None
+        return await self._load(campaign_id)
+
+    def set(self, campaign_id: int, offer_id: int | None, offer_url: str):
+        """Записывает актуальный offer_url кампании"""
+        self._store(campaign_id, offer_id, offer_url, time.monotonic())
+
+    def update_offer(self, offer_id: int, offer_url: str):
+        """Обновляет URL оффера сразу для всех его кампаний"""
+        self._offer_urls[offer_id] = offer_url
+
+    def invalidate(self, campaign_id: int):
+        """Удаляет кампанию из кэша"""
+        self._entries.pop(campaign_id, None)
+
+    def _store(self, campaign_id: int, offer_id: int | None, offer_url: str, loaded_at: float):
+        self._misses.pop(campaign_id, None)
+        self._entries[campaign_id] = (offer_id, offer_url, loaded_at)
+        if offer_id is not None:
+            self._offer_urls[offer_id] = offer_url
+
+    async def _load(self, campaign_id: int) -> str | None:
+        async with db.async_session_maker() as session:
+            result = await session.execute(
+                _campaign_urls_query()
+                .where(Campaign.id == campaign_id, Campaign.deleted_at.is_(None))
+            )
+            row = result.first()
+        if not row:
+            self.invalidate(campaign_id)
+            self._remember_miss(campaign_id)
+            return None
+        self.set(campaign_id, row.offer_id, row.offer_url)
+        return row.offer_url
+
+    def _remember_miss(self, campaign_id: int):
+        now = time.monotonic()
+        if len(self._misses) >= MISSES_LIMIT:
+            self._misses = {key: until for key, until in self._misses.items() if until > now}
+            if len(self._misses) >= MISSES_LIMIT:
+                self._misses.clear()
+        self._misses[campaign_id] = now + settings.offer_cache_miss_ttl
+
+    def _schedule_refresh(self, campaign_id: int):
+        if campaign_id in self._refreshing:
+            return
+        self._refreshing.add(campaign_id)
+        task = asyncio.create_task(self._refresh(campaign_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refresh(self, campaign_id: int):
+        try:
+            await self._load(campaign_id)
+        except Exception:
+            logger.warning(f"Failed to refresh offer URL for campaign {campaign_id}", exc_info=True)
+        finally:
+            self._refreshing.discard(campaign_id)
+
+
+@dataclass(frozen=True)
+class CatalogOffer:
+    id: int
+    name: str
+    url: str
+
+
+class OfferCatalog:
+    """
+    Все офферы, отсортированные по названию без учета регистра, и индекс по id.
+    Создание и изменение оффера увеличивают версию справочника, и следующее
+    чтение перезагружает его из БД; изменения из других процессов
+    подхватываются фоновой перезагрузкой раз в offer_cache_ttl.
+    Поиск по префиксу — бинарный поиск по отсортированным названиям.
+    """
+
+    def __init__(self):
+        self._offers: list[CatalogOffer] = []
+        self._keys: list[str] = []
+        self._by_id: dict[int, CatalogOffer] = {}
+        self._version = 0
+        self._loaded_version: int | None = None
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+        self._refresh_task: asyncio.Task | None = None
+
+    def invalidate(self):
+        """Помечает справочник устаревшим; вызывается после коммита изменений офферов"""
+        self._version += 1
+
+    async def get(self, offer_id: int) -> CatalogOffer | None:
+        await self._ensure_fresh()
+        return self._by_id.get(offer_id)
+
+    async def count(self) -> int:
+        await self._ensure_fresh()
+        return len(self._offers)
+
+    async def search(
+        self,
+        prefix: str = "",
+        limit: int | None = None,
+        exclude: int | None = None
+    ) -> list[CatalogOffer]:
+        """Офферы, название которых начинается с prefix, по алфавиту"""
+        await self._ensure_fresh()
+        # Перезагрузка заменяет списки целиком, локальные ссылки остаются согласованными
+        offers, keys = self._offers, self._keys
+        key = prefix.strip().casefold()
+        found = []
+        for index in range(bisect_left(keys, key), len(keys)):
+            if not keys[index].startswith(key) or (limit is not None and len(found) >= limit):
+                break
+            if offers[index].id != exclude:
+                found.append(offers[index])
+        return found
+
+    async def _ensure_fresh(self):
+        if self._loaded_version != self._version:
+            await self._reload()
+        elif time.monotonic() - self._loaded_at > settings.offer_cache_ttl:
+            self._schedule_refresh()
+
+    async def _reload(self, force: bool = False):
+        async with self._lock:
+            version = self._version
+            # Пока ждали блокировку, справочник мог загрузить другой запрос
+            if not force and self._loaded_version == version:
+                return
+            async with db.dashboard_session_maker() as session:
+                result = await session.execute(select(Offer.id, Offer.name, Offer.url))
+                offers = [CatalogOffer(row.id, row.name, row.url) for row in result.all()]
+            offers.sort(key=lambda offer: (offer.name.casefold(), offer.id))
+            self._offers = offers
+            self._keys = [offer.name.casefold() for offer in offers]
+            self._by_id = {offer.id: offer for offer in offers}
+            self._loaded_version = version
+            self._loaded_at = time.monotonic()
+
+    def _schedule_refresh(self):
+        if self._refresh_task and not self._refresh_task.done():
+            return
+        self._refresh_task = asyncio.create_task(self._refresh())
+
+    async def _refresh(self):
+        try:
+            await self._reload(force=True)
+        except Exception:
+            logger.warning("Failed to refresh offer catalog", exc_info=True)
+
+
+def _campaign_urls_query():
+    """URL кампании берется из оффера, если он есть: offer_url кампании — запасной"""
+    return (
+        select(
+            Campaign.id,
+            Campaign.offer_id,
+            func.coalesce(Offer.url, Campaign.offer_url).label("offer_url")
+        )
+        .outerjoin(Offer, Campaign.offer_id == Offer.id)
+    )
+
+
+offer_url_cache = OfferUrlCache()
+offer_catalog = OfferCatalog()
@@ -0,0 +1,127 @@
+"""
+Ограничение частоты приема событий: token bucket по IP клиента и по кампании.
+
+Корзины хранятся в памяти процесса в OrderedDict с вытеснением давно
+не использовавшихся ключей, поэтому память ограничена rate_limit_max_keys
+записями на каждую область. Лимиты действуют в пределах одного процесса.
+Редиректы и пиксели (tracking_rate_limiter) считаются в своих корзинах
+с настройками rate_limit_tracking_*, отдельно от /api/event.
+IP клиента за обратным прокси определяется по X-Forwarded-For
+(ingest.client_ip); серверы лендингов из rate_limit_exempt_networks
+ограничиваются только лимитом кампании.
+"""
+
+import math
+import time
+from collections import OrderedDict
+from app.config import settings
+from app.services.bot_filter import CidrTrie
+from app.services.metrics import metrics
+
+rate_limit_rejections = metrics.counter(
+    "ingest_rate_limited_total",
+    "Запросы приема событий, отклоненные лимитом частоты",
+    labels=("scope",)
+)
+
+
+class TokenBucketLimiter:
+    """
+    Token bucket на ключ: rate токенов в секунду, не больше burst.
+    Запись ключа — [токены, время последнего пополнения].
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, list[float]] = OrderedDict()
+
+    def acquire(self, key: str) -> float:
+        """Списывает токен; возвращает 0 при успехе или секунды до появления токена"""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [self.burst, now]
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / self.rate
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class IngestRateLimiter:
+    """
+    Лимиты приема событий по IP клиента и по кампании.
+    scope_prefix отличает области этого набора корзин в метриках.
+    """
+
+    def __init__(
+        self,
+        ip_rate: float,
+        ip_burst: float,
+        campaign_rate: float,
+        campaign_burst: float,
+        scope_prefix: str = ""
+    ):
+        self.exempt_networks = CidrTrie(settings.rate_limit_exempt_networks)
+        self.by_ip = TokenBucketLimiter(ip_rate, ip_burst, settings.rate_limit_max_keys)
+        self.by_campaign = TokenBucketLimiter(campaign_rate, campaign_burst, settings.rate_limit_max_keys)
+        self.ip_scope = f"{scope_prefix}ip"
+        self.campaign_scope = f"{scope_prefix}campaign"
+
+    def check(self, ip: str | None, campaign_id: int) -> int:
+        """
+        Проверяет оба лимита. Возвращает 0, если запрос разрешен,
+        иначе значение Retry-After в целых секундах.
+        """
+        if not settings.rate_limit_enabled:
+            return 0
+        if ip and ip not in self.exempt_networks:
+            wait = self.by_ip.acquire(ip)
+            if wait:
+                rate_limit_rejections.inc(self.ip_scope)
+                return math.ceil(wait)
+        wait = self.by_campaign.acquire(str(campaign_id))
+        if wait:
+            rate_limit_rejections.inc(self.campaign_scope)
+            return math.ceil(wait)
+        return 0
+
+
+ingest_rate_limiter = IngestRateLimiter(
+    settings.rate_limit_ip_rate,
+    settings.rate_limit_ip_burst,
+    settings.rate_limit_campaign_rate,
+    settings.rate_limit_campaign_burst
+)
+tracking_rate_limiter = IngestRateLimiter(
+    settings.rate_limit_tracking_ip_rate,
+    settings.rate_limit_tracking_ip_burst,
+    settings.rate_limit_tracking_campaign_rate,
+    settings.rate_limit_tracking_campaign_burst,
+    scope_prefix="tracking_"
+)
+
+metrics.gauge(
+    "ingest_rate_limit_keys",
+    "Отслеживаемые ключи лимита частоты",
+    lambda: {
+        (limiter.ip_scope,): len(limiter.by_ip)
+        for limiter in (ingest_rate_limiter, tracking_rate_limiter)
+    } | {
+        (limiter.campaign_scope,): len(limiter.by_campaign)
+        for limiter in (ingest_rate_limiter, tracking_rate_limiter)
+    },
+    labels=("scope",)
+)
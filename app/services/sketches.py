@@ -0,0 +1,242 @@
+"""
+Поддержка HyperLogLog скетчей уникальных получателей.
+
+При приеме событий email добавляется в локальные скетчи кампании и домена,
+фоновая задача периодически сливает их в campaign_sketches. Дашборд читает
+приближенное количество уникальных email вместо count(distinct).
+
+Скетчи кампании, события которой записаны до их появления, неполны: такая
+кампания считается точно, пока задача rebuild_sketches не пересчитает ее
+скетчи и не отметит строку кампании complete. Новые кампании создаются
+с пустым полным скетчем.
+"""
+
+import asyncio
+import logging
+from typing import Any, Iterable
+from sqlalchemy import func, select, tuple_, union
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import settings
+from app.database import DB_UNAVAILABLE_ERRORS, db
+from app.models.database import Campaign, CampaignSketch, Event, RecipientJourney
+from app.services.hll import HyperLogLog
+
+logger = logging.getLogger(__name__)
+
+# Ключ скетча всей кампании
+CAMPAIGN_KEY = ""
+
+SketchKey = tuple[int, str]
+
+# Сколько скетчей объединяется одной пачкой запросов: ограничивает число
+# параметров в одной команде
+MERGE_CHUNK_SIZE = 5000
+
+
+class SketchStore:
+    """Локальные несохраненные скетчи и их периодическая запись в БД"""
+
+    def __init__(self):
+        self._pending: dict[SketchKey, HyperLogLog] = {}
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self._task:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+
+    def add(self, campaign_id: int, domain: str, email: str):
+        """Учитывает email в скетчах кампании и домена"""
+        for key in ((campaign_id, CAMPAIGN_KEY), (campaign_id, domain)):
+            sketch = self._pending.get(key)
+            if sketch is None:
+                sketch = self._pending[key] = HyperLogLog()
+            sketch.add(email)
+
+    def add_events(self, events: Iterable[dict[str, Any]]):
+        for event in events:
+            if not event.get("is_bot"):
+                self.add(event["campaign_id"], event["domain"], event["email"])
+
+    def pending(self, campaign_id: int, domain: str = CAMPAIGN_KEY) -> HyperLogLog | None:
+        return self._pending.get((campaign_id, domain))
+
+    async def flush(self):
+        """Сливает локальные скетчи в БД"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            async with db.async_session_maker() as session:
+                await merge_sketches(session, pending)
+                await session.commit()
+        except DB_UNAVAILABLE_ERRORS:
+            logger.error(f"Failed to flush {len(pending)} sketches", exc_info=True)
+            # Возвращаем несохраненное обратно, объединяя с накопленным за это время
+            for key, sketch in pending.items():
+                current = self._pending.get(key)
+                if current is not None:
+                    sketch.merge(current)
+                self._pending[key] = sketch
+        except Exception:
+            # Ошибка в данных повторялась бы на каждом цикле и блокировала
+            # запись всех следующих скетчей
+            logger.error(f"Dropped {len(pending)} sketches rejected by the database", exc_info=True)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.sketch_flush_interval)
+            await self.flush()
+
+
+async def merge_sketches(session: AsyncSession, sketches: dict[SketchKey, HyperLogLog]):
+    """
+    Объединяет скетчи с сохраненными в БД за несколько запросов на пачку.
+    Кампании блокируются FOR KEY SHARE, скетчи уже удаленных кампаний
+    отбрасываются, и вставка не падает на внешнем ключе. Новые строки
+    вставляются через ON CONFLICT DO NOTHING, существующие блокируются
+    одним SELECT ... FOR UPDATE, объединяются в памяти и записываются
+    одним upsert, так что параллельные записи из разных процессов не теряются.
+    """
+    campaign_ids = sorted({cid for cid, _ in sketches})
+    result = await session.execute(
+        select(Campaign.id)
+        .where(Campaign.id.in_(campaign_ids))
+        .order_by(Campaign.id)
+        .with_for_update(key_share=True)
+    )
+    live = set(result.scalars().all())
+    dropped = set(campaign_ids) - live
+    if dropped:
+        logger.warning(f"Dropped sketches of deleted campaigns: {sorted(dropped)}")
+
+    keys = sorted(key for key in sketches if key[0] in live)
+    for start in range(0, len(keys), MERGE_CHUNK_SIZE):
+        await _merge_chunk(session, keys[start:start + MERGE_CHUNK_SIZE], sketches)
+
+
+async def _merge_chunk(
+    session: AsyncSession,
+    keys: list[SketchKey],
+    sketches: dict[SketchKey, HyperLogLog]
+):
+    inserted = await session.execute(
+        insert(CampaignSketch)
+        .values([
+            {"campaign_id": cid, "domain": domain, "registers": sketches[(cid, domain)].to_bytes()}
+            for cid, domain in keys
+        ])
+        .on_conflict_do_nothing()
+        .returning(CampaignSketch.campaign_id, CampaignSketch.domain)
+    )
+    existing = sorted(set(keys) - {(row.campaign_id, row.domain) for row in inserted.all()})
+    if not existing:
+        return
+
+    # Порядок блокировок одинаков во всех процессах: без взаимных блокировок
+    result = await session.execute(
+        select(CampaignSketch.campaign_id, CampaignSketch.domain, CampaignSketch.registers)
+        .where(tuple_(CampaignSketch.campaign_id, CampaignSketch.domain).in_(existing))
+        .order_by(CampaignSketch.campaign_id, CampaignSketch.domain)
+        .with_for_update()
+    )
+    merged = []
+    for row in result.all():
+        stored = HyperLogLog.from_bytes(row.registers)
+        stored.merge(sketches[(row.campaign_id, row.domain)])
+        merged.append({"campaign_id": row.campaign_id, "domain": row.domain, "registers": stored.to_bytes()})
+    if not merged:
+        return
+    stmt = insert(CampaignSketch).values(merged)
+    await session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[CampaignSketch.campaign_id, CampaignSketch.domain],
+            set_={"registers": stmt.excluded.registers, "updated_at": func.now()}
+        )
+    )
+
+
+async def approx_unique_emails(
+    session: AsyncSession,
+    campaign_id: int,
+    domain: str | None = None
+) -> int | None:
+    """
+    Приближенное количество уникальных email кампании или домена кампании.
+    None, если скетчи кампании неполны или скетча еще нет — тогда нужно
+    считать точно.
+    """
+    key = domain or CAMPAIGN_KEY
+    result = await session.execute(
+        select(CampaignSketch.domain, CampaignSketch.registers, CampaignSketch.complete)
+        .where(CampaignSketch.campaign_id == campaign_id, CampaignSketch.domain.in_({CAMPAIGN_KEY, key}))
+    )
+    rows = {row.domain: row for row in result.all()}
+    campaign_row = rows.get(CAMPAIGN_KEY)
+    if campaign_row is None or not campaign_row.complete:
+        return None
+    registers = rows[key].registers if key in rows else None
+    local = sketch_store.pending(campaign_id, key)
+
+    if registers is None and local is None:
+        return None
+
+    sketch = HyperLogLog.from_bytes(registers) if registers is not None else HyperLogLog()
+    if local is not None:
+        sketch.merge(local)
+    return sketch.count()
+
+
+async def rebuild_campaign_sketches(session: AsyncSession, campaign_id: int):
+    """
+    Пересчитывает скетчи кампании по всем ее событиям, включая сжатые.
+    Нужен для кампаний, события которых были записаны до появления скетчей.
+    """
+    sketches: dict[SketchKey, HyperLogLog] = {}
+    result = await session.stream(
+        union(
+            select(Event.domain, Event.email)
+            .where(Event.campaign_id == campaign_id, Event.is_bot.is_(False)),
+            select(RecipientJourney.domain, RecipientJourney.email)
+            .where(RecipientJourney.campaign_id == campaign_id)
+        )
+        .execution_options(yield_per=5000)
+    )
+    async for domain, email in result:
+        for key in ((campaign_id, CAMPAIGN_KEY), (campaign_id, domain)):
+            sketch = sketches.get(key)
+            if sketch is None:
+                sketch = sketches[key] = HyperLogLog()
+            sketch.add(email)
+
+    if sketches:
+        await merge_sketches(session, sketches)
+    await mark_sketches_complete(session, campaign_id)
+
+
+async def mark_sketches_complete(session: AsyncSession, campaign_id: int):
+    """Отмечает скетчи кампании полными (для новой кампании — создает пустой)"""
+    stmt = insert(CampaignSketch).values(
+        campaign_id=campaign_id,
+        domain=CAMPAIGN_KEY,
+        registers=HyperLogLog().to_bytes(),
+        complete=True
+    )
+    await session.execute(stmt.on_conflict_do_update(
+        index_elements=[CampaignSketch.campaign_id, CampaignSketch.domain],
+        set_={"complete": True}
+    ))
+
+
+sketch_store = SketchStore()
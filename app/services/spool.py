@@ -0,0 +1,291 @@
+"""
+Локальный журнал событий на диске на время недоступности БД.
+
+События, которые не удалось записать в БД (ошибка БД или переполненная
+очередь записи), дописываются построчно в JSON сегменты в settings.spool_dir.
+Запись на диск и fsync выполняются пачками раз в spool_fsync_interval в
+отдельном потоке. Сегмент закрывается по достижении spool_segment_bytes.
+
+Фоновый воспроизводитель по порядку имен (время создания) забирает
+закрытые сегменты, копирует их строки во временную таблицу через COPY и
+переносит в events через INSERT ... ON CONFLICT (event_key) DO NOTHING,
+так что повторное воспроизведение после сбоя не создает дублей.
+Сегмент удаляется только после коммита. Открытый сегмент и сегмент,
+который воспроизводит другой процесс, защищены flock.
+
+Если БД отклоняет пачку не из-за недоступности, а из-за данных, пачка
+переносится построчно, а отклоненные строки откладываются в файл
+<сегмент>.rejected рядом с журналом; сегмент, который не удается даже
+прочитать, целиком переименовывается в .rejected. Так испорченная запись не
+блокирует воспроизведение следующих сегментов.
+"""
+
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterator
+from sqlalchemy import text
+from app.config import settings
+from app.database import DB_UNAVAILABLE_ERRORS, db
+from app.services.metrics import metrics
+from app.services.sketches import sketch_store
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".log"
+REJECTED_SUFFIX = ".rejected"
+
+# Колонки events, которые сохраняются в журнале, в порядке COPY
+SPOOL_COLUMNS = (
+    "event_key", "campaign_id", "event_type", "email", "domain",
+    "ip", "user_agent", "extra_params", "is_bot", "created_at"
+)
+
+spooled_events = metrics.counter(
+    "ingest_spooled_events_total",
+    "События, записанные в локальный журнал вместо БД"
+)
+replayed_events = metrics.counter(
+    "ingest_replayed_events_total",
+    "События, перенесенные из локального журнала в БД"
+)
+rejected_events = metrics.counter(
+    "ingest_spool_rejected_events_total",
+    "События журнала, отклоненные БД при воспроизведении и отложенные в .rejected"
+)
+
+
+def _encode(event: dict[str, Any]) -> bytes:
+    record = {column: event.get(column) for column in SPOOL_COLUMNS}
+    record["event_key"] = str(event["event_key"])
+    record["created_at"] = event["created_at"].isoformat()
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode() + b"\n"
+
+
+def _read_segment(path: Path) -> Iterator[tuple]:
+    """Строки сегмента в виде кортежей для COPY; недописанный хвост пропускается"""
+    with open(path, "rb") as file:
+        for line in file:
+            if not line.endswith(b"\n"):
+                logger.warning(f"Skipping torn record at the end of {path.name}")
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logger.error(f"Skipping unreadable record in {path.name}")
+                continue
+            record["created_at"] = datetime.fromisoformat(record["created_at"])
+            if record["extra_params"] is not None:
+                record["extra_params"] = json.dumps(record["extra_params"], ensure_ascii=False)
+            yield tuple(record[column] for column in SPOOL_COLUMNS)
+
+
+class _Segment:
+    """Открытый для записи сегмент под эксклюзивной блокировкой процесса"""
+
+    def __init__(self, directory: Path):
+        # Имя начинается со времени создания: сортировка имен дает порядок записи
+        name = f"{time.time_ns():020d}-{os.getpid()}"
+        creating = directory / f"{name}.tmp"
+        self.path = directory / f"{name}{SEGMENT_SUFFIX}"
+        self.file = open(creating, "ab")
+        # Блокировка берется до появления файла под именем сегмента,
+        # поэтому воспроизводитель не увидит его незаблокированным
+        fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.rename(creating, self.path)
+        self.size = 0
+
+    def write(self, data: bytes):
+        self.file.write(data)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.size += len(data)
+
+    def close(self):
+        # Закрытие файла снимает блокировку: сегмент становится доступен воспроизведению
+        self.file.close()
+
+
+class EventSpool:
+    """Журнал событий на диске и его фоновое воспроизведение в БД"""
+
+    def __init__(self):
+        self._directory = Path(settings.spool_dir)
+        self._buffer: list[bytes] = []
+        self._segment: _Segment | None = None
+        self._lock = asyncio.Lock()
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._tasks = [
+            asyncio.create_task(self._flush_loop()),
+            asyncio.create_task(self._replay_loop())
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.flush()
+        if self._segment:
+            self._segment.close()
+            self._segment = None
+
+    def append(self, events: list[dict[str, Any]]):
+        """Добавляет события в буфер; на диск они попадают при ближайшем flush"""
+        self._buffer.extend(_encode(event) for event in events)
+        spooled_events.inc(amount=len(events))
+
+    async def flush(self):
+        """Дописывает буфер в текущий сегмент и выполняет fsync"""
+        async with self._lock:
+            if not self._buffer:
+                return
+            data, self._buffer = b"".join(self._buffer), []
+            await asyncio.to_thread(self._write, data)
+
+    def _write(self, data: bytes):
+        if self._segment is None:
+            self._segment = _Segment(self._directory)
+        self._segment.write(data)
+        if self._segment.size >= settings.spool_segment_bytes:
+            self._segment.close()
+            self._segment = None
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(settings.spool_fsync_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.error("Failed to flush event spool", exc_info=True)
+
+    async def _replay_loop(self):
+        while True:
+            await asyncio.sleep(settings.spool_replay_interval)
+            try:
+                await self.replay()
+            except Exception:
+                logger.warning("Event spool replay failed, will retry", exc_info=True)
+
+    async def replay(self):
+        """Переносит в БД все закрытые сегменты, начиная со старых"""
+        # Текущий сегмент закрываем, чтобы не ждать его заполнения
+        async with self._lock:
+            if self._segment is not None:
+                self._segment.close()
+                self._segment = None
+
+        for path in sorted(self._directory.glob(f"*{SEGMENT_SUFFIX}")):
+            try:
+                file = open(path, "rb")
+            except FileNotFoundError:
+                continue
+            try:
+                try:
+                    fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Сегмент пишет или воспроизводит другой процесс
+                    continue
+                if not path.exists():
+                    continue
+                try:
+                    count = await self._replay_segment(path)
+                except DB_UNAVAILABLE_ERRORS:
+                    raise
+                except Exception:
+                    # Сегмент не читается: откладываем целиком и идем дальше
+                    logger.error(f"Failed to replay {path.name}, moving it aside", exc_info=True)
+                    path.rename(path.with_suffix(REJECTED_SUFFIX))
+                    continue
+                path.unlink()
+                replayed_events.inc(amount=count)
+                logger.info(f"Replayed {count} spooled events from {path.name}")
+            finally:
+                file.close()
+
+    async def _replay_segment(self, path: Path) -> int:
+        rows = await asyncio.to_thread(lambda: list(_read_segment(path)))
+        accepted: list[tuple] = []
+        rejected: list[tuple] = []
+        for start in range(0, len(rows), settings.spool_replay_batch):
+            batch = rows[start:start + settings.spool_replay_batch]
+            try:
+                await _copy_into_events(batch)
+                accepted.extend(batch)
+                continue
+            except DB_UNAVAILABLE_ERRORS:
+                raise
+            except Exception:
+                logger.warning(
+                    f"Batch of {len(batch)} spooled events rejected, replaying row by row", exc_info=True
+                )
+            for row in batch:
+                try:
+                    await _copy_into_events([row])
+                    accepted.append(row)
+                except DB_UNAVAILABLE_ERRORS:
+                    raise
+                except Exception:
+                    rejected.append(row)
+        if rejected:
+            await asyncio.to_thread(_write_rejected, path.with_suffix(REJECTED_SUFFIX), rejected)
+            rejected_events.inc(amount=len(rejected))
+            logger.error(f"{len(rejected)} spooled events from {path.name} rejected by the database")
+        # Скетчи уникальных: повторное добавление email не меняет оценку
+        campaign_at, domain_at, email_at, is_bot_at = (
+            SPOOL_COLUMNS.index(column) for column in ("campaign_id", "domain", "email", "is_bot")
+        )
+        for row in accepted:
+            if not row[is_bot_at]:
+                sketch_store.add(row[campaign_at], row[domain_at], row[email_at])
+        return len(accepted)
+
+
+def _write_rejected(path: Path, rows: list[tuple]):
+    """Дописывает отклоненные строки в файл для разбора вручную"""
+    with open(path, "ab") as file:
+        for row in rows:
+            record = dict(zip(SPOOL_COLUMNS, row))
+            file.write(json.dumps(record, ensure_ascii=False, default=str).encode() + b"\n")
+
+
+async def _copy_into_events(rows: list[tuple]):
+    """COPY во временную таблицу и перенос в events без дублей"""
+    async with db.async_session_maker() as session:
+        await session.execute(text(
+            "CREATE TEMP TABLE events_spool ("
+            " event_key UUID, campaign_id INTEGER, event_type VARCHAR(50),"
+            " email VARCHAR(255), domain VARCHAR(255), ip VARCHAR(45),"
+            " user_agent TEXT, extra_params TEXT, is_bot BOOLEAN, created_at TIMESTAMP"
+            ") ON COMMIT DROP"
+        ))
+        connection = await session.connection()
+        raw = await connection.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            "events_spool", records=rows, columns=SPOOL_COLUMNS
+        )
+        # События удаленных за время простоя кампаний отбрасываются
+        await session.execute(text(
+            "INSERT INTO events"
+            " (event_key, campaign_id, event_type, email, domain, ip,"
+            "  user_agent, extra_params, is_bot, created_at)"
+            " SELECT s.event_key, s.campaign_id, s.event_type, s.email, s.domain, s.ip,"
+            "  s.user_agent, s.extra_params::jsonb, s.is_bot, s.created_at"
+            " FROM events_spool s JOIN campaigns c ON c.id = s.campaign_id"
+            " ORDER BY s.created_at"
+            " ON CONFLICT (event_key) WHERE event_key IS NOT NULL DO NOTHING"
+        ))
+        await session.commit()
+
+
+event_spool = EventSpool()
@@ -0,0 +1,106 @@
+"""
+Перенос событий из events_staging в events.
+
+В режиме event_ingest_mode=staging прием пишет в UNLOGGED таблицу с одним
+индексом, а этот процесс раз в staging_move_interval переносит ее строки
+в events пачками по staging_move_batch: одна команда удаляет пачку из
+staging и вставляет ее в events, отсортированной по (campaign_id,
+created_at), чтобы вставки в индексы events шли последовательно.
+Статистика читает events UNION ALL events_staging (stats.live_events),
+поэтому перенос не влияет на то, что видно на страницах.
+"""
+
+import asyncio
+import logging
+from sqlalchemy import text
+from app.config import settings
+from app.database import db
+from app.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory lock: одновременно переносит только один процесс
+MOVER_LOCK_KEY = 7_100_042
+
+EVENT_COLUMNS = (
+    "event_key, campaign_id, event_type, email, domain, ip,"
+    " user_agent, extra_params, is_bot, created_at"
+)
+
+MOVE_BATCH_SQL = text(f"""
+    WITH batch AS (
+        DELETE FROM events_staging
+        WHERE id IN (SELECT id FROM events_staging ORDER BY id LIMIT :limit)
+        RETURNING {EVENT_COLUMNS}
+    ), moved AS (
+        INSERT INTO events ({EVENT_COLUMNS})
+        SELECT {EVENT_COLUMNS} FROM batch
+        -- События кампаний, удаленных до переноса, отбрасываются
+        WHERE EXISTS (SELECT 1 FROM campaigns c WHERE c.id = batch.campaign_id)
+        ORDER BY campaign_id, created_at
+        ON CONFLICT (event_key) WHERE event_key IS NOT NULL DO NOTHING
+        RETURNING 1
+    )
+    SELECT (SELECT count(*) FROM batch) AS taken, (SELECT count(*) FROM moved) AS moved
+""")
+
+moved_events = metrics.counter(
+    "staging_moved_events_total",
+    "События, перенесенные из events_staging в events"
+)
+
+
+class StagingMover:
+    """Фоновый перенос events_staging -> events"""
+
+    def __init__(self):
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        if settings.event_ingest_mode != "staging" or self._task:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self._task:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        # Последний перенос, чтобы не оставлять строки в UNLOGGED таблице
+        try:
+            await self.move()
+        except Exception:
+            logger.warning("Final staging move failed", exc_info=True)
+
+    async def move(self) -> int:
+        """Переносит все накопленные строки пачками, возвращает число перенесенных"""
+        total = 0
+        while True:
+            async with db.async_session_maker() as session:
+                locked = await session.scalar(
+                    text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": MOVER_LOCK_KEY}
+                )
+                if not locked:
+                    return total
+                result = await session.execute(MOVE_BATCH_SQL, {"limit": settings.staging_move_batch})
+                taken, moved = result.one()
+                await session.commit()
+            total += moved
+            moved_events.inc(amount=moved)
+            if taken < settings.staging_move_batch:
+                return total
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.staging_move_interval)
+            try:
+                await self.move()
+            except Exception:
+                logger.error("Failed to move staged events", exc_info=True)
+
+
+staging_mover = StagingMover()
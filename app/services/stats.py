@@ -0,0 +1,652 @@
+"""
+Агрегирующие запросы статистики для страниц дашборда.
+
+Счетчики и пути получателей складываются из живых событий и сжатых
+задачей compact_events агрегатов (event_daily_counts, recipient_journeys),
+поэтому страницы не меняются после сжатия старых событий. Агрегаты хранят
+только дни и не хранят параметров, поэтому минутные и часовые бакеты и
+фильтр по параметрам события считаются по живым событиям, а число не
+вошедших сжатых событий (compacted_counts) страницы показывают отдельно.
+Функции campaign_* дополнительно добавляют события из холодного архива
+кампании (app/services/archive.py).
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, Literal, Sequence
+from sqlalchemy import (
+    BigInteger, DateTime, Select, select, func, case, cast, literal_column, union, union_all
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from app.config import settings
+from app.models.database import (
+    Event, EventStaging, EventDailyCount, RecipientJourney, CampaignDomainEmails
+)
+from app.services.archive import ArchiveFilter, archive_store
+from app.services.sketches import approx_unique_emails
+
+Bucket = Literal["minute", "hour", "day"]
+
+BUCKET_SIZES: dict[str, timedelta] = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1)
+}
+
+# Диапазон по умолчанию для каждого размера бакета
+DEFAULT_RANGES: dict[str, timedelta] = {
+    "minute": timedelta(hours=2),
+    "hour": timedelta(days=2),
+    "day": timedelta(days=30)
+}
+
+MAX_BUCKETS = 2000
+
+DomainSort = Literal[
+    "domain", "emails_sent", "email_clicks", "landing_clicks",
+    "conversions", "unsubscribes", "conversion_rate"
+]
+SortDirection = Literal["asc", "desc"]
+
+# Размеры страницы статистики по доменам, доступные в интерфейсе
+DOMAIN_PAGE_SIZES = (25, 50, 100, 500)
+
+_live_events = None
+
+
+def live_events():
+    """
+    Источник событий для статистики. В режиме приема через staging это
+    events UNION ALL events_staging, чтобы еще не перенесенные в events
+    события сразу попадали на страницы. Возвращается один и тот же объект,
+    поэтому условия, построенные в разных местах, относятся к одному FROM.
+    """
+    global _live_events
+    if settings.event_ingest_mode != "staging":
+        return Event
+    if _live_events is None:
+        columns = [column.name for column in Event.__table__.columns]
+        events_union = union_all(
+            select(*[Event.__table__.c[name] for name in columns]),
+            select(*[EventStaging.__table__.c[name] for name in columns])
+        ).subquery("events_live")
+        _live_events = aliased(Event, events_union, adapt_on_names=True)
+    return _live_events
+
+
+def not_bot(events=Event):
+    """Условие, исключающее события ботов и префетчеров из статистики"""
+    return events.is_bot.is_(False)
+
+
+# Счетчик в ответе -> тип события
+EVENT_COUNTERS = {
+    "email_clicks": "email_click",
+    "landing_clicks": "landing_click",
+    "conversions": "conversion",
+    "unsubscribes": "unsubscribe",
+    "opens": "open"
+}
+
+
+def event_counts_query(
+    group_by: Sequence[str] = (),
+    campaign_id: int | None = None,
+    domain: str | None = None,
+    extra_conditions: list | None = None,
+    campaign_ids: Any = None
+) -> Select:
+    """
+    Счетчики событий (колонки EVENT_COUNTERS) с группировкой по колонкам
+    group_by ("campaign_id", "domain"): живые события без ботов плюс
+    дневные агрегаты сжатых событий. Без группировки — одна строка.
+    campaign_ids (список или подзапрос id) ограничивает набор кампаний.
+    extra_conditions (фильтр по параметрам) отключают агрегаты.
+    """
+    events = live_events()
+    raw_conditions = [not_bot(events), *(extra_conditions or [])]
+    compacted_conditions = []
+    if campaign_id is not None:
+        raw_conditions.append(events.campaign_id == campaign_id)
+        compacted_conditions.append(EventDailyCount.campaign_id == campaign_id)
+    if campaign_ids is not None:
+        raw_conditions.append(events.campaign_id.in_(campaign_ids))
+        compacted_conditions.append(EventDailyCount.campaign_id.in_(campaign_ids))
+    if domain is not None:
+        raw_conditions.append(events.domain == domain)
+        compacted_conditions.append(EventDailyCount.domain == domain)
+
+    raw_groups = [getattr(events, column) for column in group_by]
+    parts = [
+        select(
+            *[group.label(column) for group, column in zip(raw_groups, group_by)],
+            *[
+                func.count(case((events.event_type == event_type, 1))).label(key)
+                for key, event_type in EVENT_COUNTERS.items()
+            ]
+        )
+        .where(*raw_conditions)
+        .group_by(*raw_groups)
+    ]
+    if not extra_conditions:
+        compacted_groups = [getattr(EventDailyCount, column) for column in group_by]
+        parts.append(
+            select(
+                *[group.label(column) for group, column in zip(compacted_groups, group_by)],
+                *[
+                    func.sum(
+                        case((EventDailyCount.event_type == event_type, EventDailyCount.count), else_=0)
+                    ).label(key)
+                    for key, event_type in EVENT_COUNTERS.items()
+                ]
+            )
+            .where(*compacted_conditions)
+            .group_by(*compacted_groups)
+        )
+
+    counts = union_all(*parts).subquery("event_counts")
+    return (
+        select(
+            *[counts.c[column] for column in group_by],
+            *[
+                cast(func.coalesce(func.sum(counts.c[key]), 0), BigInteger).label(key)
+                for key in EVENT_COUNTERS
+            ]
+        )
+        .group_by(*[counts.c[column] for column in group_by])
+    )
+
+
+async def campaign_timeseries(
+    session: AsyncSession,
+    campaign_id: int,
+    bucket: Bucket,
+    start: datetime,
+    end: datetime
+) -> dict[str, Any]:
+    """
+    Количество событий кампании по временным бакетам.
+    Ответ колоночный: массив меток "t" и по массиву на каждый тип события.
+    Пустые бакеты не возвращаются. Сжатые события хранятся по дням,
+    поэтому попадают только в дневные бакеты; для минут и часов их
+    количество за период возвращается отдельно в "compacted".
+    """
+    if bucket not in BUCKET_SIZES:
+        raise ValueError(f"Unknown bucket: {bucket}")
+
+    events = live_events()
+
+    # Единица подставляется литералом: с bind-параметром выражения в SELECT
+    # и GROUP BY получили бы разные параметры, и Postgres отверг бы запрос
+    bucket_col = func.date_trunc(literal_column(f"'{bucket}'"), events.created_at).label("bucket")
+    stmt = (
+        select(
+            bucket_col,
+            *[
+                func.count(case((events.event_type == event_type, 1))).label(key)
+                for key, event_type in EVENT_COUNTERS.items()
+            ]
+        )
+        # Диапазон по created_at покрывается индексом (campaign_id, created_at)
+        .where(
+            events.campaign_id == campaign_id,
+            not_bot(events),
+            events.created_at >= start,
+            events.created_at < end
+        )
+        .group_by(bucket_col)
+    )
+    if bucket == "day":
+        day_col = cast(EventDailyCount.day, DateTime)
+        compacted = (
+            select(
+                day_col.label("bucket"),
+                *[
+                    func.sum(
+                        case((EventDailyCount.event_type == event_type, EventDailyCount.count), else_=0)
+                    ).label(key)
+                    for key, event_type in EVENT_COUNTERS.items()
+                ]
+            )
+            # День попадает в ответ, если пересекается с диапазоном
+            .where(
+                EventDailyCount.campaign_id == campaign_id,
+                EventDailyCount.day >= start.date(),
+                day_col < end
+            )
+            .group_by(day_col)
+        )
+        buckets = union_all(stmt, compacted).subquery("buckets")
+        stmt = select(
+            buckets.c.bucket,
+            *[cast(func.sum(buckets.c[key]), BigInteger).label(key) for key in EVENT_COUNTERS]
+        ).group_by(buckets.c.bucket)
+    result = await session.execute(stmt.order_by(literal_column("bucket")))
+
+    series: dict[str, Any] = {
+        "bucket": bucket,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "t": [],
+        "compacted": (
+            dict.fromkeys(EVENT_COUNTERS, 0) if bucket == "day"
+            else await compacted_counts(session, campaign_id, start=start, end=end)
+        )
+    }
+    for key in EVENT_COUNTERS:
+        series[key] = []
+
+    buckets_counts = {
+        row.bucket: {key: getattr(row, key) or 0 for key in EVENT_COUNTERS}
+        for row in result.all()
+    }
+    archived = await archive_store.timeseries(campaign_id, bucket, start, end)
+    for bucket_start, by_type in archived.items():
+        _add_archived(buckets_counts.setdefault(bucket_start, dict.fromkeys(EVENT_COUNTERS, 0)), by_type)
+
+    for bucket_start in sorted(buckets_counts):
+        series["t"].append(bucket_start.isoformat())
+        for key in EVENT_COUNTERS:
+            series[key].append(buckets_counts[bucket_start][key])
+
+    return series
+
+
+async def compacted_counts(
+    session: AsyncSession,
+    campaign_id: int,
+    domain: str | None = None,
+    start: datetime | None = None,
+    end: datetime | None = None
+) -> dict[str, int]:
+    """
+    Счетчики сжатых событий кампании (ключи EVENT_COUNTERS) за дни,
+    пересекающиеся с [start, end). Это события, которые не попадают в
+    минутные и часовые бакеты и в фильтр по параметрам.
+    """
+    conditions = [EventDailyCount.campaign_id == campaign_id]
+    if domain:
+        conditions.append(EventDailyCount.domain == domain)
+    if start is not None:
+        conditions.append(EventDailyCount.day >= start.date())
+    if end is not None:
+        conditions.append(cast(EventDailyCount.day, DateTime) < end)
+    result = await session.execute(
+        select(*[
+            cast(func.coalesce(func.sum(
+                case((EventDailyCount.event_type == event_type, EventDailyCount.count), else_=0)
+            ), 0), BigInteger).label(key)
+            for key, event_type in EVENT_COUNTERS.items()
+        ])
+        .where(*conditions)
+    )
+    return dict(result.one()._mapping)
+
+
+def extra_param_conditions(param: str | None, value: str | None) -> list:
+    """
+    Условие фильтра по продвигаемому параметру события. Проверка вхождения
+    extra_params @> {param: value} использует GIN индекс idx_events_extra_params.
+    Непродвигаемые параметры и пустые значения игнорируются.
+    """
+    if not param or not value or param not in settings.extra_params_promoted:
+        return []
+    return [live_events().extra_params.contains({param: value})]
+
+
+def _archive_filter(
+    domain: str | None = None,
+    email_search: str | None = None,
+    param: str | None = None,
+    param_value: str | None = None
+) -> ArchiveFilter:
+    """Те же фильтры для архива; непродвигаемый параметр игнорируется, как в БД"""
+    if not param or not param_value or param not in settings.extra_params_promoted:
+        param = param_value = None
+    return ArchiveFilter(domain or None, email_search or None, param, param_value)
+
+
+def _add_archived(counts: dict[str, int], by_type: dict[str, int]):
+    """Добавляет к счетчикам количества архивных событий по типам"""
+    for key, event_type in EVENT_COUNTERS.items():
+        counts[key] += by_type.get(event_type, 0)
+
+
+async def campaign_counts(
+    session: AsyncSession,
+    campaign_id: int,
+    domain: str | None = None,
+    param: str | None = None,
+    param_value: str | None = None
+) -> dict[str, int]:
+    """Счетчики событий кампании (ключи EVENT_COUNTERS) из БД и архива"""
+    result = await session.execute(event_counts_query(
+        campaign_id=campaign_id, domain=domain,
+        extra_conditions=extra_param_conditions(param, param_value)
+    ))
+    row = result.one()
+    counts = {key: row._mapping[key] for key in EVENT_COUNTERS}
+    archived = await archive_store.counts(
+        campaign_id, _archive_filter(domain, param=param, param_value=param_value)
+    )
+    if archived:
+        _add_archived(counts, archived)
+    return counts
+
+
+async def campaign_domain_counts(
+    session: AsyncSession,
+    campaign_id: int,
+    param: str | None = None,
+    param_value: str | None = None
+) -> dict[str, dict[str, int]]:
+    """Счетчики событий кампании по доменам из БД и архива"""
+    result = await session.execute(event_counts_query(
+        ("domain",), campaign_id=campaign_id,
+        extra_conditions=extra_param_conditions(param, param_value)
+    ))
+    counts = {
+        row.domain: {key: row._mapping[key] for key in EVENT_COUNTERS}
+        for row in result.all()
+    }
+    archived = await archive_store.domain_counts(
+        campaign_id, _archive_filter(param=param, param_value=param_value)
+    )
+    for domain, by_type in archived.items():
+        _add_archived(counts.setdefault(domain, dict.fromkeys(EVENT_COUNTERS, 0)), by_type)
+    return counts
+
+
+async def archived_totals(campaign_ids: list[int] | None = None) -> dict[int, dict[str, int]]:
+    """
+    Счетчики архивных событий (ключи EVENT_COUNTERS) архивных кампаний
+    из списка или всех архивных кампаний
+    """
+    totals = {}
+    for campaign_id, by_type in (await archive_store.totals(campaign_ids)).items():
+        totals[campaign_id] = dict.fromkeys(EVENT_COUNTERS, 0)
+        _add_archived(totals[campaign_id], by_type)
+    return totals
+
+
+async def unique_emails(
+    session: AsyncSession,
+    campaign_id: int,
+    domain: str | None = None,
+    email_search: str | None = None,
+    exact: bool = False,
+    param: str | None = None,
+    param_value: str | None = None
+) -> tuple[int, bool]:
+    """
+    Количество уникальных email кампании с учетом фильтров.
+    По умолчанию берется из HyperLogLog скетча; точный count(distinct)
+    выполняется по запросу, при поиске по email или параметру и при
+    отсутствии скетча. Для архивной кампании email из БД объединяются
+    с email архива в памяти. Возвращает (количество, приближенное ли оно).
+    """
+    extra_conditions = extra_param_conditions(param, param_value)
+    if not exact and not email_search and not extra_conditions:
+        approx = await approx_unique_emails(session, campaign_id, domain)
+        if approx is not None:
+            return approx, True
+
+    events = live_events()
+    conditions = [events.campaign_id == campaign_id, not_bot(events)]
+    compacted_conditions = [RecipientJourney.campaign_id == campaign_id]
+    if domain:
+        conditions.append(events.domain == domain)
+        compacted_conditions.append(RecipientJourney.domain == domain)
+    if email_search:
+        conditions.append(events.email.ilike(f"%{email_search}%"))
+        compacted_conditions.append(RecipientJourney.email.ilike(f"%{email_search}%"))
+    conditions.extend(extra_conditions)
+
+    if extra_conditions:
+        emails = select(events.email).where(*conditions).distinct()
+    else:
+        # UNION убирает повторы email между живыми и сжатыми событиями
+        emails = union(
+            select(events.email).where(*conditions),
+            select(RecipientJourney.email).where(*compacted_conditions)
+        )
+
+    archived = await archive_store.emails(
+        campaign_id, _archive_filter(domain, email_search, param, param_value)
+    )
+    if archived is not None:
+        result = await session.execute(select(emails.subquery().c.email))
+        return len(archived.union(result.scalars().all())), False
+
+    result = await session.execute(
+        select(func.count().label("total")).select_from(emails.subquery())
+    )
+    return result.scalar_one() or 0, False
+
+
+def domain_stats_query(campaign_id: int, *conditions) -> Select:
+    """
+    Статистика по доменам кампании одним запросом: счетчики событий по
+    доменам объединяются с campaign_domain_emails через FULL OUTER JOIN,
+    чтобы попали и домены без событий. Дополнительные условия
+    применяются к событиям.
+    """
+    counts = event_counts_query(
+        ("domain",), campaign_id=campaign_id, extra_conditions=list(conditions)
+    ).subquery()
+    sent = (
+        select(CampaignDomainEmails.domain, CampaignDomainEmails.emails_sent)
+        .where(CampaignDomainEmails.campaign_id == campaign_id)
+        .subquery()
+    )
+    return select(
+        func.coalesce(counts.c.domain, sent.c.domain).label("domain"),
+        func.coalesce(sent.c.emails_sent, 0).label("emails_sent"),
+        *[func.coalesce(counts.c[key], 0).label(key) for key in EVENT_COUNTERS]
+    ).select_from(counts.join(sent, counts.c.domain == sent.c.domain, full=True))
+
+
+async def campaign_domain_stats(
+    session: AsyncSession,
+    campaign_id: int,
+    sort: DomainSort = "email_clicks",
+    direction: SortDirection = "desc",
+    offset: int = 0,
+    limit: int = 50,
+    param: str | None = None,
+    param_value: str | None = None
+) -> tuple[list[dict[str, Any]], int]:
+    """
+    Страница статистики по доменам кампании и общее число доменов.
+    Сортировка и пагинация — в SQL поверх domain_stats_query, число
+    доменов — окном count(*) OVER () в том же запросе. Для архивной
+    кампании строки собираются и сортируются в памяти.
+    """
+    if archive_store.parts(campaign_id):
+        return await _archived_domain_stats(
+            session, campaign_id, sort, direction, offset, limit, param, param_value
+        )
+
+    stats = domain_stats_query(
+        campaign_id, *extra_param_conditions(param, param_value)
+    ).subquery("domain_stats")
+    conversion_rate = case(
+        (stats.c.email_clicks > 0, stats.c.conversions * 100.0 / stats.c.email_clicks),
+        else_=0
+    ).label("conversion_rate")
+    order = conversion_rate if sort == "conversion_rate" else stats.c[sort]
+    # Окно считается до OFFSET/LIMIT, поэтому дает число всех доменов
+    domains_total = func.count().over().label("domains_total")
+    # Домен вторым ключом: порядок строк между страницами стабилен
+    result = await session.execute(
+        select(stats, conversion_rate, domains_total)
+        .order_by(order.desc() if direction == "desc" else order.asc(), stats.c.domain)
+        .offset(offset)
+        .limit(limit)
+    )
+    rows = []
+    total = 0
+    for row in result.all():
+        total = row.domains_total
+        stats_row = dict(row._mapping)
+        del stats_row["domains_total"]
+        rows.append({**stats_row, "conversion_rate": float(row.conversion_rate)})
+    if not rows and offset:
+        # Страница за концом списка: окну не на чем вернуть число доменов
+        total = await session.scalar(select(func.count()).select_from(stats))
+    return rows, total or 0
+
+
+async def _archived_domain_stats(
+    session: AsyncSession,
+    campaign_id: int,
+    sort: DomainSort,
+    direction: SortDirection,
+    offset: int,
+    limit: int,
+    param: str | None,
+    param_value: str | None
+) -> tuple[list[dict[str, Any]], int]:
+    counts = await campaign_domain_counts(session, campaign_id, param=param, param_value=param_value)
+    result = await session.execute(
+        select(CampaignDomainEmails.domain, CampaignDomainEmails.emails_sent)
+        .where(CampaignDomainEmails.campaign_id == campaign_id)
+    )
+    sent = dict(result.all())
+    rows = []
+    for domain in counts.keys() | sent.keys():
+        domain_counts = counts.get(domain) or dict.fromkeys(EVENT_COUNTERS, 0)
+        email_clicks = domain_counts["email_clicks"]
+        rows.append({
+            "domain": domain,
+            "emails_sent": sent.get(domain, 0),
+            **domain_counts,
+            "conversion_rate": domain_counts["conversions"] * 100.0 / email_clicks if email_clicks else 0.0
+        })
+    rows.sort(key=lambda row: row["domain"])
+    rows.sort(key=lambda row: row[sort], reverse=direction == "desc")
+    return rows[offset:offset + limit], len(rows)
+
+
+async def campaign_domains(session: AsyncSession, campaign_id: int) -> list[str]:
+    """Все домены кампании для фильтра: с событиями (в т.ч. сжатыми и архивными) и с отправками"""
+    events = live_events()
+    result = await session.execute(union(
+        select(events.domain).where(events.campaign_id == campaign_id, not_bot(events)),
+        select(EventDailyCount.domain).where(EventDailyCount.campaign_id == campaign_id),
+        select(CampaignDomainEmails.domain).where(CampaignDomainEmails.campaign_id == campaign_id)
+    ))
+    domains = set(result.scalars().all())
+    domains.update(await archive_store.domain_counts(campaign_id))
+    return sorted(domains)
+
+
+def user_journeys_query(
+    campaign_id: int,
+    domain: str | None = None,
+    email_search: str | None = None,
+    extra_conditions: list | None = None
+) -> Select:
+    """
+    Путь каждого получателя (email, domain): какие события у него были.
+    Живые события объединяются с путями по сжатым событиям. События ботов
+    не учитываются. Сортировать по колонке first_event результата.
+    """
+    events = live_events()
+    conditions = [events.campaign_id == campaign_id, not_bot(events)]
+    compacted_conditions = [RecipientJourney.campaign_id == campaign_id]
+    if domain:
+        conditions.append(events.domain == domain)
+        compacted_conditions.append(RecipientJourney.domain == domain)
+    if email_search:
+        conditions.append(events.email.ilike(f"%{email_search}%"))
+        compacted_conditions.append(RecipientJourney.email.ilike(f"%{email_search}%"))
+    conditions.extend(extra_conditions or [])
+
+    parts = [
+        select(
+            events.email.label("email"),
+            events.domain.label("domain"),
+            func.bool_or(events.event_type == "email_click").label("has_email_click"),
+            func.bool_or(events.event_type == "landing_click").label("has_landing_click"),
+            func.bool_or(events.event_type == "conversion").label("has_conversion"),
+            func.bool_or(events.event_type == "unsubscribe").label("has_unsubscribe"),
+            func.min(events.created_at).label("first_event")
+        )
+        .where(*conditions)
+        .group_by(events.email, events.domain)
+    ]
+    if not extra_conditions:
+        parts.append(
+            select(
+                RecipientJourney.email,
+                RecipientJourney.domain,
+                RecipientJourney.has_email_click,
+                RecipientJourney.has_landing_click,
+                RecipientJourney.has_conversion,
+                RecipientJourney.has_unsubscribe,
+                RecipientJourney.first_event
+            )
+            .where(*compacted_conditions)
+        )
+
+    journeys = union_all(*parts).subquery("journeys")
+    return (
+        select(
+            journeys.c.email,
+            journeys.c.domain,
+            func.bool_or(journeys.c.has_email_click).label("has_email_click"),
+            func.bool_or(journeys.c.has_landing_click).label("has_landing_click"),
+            func.bool_or(journeys.c.has_conversion).label("has_conversion"),
+            func.bool_or(journeys.c.has_unsubscribe).label("has_unsubscribe"),
+            func.min(journeys.c.first_event).label("first_event")
+        )
+        .group_by(journeys.c.email, journeys.c.domain)
+    )
+
+
+async def campaign_journeys(
+    session: AsyncSession,
+    campaign_id: int,
+    domain: str | None = None,
+    email_search: str | None = None,
+    param: str | None = None,
+    param_value: str | None = None,
+    offset: int = 0,
+    limit: int = 50
+) -> list[dict[str, Any]]:
+    """
+    Страница путей получателей кампании, свежие первыми. Для архивной
+    кампании пути из БД (обычно немногие события после архивации)
+    сливаются со страницей отсортированных путей архива: из архива
+    читается offset + limit путей и еще по одному на каждый путь из БД,
+    который может совпасть с архивным.
+    """
+    stmt = user_journeys_query(
+        campaign_id, domain=domain, email_search=email_search,
+        extra_conditions=extra_param_conditions(param, param_value)
+    )
+    if not archive_store.parts(campaign_id):
+        result = await session.execute(
+            stmt.order_by(stmt.selected_columns.first_event.desc()).limit(limit).offset(offset)
+        )
+        return [dict(row._mapping) for row in result.all()]
+
+    filters = _archive_filter(domain, email_search, param, param_value)
+    result = await session.execute(stmt)
+    rows = {(row.email, row.domain): dict(row._mapping) for row in result.all()}
+    if not rows:
+        return await archive_store.journeys(campaign_id, filters, offset, limit)
+
+    for key, archived in (await archive_store.journeys_for(campaign_id, rows, filters)).items():
+        journey = rows[key]
+        for flag in ("has_email_click", "has_landing_click", "has_conversion", "has_unsubscribe"):
+            journey[flag] = journey[flag] or archived[flag]
+        journey["first_event"] = min(journey["first_event"], archived["first_event"])
+    head = await archive_store.journeys(campaign_id, filters, 0, offset + limit + len(rows))
+    journeys = [
+        journey for journey in head if (journey["email"], journey["domain"]) not in rows
+    ]
+    journeys.extend(rows.values())
+    journeys.sort(key=lambda journey: journey["first_event"], reverse=True)
+    return journeys[offset:offset + limit]
@@ -0,0 +1,270 @@
+"""
+Список отписавшихся адресов для проверки перед отправкой письма (MTA).
+
+Адреса хранятся 64-битными хэшами: blake2b(digest_size=8) от email без
+пробелов по краям в нижнем регистре, little-endian. Глобальная область —
+отписка от любой кампании, область кампании — хэш строки "campaign_id:email".
+Хэши лежат в отсортированном array('Q') (8 байт на адрес, поиск делением
+пополам); новые отписки попадают в небольшое множество и вливаются в массив
+в фоне. Вероятность ложного совпадения для 10 млн адресов — порядка 1e-6.
+
+Индекс загружается в фоне при старте из отписок в events, путей
+получателей сжатых событий и архива кампаний. Затем он пополняется пачками
+записи событий этого процесса и опросом events по id раз в
+suppression_poll_interval: так видны отписки, принятые другими процессами,
+воспроизведенные из журнала и перенесенные из staging. Удаление кампании
+снимает ее отписки только после перезапуска.
+
+Отписки не фильтруются по is_bot: адрес, от имени которого пришла отписка,
+исключается из рассылки в любом случае.
+"""
+
+import asyncio
+import hashlib
+import heapq
+import logging
+import sys
+from array import array
+from bisect import bisect_left
+from typing import Any, Iterable, Literal
+from sqlalchemy import func, select
+from app.config import settings
+from app.database import db
+from app.models.database import Event, RecipientJourney
+from app.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SuppressionScope = Literal["global", "campaign"]
+
+# Сколько новых хэшей накапливается до слияния с отсортированным массивом
+COMPACT_PENDING_SIZE = 10000
+
+def email_key(email: str, campaign_id: int | None = None) -> int:
+    """Хэш адреса в глобальной области или в области кампании"""
+    normalized = email.strip().lower()
+    value = normalized if campaign_id is None else f"{campaign_id}:{normalized}"
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "little")
+
+
+def _unsubscribed(query):
+    return query.where(Event.event_type == "unsubscribe")
+
+
+def _sorted_array(keys: Iterable[int]) -> array:
+    return array("Q", sorted(keys))
+
+
+def _merge_sorted(keys: array, recent: set[int]) -> array:
+    return array("Q", heapq.merge(keys, sorted(recent)))
+
+
+class _HashSet:
+    """Отсортированный массив хэшей и множество еще не влитых новых"""
+
+    def __init__(self, keys: array | None = None):
+        self._sorted = keys if keys is not None else array("Q")
+        self._recent: set[int] = set()
+
+    def __contains__(self, key: int) -> bool:
+        if key in self._recent:
+            return True
+        keys = self._sorted
+        index = bisect_left(keys, key)
+        return index < len(keys) and keys[index] == key
+
+    def __len__(self) -> int:
+        return len(self._sorted) + len(self._recent)
+
+    @property
+    def pending(self) -> int:
+        return len(self._recent)
+
+    def recent(self) -> set[int]:
+        return set(self._recent)
+
+    def add(self, key: int) -> bool:
+        """Добавляет хэш, возвращает False, если он уже есть"""
+        if key in self:
+            return False
+        self._recent.add(key)
+        return True
+
+    async def compact(self):
+        """Вливает новые хэши в массив в пуле потоков"""
+        if not self._recent:
+            return
+        # Хэши, добавленные во время слияния, остаются в _recent
+        recent = set(self._recent)
+        self._sorted = await asyncio.to_thread(_merge_sorted, self._sorted, recent)
+        self._recent -= recent
+
+    def to_bytes(self) -> bytes:
+        """Отсортированные хэши little-endian uint64 (после compact)"""
+        keys = self._sorted
+        if sys.byteorder != "little":
+            keys = array("Q", keys)
+            keys.byteswap()
+        return keys.tobytes()
+
+
+class SuppressionIndex:
+    """Индекс отписавшихся адресов в памяти процесса"""
+
+    def __init__(self):
+        self._sets: dict[SuppressionScope, _HashSet] = {"global": _HashSet(), "campaign": _HashSet()}
+        self._last_event_id = 0
+        self._version = 0
+        self._snapshots: dict[SuppressionScope, tuple[int, bytes]] = {}
+        self._task: asyncio.Task | None = None
+        self.ready = False
+
+    async def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self._task:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def check(self, email: str, campaign_id: int | None = None) -> bool:
+        """Отписан ли адрес от кампании или, без campaign_id, от любой кампании"""
+        if campaign_id is None:
+            return email_key(email) in self._sets["global"]
+        return email_key(email, campaign_id) in self._sets["campaign"]
+
+    def add(self, campaign_id: int, email: str):
+        added = self._sets["global"].add(email_key(email))
+        added |= self._sets["campaign"].add(email_key(email, campaign_id))
+        if added:
+            self._version += 1
+
+    def add_events(self, events: Iterable[dict[str, Any]]):
+        """Учитывает отписки из записанной пачки событий"""
+        if not self._task:
+            # Индекс не запущен в этом процессе (например, в ingest-процессе)
+            return
+        for event in events:
+            if event["event_type"] == "unsubscribe":
+                self.add(event["campaign_id"], event["email"])
+
+    async def snapshot(self, scope: SuppressionScope) -> bytes:
+        """Снимок области: отсортированные хэши little-endian uint64"""
+        cached = self._snapshots.get(scope)
+        if cached and cached[0] == self._version:
+            return cached[1]
+        version = self._version
+        hashes = self._sets[scope]
+        await hashes.compact()
+        data = hashes.to_bytes()
+        self._snapshots[scope] = (version, data)
+        return data
+
+    def size(self, scope: SuppressionScope) -> int:
+        return len(self._sets[scope])
+
+    async def load(self):
+        """Полная загрузка отписок из БД и архива"""
+        # Архив тянет pyarrow; модуль импортируется и ingest-процессом
+        # ради add_events, поэтому архив загружается только здесь
+        from app.services.archive import archive_store
+
+        keys: dict[SuppressionScope, set[int]] = {"global": set(), "campaign": set()}
+
+        def collect(campaign_id: int, email: str):
+            keys["global"].add(email_key(email))
+            keys["campaign"].add(email_key(email, campaign_id))
+
+        async with db.engine.connect() as conn:
+            # Отписки, записанные после этой границы, подберет опрос
+            last_event_id = await conn.scalar(select(func.max(Event.id))) or 0
+            for query in (
+                _unsubscribed(select(Event.campaign_id, Event.email)),
+                select(RecipientJourney.campaign_id, RecipientJourney.email)
+                .where(RecipientJourney.has_unsubscribe)
+            ):
+                result = await conn.stream(
+                    query.execution_options(yield_per=settings.export_chunk_size)
+                )
+                async for partition in result.partitions():
+                    for campaign_id, email in partition:
+                        collect(campaign_id, email)
+
+        for campaign_id in archive_store.archived_campaign_ids():
+            for email in await archive_store.unsubscribed_emails(campaign_id):
+                collect(campaign_id, email)
+
+        for scope, scope_keys in keys.items():
+            hashes = _HashSet(await asyncio.to_thread(_sorted_array, scope_keys))
+            # Отписки из пачек записи, пришедшие во время загрузки
+            for key in self._sets[scope].recent():
+                hashes.add(key)
+            self._sets[scope] = hashes
+        self._last_event_id = last_event_id
+        self._version += 1
+        self.ready = True
+        logger.info(
+            f"Suppression index loaded: {self.size('global')} addresses, "
+            f"{self.size('campaign')} campaign entries"
+        )
+
+    async def poll(self):
+        """
+        Добавляет отписки из events после последнего прочитанного id.
+        Опрос повторно читает suppression_poll_lookback id до границы:
+        транзакции записи коммитятся не в порядке выдачи id.
+        """
+        cursor = max(self._last_event_id - settings.suppression_poll_lookback, 0)
+        while True:
+            async with db.async_session_maker() as session:
+                result = await session.execute(
+                    _unsubscribed(select(Event.id, Event.campaign_id, Event.email))
+                    .where(Event.id > cursor)
+                    .order_by(Event.id)
+                    .limit(settings.suppression_poll_batch)
+                )
+                rows = result.all()
+            for _, campaign_id, email in rows:
+                self.add(campaign_id, email)
+            if rows:
+                cursor = rows[-1].id
+            if len(rows) < settings.suppression_poll_batch:
+                break
+        self._last_event_id = max(self._last_event_id, cursor)
+
+        for hashes in self._sets.values():
+            if hashes.pending >= COMPACT_PENDING_SIZE:
+                await hashes.compact()
+
+    async def _run(self):
+        while not self.ready:
+            try:
+                await self.load()
+            except Exception:
+                logger.error("Failed to load suppression index, will retry", exc_info=True)
+                await asyncio.sleep(settings.suppression_poll_interval)
+        while True:
+            await asyncio.sleep(settings.suppression_poll_interval)
+            try:
+                await self.poll()
+            except Exception:
+                logger.warning("Suppression index poll failed", exc_info=True)
+
+
+suppression_index = SuppressionIndex()
+
+metrics.gauge(
+    "suppression_index_entries",
+    "Хэшей отписавшихся адресов в индексе",
+    lambda: {
+        ("global",): suppression_index.size("global"),
+        ("campaign",): suppression_index.size("campaign")
+    },
+    labels=("scope",)
+)
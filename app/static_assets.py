@@ -0,0 +1,74 @@
+"""
+Статические файлы с отпечатком содержимого в имени.
+
+При импорте для каждого файла каталога static считается хэш содержимого
+(манифест: styles.css -> styles.<hash>.css). Шаблоны ссылаются на файлы через
+static_url("styles.css"), поэтому адрес меняется вместе с содержимым, и такие
+ответы отдаются с Cache-Control immutable на год. Запросы по исходному имени
+отдаются с no-cache.
+"""
+
+import hashlib
+import logging
+from pathlib import Path
+from fastapi.staticfiles import StaticFiles
+from starlette.responses import Response
+from starlette.types import Scope
+
+logger = logging.getLogger(__name__)
+
+STATIC_DIR = "static"
+STATIC_URL_PREFIX = "/static/"
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class StaticManifest:
+    """Исходное имя файла -> имя с отпечатком и обратно"""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self._fingerprinted: dict[str, str] = {}
+        self._originals: dict[str, str] = {}
+        self.load()
+
+    def load(self):
+        self._fingerprinted = {}
+        self._originals = {}
+        if not self.directory.is_dir():
+            return
+        for path in sorted(self.directory.rglob("*")):
+            if not path.is_file():
+                continue
+            name = path.relative_to(self.directory).as_posix()
+            digest = hashlib.sha256(path.read_bytes()).hexdigest()[:12]
+            stem, dot, suffix = name.rpartition(".")
+            fingerprinted = f"{stem}.{digest}.{suffix}" if dot and "/" not in suffix else f"{name}.{digest}"
+            self._fingerprinted[name] = fingerprinted
+            self._originals[fingerprinted] = name
+        logger.info(f"Static manifest: {len(self._fingerprinted)} files")
+
+    def url(self, name: str) -> str:
+        """URL файла для шаблонов; неизвестные файлы — по исходному имени"""
+        return STATIC_URL_PREFIX + self._fingerprinted.get(name, name)
+
+    def original(self, path: str) -> str | None:
+        return self._originals.get(path)
+
+
+class FingerprintedStaticFiles(StaticFiles):
+    """StaticFiles, который понимает имена с отпечатком из манифеста"""
+
+    def __init__(self, *, directory: str, manifest: StaticManifest):
+        super().__init__(directory=directory)
+        self.manifest = manifest
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        original = self.manifest.original(path)
+        response = await super().get_response(original or path, scope)
+        if response.status_code in (200, 304):
+            response.headers["cache-control"] = IMMUTABLE_CACHE_CONTROL if original else "no-cache"
+        return response
+
+
+static_manifest = StaticManifest(STATIC_DIR)
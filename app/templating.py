@@ -0,0 +1,70 @@
+"""
+Общий экземпляр Jinja2 шаблонов для HTML роутеров.
+
+Скомпилированные шаблоны сохраняются в settings.template_cache_dir
+(байткод Jinja2), поэтому новые воркеры не компилируют их заново. Образ
+заполняет кэш при сборке: python -m app.templating. Устаревший байткод
+отбрасывается по контрольной сумме исходника шаблона.
+"""
+
+import logging
+from pathlib import Path
+from typing import Iterator
+from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache, Template
+from starlette.responses import Response, StreamingResponse
+from app.config import settings
+from app.static_assets import static_manifest
+
+logger = logging.getLogger(__name__)
+
+templates = Jinja2Templates(directory="app/templates")
+# Ссылки на статику с отпечатком содержимого: {{ static_url("styles.css") }}
+templates.env.globals["static_url"] = static_manifest.url
+
+if settings.template_cache_dir:
+    Path(settings.template_cache_dir).mkdir(parents=True, exist_ok=True)
+    templates.env.bytecode_cache = FileSystemBytecodeCache(settings.template_cache_dir)
+
+
+def render_table(name: str, context: dict, rows: int) -> Response:
+    """
+    Фрагмент с таблицей. Начиная с template_stream_min_rows строк шаблон
+    рендерится в пуле потоков и отдается кусками по мере рендера, так что
+    первые байты уходят клиенту раньше; небольшие таблицы отдаются обычным
+    TemplateResponse. Контекст должен быть загружен целиком: сессия БД
+    закрывается до начала отправки ответа.
+    """
+    if not settings.template_stream_min_rows or rows < settings.template_stream_min_rows:
+        return templates.TemplateResponse(name, context)
+    template = templates.get_template(name)
+    return StreamingResponse(_render_chunks(template, context), media_type="text/html; charset=utf-8")
+
+
+def _render_chunks(template: Template, context: dict) -> Iterator[str]:
+    """Склеивает мелкие куски Template.generate в куски template_stream_chunk_size"""
+    buffer: list[str] = []
+    size = 0
+    for piece in template.generate(context):
+        buffer.append(piece)
+        size += len(piece)
+        if size >= settings.template_stream_chunk_size:
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def precompile() -> int:
+    """Компилирует все шаблоны в кэш байткода, возвращает их число"""
+    names = templates.env.list_templates()
+    for name in names:
+        templates.env.get_template(name)
+    return len(names)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    count = precompile()
+    logger.info(f"Precompiled {count} templates into {settings.template_cache_dir}")
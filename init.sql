@@ -11,23 +11,43 @@ CREATE TABLE IF NOT EXISTS campaigns (
     id SERIAL PRIMARY KEY,
     name VARCHAR(255) NOT NULL,
     offer_url TEXT NOT NULL,
-    offer_id INTEGER REFERENCES offers(id),
-    created_at TIMESTAMP DEFAULT NOW()
+    offer_id INTEGER REFERENCES offers(id) ON DELETE CASCADE,
+    created_at TIMESTAMP DEFAULT NOW(),
+    deleted_at TIMESTAMP
 );
 
 -- Таблица событий
 CREATE TABLE IF NOT EXISTS events (
     id SERIAL PRIMARY KEY,
-    campaign_id INTEGER NOT NULL REFERENCES campaigns(id),
+    campaign_id INTEGER NOT NULL REFERENCES campaigns(id) ON DELETE CASCADE,
     event_type VARCHAR(50) NOT NULL,
     email VARCHAR(255) NOT NULL,
     domain VARCHAR(255) NOT NULL,
     ip VARCHAR(45),
     user_agent TEXT,
     extra_params JSONB,
+    event_key UUID,
+    is_bot BOOLEAN NOT NULL DEFAULT FALSE,
     created_at TIMESTAMP DEFAULT NOW()
 );
 
+-- Промежуточная таблица приема событий (EVENT_INGEST_MODE=staging).
+-- UNLOGGED: быстрее запись, но при аварийном перезапуске Postgres
+-- неперенесенные строки теряются; для надежности: ALTER TABLE events_staging SET LOGGED
+CREATE UNLOGGED TABLE IF NOT EXISTS events_staging (
+    id BIGSERIAL PRIMARY KEY,
+    campaign_id INTEGER NOT NULL,
+    event_type VARCHAR(50) NOT NULL,
+    email VARCHAR(255) NOT NULL,
+    domain VARCHAR(255) NOT NULL,
+    ip VARCHAR(45),
+    user_agent TEXT,
+    extra_params JSONB,
+    event_key UUID,
+    is_bot BOOLEAN NOT NULL DEFAULT FALSE,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
 -- Таблица для хранения количества отправленных писем по доменам в кампаниях
 CREATE TABLE IF NOT EXISTS campaign_domain_emails (
     id SERIAL PRIMARY KEY,
@@ -39,11 +59,185 @@ CREATE TABLE IF NOT EXISTS campaign_domain_emails (
     UNIQUE(campaign_id, domain)
 );
 
+-- HyperLogLog скетчи уникальных email: по кампании (domain = '') и по доменам кампании.
+-- complete в строке кампании: скетчи учитывают все ее события (кампания создана
+-- со скетчами или пересчитана задачей rebuild_sketches)
+CREATE TABLE IF NOT EXISTS campaign_sketches (
+    campaign_id INTEGER NOT NULL REFERENCES campaigns(id) ON DELETE CASCADE,
+    domain VARCHAR(255) NOT NULL DEFAULT '',
+    registers BYTEA NOT NULL,
+    complete BOOLEAN NOT NULL DEFAULT FALSE,
+    updated_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (campaign_id, domain)
+);
+
+-- Сжатые события (задача compact_events): дневные счетчики событий
+-- по (кампания, домен, тип) без учета ботов
+CREATE TABLE IF NOT EXISTS event_daily_counts (
+    campaign_id INTEGER NOT NULL REFERENCES campaigns(id) ON DELETE CASCADE,
+    domain VARCHAR(255) NOT NULL,
+    event_type VARCHAR(50) NOT NULL,
+    day DATE NOT NULL,
+    count BIGINT NOT NULL,
+    PRIMARY KEY (campaign_id, domain, event_type, day)
+);
+
+-- Сжатые события: путь каждого получателя кампании
+CREATE TABLE IF NOT EXISTS recipient_journeys (
+    campaign_id INTEGER NOT NULL REFERENCES campaigns(id) ON DELETE CASCADE,
+    email VARCHAR(255) NOT NULL,
+    domain VARCHAR(255) NOT NULL,
+    has_email_click BOOLEAN NOT NULL DEFAULT FALSE,
+    has_landing_click BOOLEAN NOT NULL DEFAULT FALSE,
+    has_conversion BOOLEAN NOT NULL DEFAULT FALSE,
+    has_unsubscribe BOOLEAN NOT NULL DEFAULT FALSE,
+    first_event TIMESTAMP NOT NULL,
+    PRIMARY KEY (campaign_id, email, domain)
+);
+
+-- Счетчики кампаний для списка на главной (без ботов, включая сжатые
+-- и архивные события). Пополняются сверткой campaign_counter_deltas
+CREATE TABLE IF NOT EXISTS campaign_counters (
+    campaign_id INTEGER PRIMARY KEY REFERENCES campaigns(id) ON DELETE CASCADE,
+    clicks BIGINT NOT NULL DEFAULT 0,
+    conversions BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- Приращения счетчиков от вставок в events (триггер events_campaign_counters);
+-- фоновый процесс сворачивает их в campaign_counters (app/services/campaign_counters.py)
+CREATE TABLE IF NOT EXISTS campaign_counter_deltas (
+    id BIGSERIAL PRIMARY KEY,
+    campaign_id INTEGER NOT NULL,
+    clicks BIGINT NOT NULL,
+    conversions BIGINT NOT NULL
+);
+
+-- Фоновые задачи обслуживания
+CREATE TABLE IF NOT EXISTS jobs (
+    id SERIAL PRIMARY KEY,
+    kind VARCHAR(50) NOT NULL,
+    params JSONB,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    progress BIGINT NOT NULL DEFAULT 0,
+    total BIGINT,
+    message TEXT,
+    error TEXT,
+    created_at TIMESTAMP DEFAULT NOW(),
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
 -- Индексы для производительности
 CREATE INDEX IF NOT EXISTS idx_events_campaign ON events(campaign_id);
 CREATE INDEX IF NOT EXISTS idx_events_email ON events(email);
 CREATE INDEX IF NOT EXISTS idx_events_domain ON events(domain);
 CREATE INDEX IF NOT EXISTS idx_events_created_at ON events(created_at);
+CREATE INDEX IF NOT EXISTS idx_events_campaign_created_at ON events(campaign_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_events_extra_params ON events USING GIN (extra_params jsonb_path_ops)
+    WHERE extra_params IS NOT NULL;
+-- Опрос новых отписок индексом проверки перед отправкой
+CREATE INDEX IF NOT EXISTS idx_events_unsubscribe ON events(id)
+    WHERE event_type = 'unsubscribe';
+CREATE INDEX IF NOT EXISTS idx_events_staging_campaign ON events_staging(campaign_id);
 CREATE INDEX IF NOT EXISTS idx_campaigns_offer ON campaigns(offer_id);
 CREATE INDEX IF NOT EXISTS idx_campaign_domain_emails_campaign ON campaign_domain_emails(campaign_id);
 CREATE INDEX IF NOT EXISTS idx_campaign_domain_emails_domain ON campaign_domain_emails(domain);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id);
+CREATE INDEX IF NOT EXISTS idx_campaigns_created_at ON campaigns(created_at, id);
+CREATE INDEX IF NOT EXISTS idx_campaign_counters_clicks ON campaign_counters(clicks, campaign_id);
+CREATE INDEX IF NOT EXISTS idx_campaign_counters_conversions ON campaign_counters(conversions, campaign_id);
+CREATE INDEX IF NOT EXISTS idx_campaign_counters_updated_at ON campaign_counters(updated_at);
+
+-- Миграции для баз, созданных предыдущими версиями init.sql
+ALTER TABLE campaigns ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP;
+ALTER TABLE events ADD COLUMN IF NOT EXISTS is_bot BOOLEAN NOT NULL DEFAULT FALSE;
+ALTER TABLE events ADD COLUMN IF NOT EXISTS event_key UUID;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_events_event_key ON events(event_key)
+    WHERE event_key IS NOT NULL;
+ALTER TABLE campaign_sketches ADD COLUMN IF NOT EXISTS complete BOOLEAN NOT NULL DEFAULT FALSE;
+
+-- Пересчет скетчей кампаний, у которых они заполнены не по всем событиям;
+-- до его окончания уникальные таких кампаний считаются точно
+INSERT INTO jobs (kind, params)
+SELECT 'rebuild_sketches', '{}'::jsonb
+WHERE EXISTS (
+    SELECT 1 FROM campaigns c
+    WHERE NOT EXISTS (
+        SELECT 1 FROM campaign_sketches s
+        WHERE s.campaign_id = c.id AND s.domain = '' AND s.complete
+    )
+) AND NOT EXISTS (
+    SELECT 1 FROM jobs WHERE kind = 'rebuild_sketches' AND status IN ('pending', 'running')
+);
+
+DO $$
+BEGIN
+    -- Внешние ключи с ON DELETE CASCADE: остаток событий удаляется вместе с кампанией
+    IF EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conname = 'events_campaign_id_fkey' AND confdeltype <> 'c'
+    ) THEN
+        ALTER TABLE events DROP CONSTRAINT events_campaign_id_fkey;
+        ALTER TABLE events ADD CONSTRAINT events_campaign_id_fkey
+            FOREIGN KEY (campaign_id) REFERENCES campaigns(id) ON DELETE CASCADE;
+    END IF;
+    IF EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conname = 'campaigns_offer_id_fkey' AND confdeltype <> 'c'
+    ) THEN
+        ALTER TABLE campaigns DROP CONSTRAINT campaigns_offer_id_fkey;
+        ALTER TABLE campaigns ADD CONSTRAINT campaigns_offer_id_fkey
+            FOREIGN KEY (offer_id) REFERENCES offers(id) ON DELETE CASCADE;
+    END IF;
+END $$;
+
+-- Приращения счетчиков кампаний одной командой на каждый INSERT в events
+-- (пачка записи, воспроизведение журнала, перенос из events_staging).
+-- Только вставка в campaign_counter_deltas: транзакция приема не блокирует
+-- строку счетчиков, ее обновляет свертка. Удаления из events (сжатие,
+-- архив) счетчики не уменьшают: события переносятся, а не пропадают
+CREATE OR REPLACE FUNCTION bump_campaign_counters() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO campaign_counter_deltas (campaign_id, clicks, conversions)
+    SELECT campaign_id,
+           count(*) FILTER (WHERE event_type IN ('email_click', 'landing_click')),
+           count(*) FILTER (WHERE event_type = 'conversion')
+    FROM new_events
+    WHERE NOT is_bot AND event_type IN ('email_click', 'landing_click', 'conversion')
+    GROUP BY campaign_id;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    -- Первичное заполнение счетчиков и создание триггера в одной транзакции:
+    -- блокировка events не дает событиям попасть между подсчетом и триггером
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'events_campaign_counters') THEN
+        LOCK TABLE events IN SHARE ROW EXCLUSIVE MODE;
+        INSERT INTO campaign_counters (campaign_id, clicks, conversions)
+        SELECT c.id, COALESCE(SUM(n.clicks), 0), COALESCE(SUM(n.conversions), 0)
+        FROM campaigns c
+        LEFT JOIN (
+            SELECT campaign_id,
+                   count(*) FILTER (WHERE event_type IN ('email_click', 'landing_click')) AS clicks,
+                   count(*) FILTER (WHERE event_type = 'conversion') AS conversions
+            FROM events
+            WHERE NOT is_bot
+            GROUP BY campaign_id
+            UNION ALL
+            SELECT campaign_id,
+                   SUM(count) FILTER (WHERE event_type IN ('email_click', 'landing_click')),
+                   SUM(count) FILTER (WHERE event_type = 'conversion')
+            FROM event_daily_counts
+            GROUP BY campaign_id
+        ) n ON n.campaign_id = c.id
+        GROUP BY c.id
+        ON CONFLICT (campaign_id) DO NOTHING;
+        CREATE TRIGGER events_campaign_counters
+            AFTER INSERT ON events
+            REFERENCING NEW TABLE AS new_events
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_campaign_counters();
+    END IF;
+END $$;